@@ -12,6 +12,9 @@ git fetch origin "$BRANCH"
 git checkout "$BRANCH" || git checkout -b "$BRANCH" "origin/$BRANCH"
 git pull --ff-only origin "$BRANCH"
 
+# Vendor front-end assets before syncing (rsync --delete would drop them)
+./vendor_assets.sh || echo "Warning: vendoring assets failed" >&2
+
 # Print the current version
 echo "Deploying version $(cat VERSION)"
 
@@ -27,6 +30,34 @@ if ! sudo -n true; then
   echo "Error: sudo privileges are required to restart bt-web" >&2
   exit 1
 fi
+
+# Install the unit files so webhook-updated Pis pick up unit changes (socket
+# activation, StateDirectory=, KillMode=). The webhook secret that install.sh
+# wrote into the installed service is carried over; put other local changes
+# in a drop-in (systemctl edit bt-web).
+# (no tracing here: the secret must not end up in the deploy output)
+set +x
+SECRET_LINE=$(grep -m1 '^Environment=GITHUB_WEBHOOK_SECRET=' /etc/systemd/system/bt-web.service || true)
+UNIT_TMP=$(mktemp)
+cp bt-web.service "$UNIT_TMP"
+if [[ -n "$SECRET_LINE" ]]; then
+  sed -i "s|^# Environment=GITHUB_WEBHOOK_SECRET=your-hash|$SECRET_LINE|" "$UNIT_TMP"
+fi
+sudo install -m 644 "$UNIT_TMP" /etc/systemd/system/bt-web.service
+sudo install -m 644 bt-web.socket /etc/systemd/system/bt-web.socket
+rm -f "$UNIT_TMP"
+unset SECRET_LINE
+set -x
 sudo systemctl daemon-reload
-sudo systemctl restart bt-web
+
+# This restart also ends this script (it runs inside the service's cgroup).
+# The first time, the socket can only bind once the old process has let go
+# of port 8080, so both restart in one transaction; after that the socket
+# stays up and keeps its backlog.
+if systemctl is-active --quiet bt-web.socket; then
+  sudo systemctl restart bt-web
+else
+  sudo systemctl enable bt-web.socket
+  sudo systemctl restart bt-web.socket bt-web
+fi
 sudo systemctl status bt-web --no-pager
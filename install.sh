@@ -15,6 +15,7 @@ fi
 REPO_URL=${REPO_URL:-https://github.com/Muppet1856/BluetoothWebsite.git}
 DEST=/opt/bt-web
 SERVICE=/etc/systemd/system/bt-web.service
+SOCKET=/etc/systemd/system/bt-web.socket
 
 # Prompt for optional GitHub webhook passphrase and hash it
 WEBHOOK_SECRET_HASH=""
@@ -34,7 +35,7 @@ fi
 
 apt update
 apt full-upgrade -y
-apt install -y bluetooth bluez bluez-tools bluez-alsa-utils alsa-utils python3-flask git
+apt install -y bluetooth bluez bluez-tools bluez-alsa-utils alsa-utils python3-flask python3-brotli git curl
 
 rfkill unblock bluetooth
 systemctl enable --now bluetooth
@@ -45,16 +46,20 @@ else
   git -C "$DEST" pull --ff-only
 fi
 
+"$DEST/vendor_assets.sh" || echo "Warning: could not vendor front-end assets" >&2
+
 if ! id -u bt-web >/dev/null 2>&1; then
   adduser --system --group bt-web
 fi
 chown -R bt-web:bt-web "$DEST"
 
 cp "$DEST/bt-web.service" "$SERVICE"
+cp "$DEST/bt-web.socket" "$SOCKET"
 if [[ -n "$WEBHOOK_SECRET_HASH" ]]; then
   sed -i "s|# Environment=GITHUB_WEBHOOK_SECRET=your-hash|Environment=GITHUB_WEBHOOK_SECRET=$WEBHOOK_SECRET_HASH|" "$SERVICE"
 fi
 systemctl daemon-reload
+systemctl enable --now bt-web.socket
 systemctl enable --now bt-web
 
 echo "\nDeployment complete. Service status:"
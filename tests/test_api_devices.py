@@ -49,10 +49,8 @@ def test_api_devices_logs_dropped(monkeypatch, capsys):
 
     flask_stub.request.args = {"audio_only": "1"}
     resp = app.api_devices()
-    assert resp == {
-        "devices": [],
-        "dropped": [{"mac": "AA:BB:CC:DD:EE:FF", "name": "Thing", "class": "0x1234"}],
-    }
+    assert resp["devices"] == []
+    assert resp["dropped"] == [{"mac": "AA:BB:CC:DD:EE:FF", "name": "Thing", "class": "0x1234"}]
     out = capsys.readouterr().out
     assert "AA:BB:CC:DD:EE:FF" in out
     assert "Thing" in out
@@ -97,4 +95,4 @@ def test_unpaired_removed_when_scan_off(monkeypatch):
     monkeypatch.setattr(app, "is_audio_capable", lambda info: True)
 
     resp = app.api_devices()
-    assert resp == {"devices": []}
+    assert resp["devices"] == [] and "dropped" not in resp
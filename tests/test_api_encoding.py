@@ -0,0 +1,167 @@
+import copy
+import gzip
+import importlib.util
+import json
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def _devices(n=30):
+    return [{
+        "mac": f"AA:00:00:00:00:{i:02X}",
+        "name": f"Speaker {i}",
+        "alias": None,
+        "type": "public",
+        "identity": None,
+        "paired": i % 3 == 0,
+        "trusted": i % 3 == 0,
+        "connected": i == 0,
+        "class": "0x240404",
+        "uuids": ["Audio Sink                (0000110b-0000-1000-8000-00805f9b34fb)"],
+        "caps": ["a2dp_sink", "audio", "audio_video"],
+        "rssi": -50 - i,
+        "last_seen": 1000.0 + i,
+    } for i in range(n)]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    payload = {"devices": _devices()}
+    snapshot = copy.deepcopy(payload)
+    monkeypatch.setattr(app, "SINGLE_FLIGHT", {})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": True, "start_ts": 0})
+    monkeypatch.setattr(app, "device_list_payload", lambda audio_only, caps: payload)
+
+    def call(route="api_devices", **args):
+        monkeypatch.setattr(app, "request", types.SimpleNamespace(args=args))
+        return getattr(app, route)()
+
+    yield call
+    # Projections are copies; the shared snapshot stays complete
+    assert payload == snapshot
+
+
+def test_parse_fields():
+    assert app.parse_fields(None, app.DEVICE_FIELDS) is None
+    assert app.parse_fields(" , ", app.DEVICE_FIELDS) is None
+    assert app.parse_fields("name, mac,name", app.DEVICE_FIELDS) == ("name", "mac")
+    with pytest.raises(ValueError, match="unknown field: caps"):
+        app.parse_fields("paired,caps", app.INFO_FIELDS)
+
+
+def test_devices_projection(api):
+    page = api(fields="mac,connected", limit="5")
+    assert page["devices"][0] == {"mac": "AA:00:00:00:00:00", "connected": True}
+    assert all(set(d) == {"mac", "connected"} for d in page["devices"])
+    assert page["total"] == 30 and page["next_cursor"]
+    # The cursor does not depend on the projection
+    nxt = api(fields="mac", limit="5", cursor=page["next_cursor"])
+    assert nxt["devices"] == [{"mac": d["mac"]} for d in api(limit="10")["devices"][5:]]
+
+
+def test_devices_rows(api):
+    full = api(limit="8")
+    rows = api(limit="8", fields="mac,name,paired", format="rows")
+    assert "devices" not in rows and rows["fields"] == ["mac", "name", "paired"]
+    assert rows["next_cursor"] == full["next_cursor"] and rows["total"] == 30
+    assert rows["rows"] == [[d["mac"], d["name"], d["paired"]] for d in full["devices"]]
+    # Without fields every projectable key is sent, in DEVICE_FIELDS order
+    every = api(limit="8", format="ROWS")
+    assert every["fields"] == list(app.DEVICE_FIELDS)
+    assert [dict(zip(every["fields"], r)) for r in every["rows"]] == full["devices"]
+
+
+@pytest.mark.parametrize("args, error", [
+    ({"fields": "mac,colour"}, "unknown field: colour"),
+    ({"format": "xml"}, "format must be one of objects, rows"),
+])
+def test_devices_bad_encoding_is_400(api, args, error):
+    body, status = api(**args)
+    assert status == 400 and body == {"ok": False, "error": error}
+
+
+def test_info_projection(api, monkeypatch):
+    info = {k: v for k, v in _devices(1)[0].items() if k in app.INFO_FIELDS}
+    monkeypatch.setattr(app, "get_info", lambda mac: info)
+    assert api("api_info", mac="AA:00:00:00:00:00") == info
+    assert api("api_info", mac="AA:00:00:00:00:00", fields="connected,alias") == {
+        "connected": True, "alias": None}
+    body, status = api("api_info", mac="AA:00:00:00:00:00", fields="mac")
+    assert status == 400 and body["error"] == "unknown field: mac"
+
+
+class FakeResponse:
+    def __init__(self, body, mimetype="application/json", status_code=200):
+        self.body = body
+        self.mimetype = mimetype
+        self.status_code = status_code
+        self.direct_passthrough = False
+        self.headers = {}
+
+    def get_data(self):
+        return self.body
+
+    def set_data(self, body):
+        self.body = body
+
+
+def _compress(monkeypatch, resp, accept="gzip, deflate, br"):
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(headers={"Accept-Encoding": accept}))
+    return app.compress_json(resp)
+
+
+def test_large_json_is_gzipped(monkeypatch):
+    body = json.dumps({"devices": _devices()}).encode()
+    resp = _compress(monkeypatch, FakeResponse(body))
+    assert resp.headers == {"Vary": "Accept-Encoding", "Content-Encoding": "gzip"}
+    assert gzip.decompress(resp.body) == body and len(resp.body) < len(body) // 4
+
+
+@pytest.mark.parametrize("resp, accept", [
+    (FakeResponse(b'{"ok": true}'), "gzip"),                          # under the threshold
+    (FakeResponse(b"x" * 4096), "identity"),                          # not accepted
+    (FakeResponse(b"x" * 4096), "gzip;q=0"),
+    (FakeResponse(b"x" * 4096, status_code=500), "gzip"),
+])
+def test_json_sent_as_is(monkeypatch, resp, accept):
+    body = resp.body
+    out = _compress(monkeypatch, resp, accept)
+    assert out.body == body and out.headers == {"Vary": "Accept-Encoding"}
+
+
+def test_non_json_untouched(monkeypatch):
+    resp = FakeResponse(b"<p>" * 1000, mimetype="text/html")
+    assert _compress(monkeypatch, resp).headers == {}
+    resp = FakeResponse(b"x" * 4096)
+    resp.headers["Content-Encoding"] = "br"
+    assert _compress(monkeypatch, resp).body == b"x" * 4096
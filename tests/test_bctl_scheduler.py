@@ -0,0 +1,139 @@
+import importlib.util
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+@pytest.fixture
+def sched(monkeypatch):
+    monkeypatch.setattr(app, "BCTL_SCHED", {"queue": [], "running": 0, "seq": 0})
+    monkeypatch.setattr(app, "BCTL_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(
+        app, "BCTL_STATS",
+        {n: {"runs": 0, "cancelled": 0, "wait_total": 0.0, "wait_max": 0.0} for n in app.PRIO_NAMES.values()},
+    )
+    return app
+
+
+def _wait_queued(n):
+    for _ in range(200):
+        if len(app.BCTL_SCHED["queue"]) >= n:
+            return
+        time.sleep(0.01)
+    raise AssertionError("workers never queued")
+
+
+def _worker(priority, order):
+    def run():
+        try:
+            with app.bctl_priority(priority), app.bctl_slot():
+                order.append(app.PRIO_NAMES[priority])
+        except app.BctlCancelled:
+            order.append("cancelled")
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+
+def test_interactive_runs_before_background(sched):
+    order = []
+    app._bctl_acquire(app.PRIO_REFRESH)  # occupy the only slot
+    threads = [_worker(app.PRIO_IDENTITY, order)]
+    _wait_queued(1)
+    threads.append(_worker(app.PRIO_REFRESH, order))
+    _wait_queued(2)
+    threads.append(_worker(app.PRIO_INTERACTIVE, order))
+    _wait_queued(3)
+    app._bctl_release()
+    for t in threads:
+        t.join(2)
+    assert order == ["interactive", "refresh", "identity"]
+    stats = app.bctl_stats()
+    assert stats["running"] == 0 and stats["queued"] == 0
+    assert stats["interactive"]["runs"] == 1
+
+
+def test_interactive_route_cancels_queued_identity_work(sched):
+    order = []
+    app._bctl_acquire(app.PRIO_REFRESH)
+    t = _worker(app.PRIO_IDENTITY, order)
+    _wait_queued(1)
+    app.interactive(lambda: None)()
+    t.join(2)
+    app._bctl_release()
+    assert order == ["cancelled"]
+    assert app.BCTL_STATS["identity"]["cancelled"] == 1
+
+
+def test_stale_low_priority_call_times_out(sched, monkeypatch):
+    monkeypatch.setitem(app.BCTL_MAX_WAIT, app.PRIO_IDENTITY, 0.05)
+    app._bctl_acquire(app.PRIO_REFRESH)
+    with pytest.raises(app.BctlCancelled):
+        with app.bctl_priority(app.PRIO_IDENTITY), app.bctl_slot():
+            pass
+    app._bctl_release()
+    assert app.BCTL_SCHED["queue"] == []
+
+
+def test_nested_calls_reuse_the_held_slot(sched, monkeypatch):
+    calls = []
+
+    def fake_run(cmd, *a, **k):
+        calls.append(cmd)
+        return types.SimpleNamespace(returncode=0, stdout=b"Controller 00:11:22:33:44:55 pi\n", stderr=b"")
+
+    monkeypatch.setattr(app.subprocess, "run", fake_run)
+    monkeypatch.setattr(app, "ADAPTER_CACHE", {"mac": None, "ts": 0.0})
+    rc, out, _ = app.run_bctl(["show"])  # run_bctl -> _get_adapter_mac nests
+    assert rc == 0
+    assert len(calls) == 2
+    assert app.BCTL_SCHED["running"] == 0
+
+
+@pytest.mark.parametrize("route, args", [
+    ("api_devices", {"audio_only": "1"}),
+    ("api_info", {"mac": "AA:00:00:00:00:01"}),
+    ("api_scan_status", {}),
+])
+def test_poll_route_answers_503_when_dropped(sched, monkeypatch, route, args):
+    monkeypatch.setitem(app.BCTL_MAX_WAIT, app.PRIO_REFRESH, 0.05)
+    monkeypatch.setattr(app, "SINGLE_FLIGHT", {})
+    monkeypatch.setattr(app, "ADAPTER_CACHE", {"mac": None, "ts": 0.0})
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(args=args))
+    app._bctl_acquire(app.PRIO_INTERACTIVE)  # a long connect holds the only slot
+    try:
+        assert getattr(app, route)() == ({"ok": False, "error": "busy"}, 503, {"Retry-After": "2"})
+    finally:
+        app._bctl_release()
+    assert app.BCTL_STATS["refresh"]["cancelled"] == 1
@@ -0,0 +1,181 @@
+import importlib.util
+import sys
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+SPEAKER = {
+    "class": "0x00240414",
+    "uuids": [
+        "Audio Sink                (0000110b-0000-1000-8000-00805f9b34fb)",
+        "A/V Remote Control        (0000110e-0000-1000-8000-00805f9b34fb)",
+    ],
+}
+PHONE = {
+    "class": "0x005a020c",
+    "uuids": [
+        "Audio Source              (0000110a-0000-1000-8000-00805f9b34fb)",
+        "Handsfree Audio Gateway   (0000111f-0000-1000-8000-00805f9b34fb)",
+    ],
+}
+
+
+def test_capabilities_from_class_and_uuids():
+    caps = app.device_capabilities(SPEAKER)
+    assert {"audio_video", "loudspeaker", "svc_audio", "svc_rendering",
+            "a2dp_sink", "avrcp", "audio"} <= caps
+    assert "audio" not in app.device_capabilities(PHONE)
+    assert "phone" in app.device_capabilities(PHONE)
+
+
+def test_a2dp_sink_uuid_alone_is_audio():
+    info = {"class": None, "uuids": ["Audio Sink (0000110b-0000-1000-8000-00805f9b34fb)"]}
+    assert app.is_audio_capable(info)
+    le = {"uuids": ["Unknown (00001850-0000-1000-8000-00805f9b34fb)"]}
+    assert app.device_capabilities(le) == {"le_audio"}
+
+
+def test_parse_caps():
+    assert app.parse_caps(" A2DP_Sink ,avrcp") == {"a2dp_sink", "avrcp"}
+    assert app.parse_caps("") == frozenset()
+    with pytest.raises(ValueError):
+        app.parse_caps("a2dp_sink,teleport")
+
+
+def _setup(monkeypatch, args):
+    monkeypatch.setattr(app, "SINGLE_FLIGHT", {})
+    monkeypatch.setattr(app, "CAPS_INDEX", {})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": True, "start_ts": 0})
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(args=args))
+    monkeypatch.setattr(app, "list_devices", lambda: [
+        {"mac": "AA:00:00:00:00:01", "name": "Speaker", "type": "public"},
+        {"mac": "AA:00:00:00:00:02", "name": "Phone", "type": "public"},
+    ])
+    infos = {"AA:00:00:00:00:01": SPEAKER, "AA:00:00:00:00:02": PHONE}
+    calls = []
+
+    def fake_info(mac):
+        calls.append(mac)
+        info = {"paired": False, "connected": False, "trusted": False, "alias": None, **infos[mac]}
+        app.index_capabilities(mac, info)
+        return info
+
+    monkeypatch.setattr(app, "get_info", fake_info)
+    return calls
+
+
+def test_caps_filter_uses_index(monkeypatch):
+    calls = _setup(monkeypatch, {"caps": "a2dp_sink"})
+    res = app.api_devices()
+    assert [d["mac"] for d in res["devices"]] == ["AA:00:00:00:00:01"]
+    assert "a2dp_sink" in res["devices"][0]["caps"]
+    assert sorted(calls) == ["AA:00:00:00:00:01", "AA:00:00:00:00:02"]
+
+    # Second pass: the phone is ruled out by the index without bluetoothctl
+    calls.clear()
+    app.SINGLE_FLIGHT.clear()
+    res = app.api_devices()
+    assert [d["mac"] for d in res["devices"]] == ["AA:00:00:00:00:01"]
+    assert calls == ["AA:00:00:00:00:01"]
+
+
+def test_audio_only_skips_indexed_non_audio(monkeypatch):
+    calls = _setup(monkeypatch, {"audio_only": "1"})
+    app.index_capabilities("AA:00:00:00:00:02", {**PHONE, "paired": False})
+    res = app.api_devices()
+    assert calls == ["AA:00:00:00:00:01"]
+    assert res["dropped"][0]["mac"] == "AA:00:00:00:00:02"
+
+
+def test_stale_index_entry_is_rechecked(monkeypatch):
+    calls = _setup(monkeypatch, {"audio_only": "1"})
+    app.index_capabilities("AA:00:00:00:00:02", {**PHONE, "paired": False})
+    app.CAPS_INDEX["AA:00:00:00:00:02"]["ts"] = time.time() - app.CAPS_INDEX_TTL - 1
+    app.api_devices()
+    assert "AA:00:00:00:00:02" in calls
+
+
+def test_unknown_caps_is_400(monkeypatch):
+    _setup(monkeypatch, {"caps": "bogus"})
+    body, code = app.api_devices()
+    assert code == 400 and body["ok"] is False
+
+
+def test_index_entry_without_class_or_uuids_is_rechecked(monkeypatch):
+    calls = _setup(monkeypatch, {"audio_only": "1"})
+    # Indexed from the first advertisement, before BlueZ knew the Class
+    app.index_capabilities("AA:00:00:00:00:01", {"class": None, "uuids": [], "paired": False})
+    assert not app._index_caps_known(app.CAPS_INDEX["AA:00:00:00:00:01"])
+    # By the next poll the Class has arrived
+    res = app.api_devices()
+    assert [d["mac"] for d in res["devices"]] == ["AA:00:00:00:00:01"]
+    assert "AA:00:00:00:00:01" in calls
+    assert app.CAPS_INDEX["AA:00:00:00:00:01"]["has_class"] is True
+
+
+def test_class_only_entry_cannot_rule_out_uuid_caps(monkeypatch):
+    calls = _setup(monkeypatch, {"caps": "a2dp_sink"})
+    # An A/V speaker whose UUIDs BlueZ has not learnt yet
+    app.index_capabilities("AA:00:00:00:00:01", {"class": SPEAKER["class"], "uuids": []})
+    res = app.api_devices()
+    assert "AA:00:00:00:00:01" in calls
+    assert [d["mac"] for d in res["devices"]] == ["AA:00:00:00:00:01"]
+
+    # ...but a Class-derived tag it lacks does rule it out
+    calls = _setup(monkeypatch, {"caps": "phone"})
+    app.index_capabilities("AA:00:00:00:00:01", {"class": SPEAKER["class"], "uuids": []})
+    app.api_devices()
+    assert "AA:00:00:00:00:01" not in calls
+
+
+def test_audio_only_keeps_class_only_non_av_device(monkeypatch):
+    calls = _setup(monkeypatch, {"audio_only": "1"})
+    # Computer-class A2DP sink, indexed before its UUIDs were known
+    app.index_capabilities("AA:00:00:00:00:01", {"class": "0x0c010c", "uuids": []})
+    infos = {"AA:00:00:00:00:01": {"class": "0x0c010c", "uuids": SPEAKER["uuids"]},
+             "AA:00:00:00:00:02": PHONE}
+    monkeypatch.setattr(app, "get_info", lambda mac: calls.append(mac) or {
+        "paired": False, "connected": False, "trusted": False, "alias": None, **infos[mac]})
+    res = app.api_devices()
+    assert "AA:00:00:00:00:01" in calls
+    assert [d["mac"] for d in res["devices"]] == ["AA:00:00:00:00:01"]
+
+
+def test_resolved_services_without_uuids_rule_out(monkeypatch):
+    out = "Device AA:00:00:00:00:01 (public)\n\tClass: 0x00240414\n\tServicesResolved: yes\n"
+    monkeypatch.setattr(app, "CAPS_INDEX", {})
+    monkeypatch.setattr(app, "run_bctl", lambda cmds, timeout=30: (0, out, ""))
+    app.get_info("AA:00:00:00:00:01")
+    entry = app.CAPS_INDEX["AA:00:00:00:00:01"]
+    assert entry["has_uuids"] and not app._index_may_match(entry, False, {"a2dp_sink"})
+    # Its A/V class still makes it an audio device
+    assert app._index_may_match(entry, True, frozenset())
@@ -36,3 +36,9 @@ clean_for_js = app.clean_for_js
 def test_preserves_ansi_escape():
     sample = "\x1b[31mRed\x1b[0m\n"
     assert clean_for_js(sample) == sample
+
+
+def test_matches_reference_filter():
+    sample = "".join(chr(c) for c in range(0x300)) + "\r\n\x00é→"
+    ref = "".join(ch for ch in sample if ch in ("\n", "\t", "\x1b") or ord(ch) >= 0x20)
+    assert clean_for_js(sample) == ref
@@ -0,0 +1,146 @@
+import copy
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def _devices(n=250):
+    out = []
+    for i in range(n):
+        out.append({
+            "mac": f"AA:00:00:00:{i // 256:02X}:{i % 256:02X}",
+            "name": f"{'Speaker' if i % 2 else 'phone'} {i:03d}",
+            "alias": None,
+            "connected": i % 50 == 0,
+            "paired": i % 10 == 0,
+            "trusted": i % 10 == 0,
+            "rssi": None if i % 7 == 0 else -40 - i % 60,
+            "last_seen": 1000.0 + (i * 37) % 250,
+        })
+    return out
+
+
+@pytest.fixture
+def api(monkeypatch):
+    payload = {"devices": _devices(), "dropped": [{"mac": "BB", "name": "x", "class": None}]}
+    monkeypatch.setattr(app, "SINGLE_FLIGHT", {})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": True, "start_ts": 0})
+    monkeypatch.setattr(app, "device_list_payload", lambda audio_only, caps: payload)
+
+    def call(**args):
+        monkeypatch.setattr(app, "request", types.SimpleNamespace(args=args))
+        return app.api_devices()
+
+    return payload, call
+
+
+@pytest.mark.parametrize("sort", app.DEVICE_SORTS)
+def test_pages_cover_sorted_list(api, sort):
+    payload, call = api
+    expected = sorted(payload["devices"], key=lambda d: app._device_sort_key(sort, d))
+    got, cursor = [], None
+    while True:
+        args = {"sort": sort, "limit": "40"}
+        if cursor:
+            args["cursor"] = cursor
+        page = call(**args)
+        assert len(page["devices"]) <= 40 and page["total"] == 250
+        got += page["devices"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert [d["mac"] for d in got] == [d["mac"] for d in expected]
+
+
+def test_default_order_and_limit(api):
+    payload, call = api
+    page = call()
+    assert len(page["devices"]) == app.DEVICE_PAGE_DEFAULT
+    assert page["devices"][0]["connected"]
+    assert page["dropped"]
+    # later pages leave out the drop report
+    assert "dropped" not in call(cursor=page["next_cursor"])
+
+
+def test_rssi_and_last_seen_orders(api):
+    _, call = api
+    rssi = [d["rssi"] for d in call(sort="rssi", limit="500")["devices"]]
+    known = [r for r in rssi if r is not None]
+    assert known == sorted(known, reverse=True)
+    assert rssi[-1] is None
+    seen = [d["last_seen"] for d in call(sort="last_seen", limit="500")["devices"]]
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_prefix_search(api):
+    _, call = api
+    page = call(q="speaker 01", sort="name")
+    assert [d["name"] for d in page["devices"]] == [f"Speaker {i:03d}" for i in range(11, 20, 2)]
+    page = call(q="aa:00:00:00:00:0")
+    assert page["total"] == 16
+    page = call(q="PHONE", limit="3")
+    assert page["total"] == 125 and len(page["devices"]) == 3
+    rest = call(q="PHONE", limit="500", cursor=page["next_cursor"])
+    assert len(rest["devices"]) == 122
+
+
+def test_payload_not_mutated(api):
+    payload, call = api
+    before = copy.deepcopy(payload)
+    for sort in app.DEVICE_SORTS:
+        call(sort=sort, limit="7", q="s")
+    assert payload == before
+
+
+@pytest.mark.parametrize("args", [
+    {"limit": "0"}, {"limit": "many"}, {"limit": str(app.DEVICE_PAGE_MAX + 1)},
+    {"sort": "color"}, {"cursor": "###"},
+    {"cursor": app.encode_cursor("name", ("x", "AA")), "sort": "rssi"},
+    {"cursor": app.encode_cursor("rssi", ("x", "y")), "sort": "rssi"},
+    {"cursor": app.encode_cursor("rssi", (None,)), "sort": "rssi"},
+    {"cursor": app.encode_cursor("rssi", ([50], "AA")), "sort": "rssi"},
+    {"cursor": app.encode_cursor("rssi", (50, "AA", "x")), "sort": "rssi"},
+    {"cursor": app.encode_cursor("connected", (0, 0, 0, "n", "AA")), "sort": "connected"},
+])
+def test_bad_paging_is_400(api, args):
+    _, call = api
+    body, code = call(**args)
+    assert code == 400 and body["ok"] is False
+
+
+def test_get_info_reads_rssi(monkeypatch):
+    out = "Device AA:00:00:00:00:01 (public)\n\tName: X\n\tRSSI: 0xffffffc4 (-60)\n"
+    monkeypatch.setattr(app, "run_bctl", lambda cmds, timeout=30: (0, out, ""))
+    assert app.get_info("AA:00:00:00:00:01")["rssi"] == -60
+    monkeypatch.setattr(app, "run_bctl", lambda cmds, timeout=30: (0, "\tRSSI: -71\n", ""))
+    assert app.get_info("AA:00:00:00:00:01")["rssi"] == -71
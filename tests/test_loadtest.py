@@ -0,0 +1,69 @@
+import importlib.util
+import os
+import sys
+import types
+from pathlib import Path
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+ROOT = Path(__file__).resolve().parents[1]
+
+spec = importlib.util.spec_from_file_location("app", ROOT / "web-bt" / "app.py")
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+spec = importlib.util.spec_from_file_location("loadtest", ROOT / "tools" / "loadtest.py")
+loadtest = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(loadtest)
+
+
+def test_percentiles_and_summary():
+    rec = loadtest.Recorder()
+    for i in range(1, 101):
+        rec.add("GET /api/devices", i / 1000.0, ok=(i != 50))
+    report = loadtest.summarize(rec, elapsed=10.0)
+    route = report["routes"]["GET /api/devices"]
+    assert route["count"] == 100
+    assert route["errors"] == 1
+    assert route["rps"] == 10.0
+    assert (route["p50_ms"], route["p95_ms"], route["p99_ms"]) == (50.0, 95.0, 99.0)
+    assert report["requests"] == 100
+
+
+def test_fake_bluetoothctl_output_parses(monkeypatch, tmp_path):
+    monkeypatch.setenv("PATH", str(ROOT / "tools" / "fake-bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_BCTL_DEVICES", "3")
+    monkeypatch.setenv("FAKE_BCTL_DELAY", "0")
+    monkeypatch.setenv("FAKE_BCTL_STATE", str(tmp_path / "state.json"))
+    monkeypatch.setattr(app, "ADAPTER_CACHE", {"mac": None, "ts": 0.0})
+
+    devices = app.list_devices()
+    assert [d["mac"] for d in devices] == ["7E:00:00:00:00:02", "AA:00:00:00:00:00", "AA:00:00:00:00:01"]
+
+    info = app.get_info("7E:00:00:00:00:02")
+    assert info["identity"] == "AA:00:00:00:00:02"
+    assert app.is_audio_capable(info)
+
+    app.run_bctl(["pair AA:00:00:00:00:00", "trust AA:00:00:00:00:00"])
+    info = app.get_info("AA:00:00:00:00:00")
+    assert info["paired"] and info["trusted"] and not info["connected"]
+    assert app.ADAPTER_CACHE["mac"] == "00:11:22:33:44:55"
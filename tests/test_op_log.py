@@ -0,0 +1,88 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def _reset(monkeypatch, maxlen=500):
+    monkeypatch.setattr(app, "OP_LOG", app.deque(maxlen=maxlen))
+    monkeypatch.setattr(app, "OP_LOG_STATE", {"seq": 0, "boot": "b1"})
+
+
+def test_log_since_returns_only_new_entries(monkeypatch):
+    _reset(monkeypatch)
+    app.log_step("pair-ok")
+    app.log_append("bad\x07 bell")
+    entries, head, reset = app.log_since(0)
+    assert [e["seq"] for e in entries] == [1, 2]
+    assert entries[1]["text"] == "bad bell"
+    assert head == 2 and reset is False
+
+    app.log_step("scan-off")
+    entries, head, reset = app.log_since(2)
+    assert [e["seq"] for e in entries] == [3]
+    assert app.log_since(3) == ([], 3, False)
+
+
+def test_log_since_flags_evicted_cursor(monkeypatch):
+    _reset(monkeypatch, maxlen=2)
+    for i in range(5):
+        app.log_append(f"line {i}")
+    entries, head, reset = app.log_since(1)
+    assert reset is True
+    assert [e["seq"] for e in entries] == [4, 5]
+    # A cursor from before a server restart is ahead of the buffer.
+    assert app.log_since(99)[2] is True
+
+
+def test_api_logs_uses_cursor(monkeypatch):
+    _reset(monkeypatch)
+    app.log_append("one")
+    app.log_append("two")
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(args={"cursor": "1"}))
+    resp = app.api_logs()
+    assert [e["text"] for e in resp["entries"]] == ["two"]
+    assert resp["cursor"] == 2
+    assert resp["boot"] == "b1" and resp["reset"] is False
+
+
+def test_cursor_from_previous_process_resets(monkeypatch):
+    # The new process has already logged past the old client's cursor
+    _reset(monkeypatch)
+    for i in range(5):
+        app.log_append(f"new {i}")
+    entries, head, reset = app.log_since(3, "b0")
+    assert reset is True and head == 5
+    assert [e["text"] for e in entries] == [f"new {i}" for i in range(5)]
+    assert app.log_since(3, "b1") == (list(app.OP_LOG)[3:], 5, False)
+
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(args={"cursor": "3", "boot": "b0"}))
+    resp = app.api_logs()
+    assert resp["reset"] is True and len(resp["entries"]) == 5 and resp["boot"] == "b1"
@@ -0,0 +1,96 @@
+import copy
+import importlib.util
+import json
+import os
+import sys
+import types
+from pathlib import Path
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+ROOT = Path(__file__).resolve().parents[1]
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+TRANSCRIPT = str(FIXTURES / "bluetoothctl-session.jsonl.gz")
+
+spec = importlib.util.spec_from_file_location("app", ROOT / "web-bt" / "app.py")
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+spec = importlib.util.spec_from_file_location("replay", ROOT / "tools" / "replay.py")
+replay = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(replay)
+
+EXPECTED = json.loads((FIXTURES / "bluetoothctl-session.expected.json").read_text())
+
+
+def test_recorded_session_matches_expectations():
+    report = replay.run(app, replay.load_transcript(TRANSCRIPT))
+    assert replay.check(report, EXPECTED) == []
+    # colored prompts, [CHG] noise and multi-line values do not hide devices
+    assert report["stages"]["scan"]["lines"] > report["stages"]["scan"]["device_lines"]
+    info = report["results"]["info"]
+    assert info["4C:87:5D:2A:10:01"]["rssi"] == -63
+    assert info["7B:2E:91:0C:44:06"]["identity"] == "D0:8A:55:12:34:56"
+
+
+def test_accelerated_replay_keeps_results_and_budget():
+    report = replay.run(app, replay.load_transcript(TRANSCRIPT), speed=60.0)
+    assert replay.check(report, EXPECTED) == []
+    st = report["stages"]["scan"]
+    # the recorded ~18 s of scan output is paced, not dumped at once
+    assert st["seconds"] >= 0.2 and st["processing_s"] < st["seconds"]
+
+
+def test_check_reports_regressions():
+    report = replay.run(app, replay.load_transcript(TRANSCRIPT))
+    expected = copy.deepcopy(EXPECTED)
+    expected["results"]["info"]["4C:87:5D:2A:10:01"]["paired"] = False
+    expected["budgets"]["devices"] = 0.0
+    failures = replay.check(report, expected)
+    assert any(f.startswith("info:") for f in failures)
+    assert any(f.startswith("devices:") and "budget" in f for f in failures)
+
+
+def test_capture_round_trip(monkeypatch, tmp_path):
+    monkeypatch.setenv("PATH", str(ROOT / "tools" / "fake-bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_BCTL_DEVICES", "3")
+    monkeypatch.setenv("FAKE_BCTL_DELAY", "0")
+    monkeypatch.setenv("FAKE_BCTL_STATE", str(tmp_path / "state.json"))
+    monkeypatch.setattr(app, "ADAPTER_CACHE", {"mac": None, "ts": 0.0})
+    path = str(tmp_path / "capture.jsonl.gz")
+    assert app.capture_start(path)
+    try:
+        live = app.get_info("7E:00:00:00:00:02")
+    finally:
+        app.capture_stop()
+
+    transcript = replay.load_transcript(path)
+    roles = [s["role"] for s in transcript["sessions"]]
+    assert roles == ["show", "run"]
+    run = transcript["sessions"][1]
+    assert "info 7E:00:00:00:00:02" in run["in"][0][1] and run["exit"][1] == 0
+
+    rp = replay.Replay(transcript)
+    monkeypatch.setattr(app, "_captured_run", rp.run)
+    monkeypatch.setattr(app, "ADAPTER_CACHE", {"mac": None, "ts": 0.0})
+    assert app.get_info("7E:00:00:00:00:02") == live
+    assert rp.misses == []
@@ -0,0 +1,139 @@
+import importlib.util
+import io
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+class FakeProc:
+    def __init__(self):
+        self.stdin = io.BytesIO()
+
+    def poll(self):
+        return None
+
+    def sent(self):
+        return self.stdin.getvalue().decode().splitlines()
+
+
+@pytest.fixture
+def scanner(monkeypatch):
+    p = FakeProc()
+    monkeypatch.setattr(app, "SCAN_PROC", {"p": p, "adapter": None, "t": None})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": True, "start_ts": 1000.0})
+    monkeypatch.setattr(app, "AUDIO_TRANSPORTS", {})
+    # the watchdog has its own tests
+    monkeypatch.setattr(app, "_scan_watchdog", lambda now: 5.0)
+    monkeypatch.setattr(app, "SCAN_DUTY", {
+        **app.SCAN_DUTY, "window": None, "interval": None, "idle_timeout": None,
+        "cycle_start": 1000.0, "last_client": 1000.0, "pauses": {}, "holds": {},
+        "discovering": True, "auto_stopped": None, "thread": None,
+    })
+    return p
+
+
+def test_parse_scan_duty(monkeypatch):
+    monkeypatch.delenv("BT_WEB_SCAN_IDLE_TIMEOUT", raising=False)
+    assert app.parse_scan_duty({}) == {"window": None, "interval": None,
+                                       "idle_timeout": app.SCAN_IDLE_TIMEOUT}
+    assert app.parse_scan_duty({"window": "10", "interval": "60", "idle_timeout": "0"}) == {
+        "window": 10.0, "interval": 60.0, "idle_timeout": None}
+    # a window as long as the interval is continuous scanning
+    assert app.parse_scan_duty({"window": 5, "interval": 5})["window"] is None
+    for bad in ({"window": "10"}, {"window": 30, "interval": 10},
+                {"window": "x", "interval": 10}, {"window": 0.1, "interval": 10},
+                {"idle_timeout": -1}):
+        with pytest.raises(ValueError):
+            app.parse_scan_duty(bad)
+
+
+def test_duty_cycle_toggles_discovery(scanner):
+    app.SCAN_DUTY.update(window=10.0, interval=30.0)
+    assert app._scan_tick(1005.0) == pytest.approx(5.0)
+    assert scanner.sent() == []
+    assert app._scan_tick(1012.0) == pytest.approx(5.0)
+    assert scanner.sent() == ["scan off"]
+    app._scan_tick(1031.0)
+    assert scanner.sent() == ["scan off", "scan on"]
+
+
+def test_pause_and_hold(scanner):
+    with app.scan_paused("connect"):
+        assert app.scan_duty_status()["paused"] == ["connect"]
+        with app.scan_held("pair"):
+            pass
+    assert scanner.sent() == ["scan off", "scan on", "scan off", "scan on"]
+    assert app.scan_duty_status()["paused"] == []
+
+
+def test_pause_leaves_unwanted_scanner_alone(scanner):
+    app.SCAN_STATE["wanted"] = False
+    with app.scan_paused("connect"):
+        pass
+    assert scanner.sent() == []
+
+
+def test_streaming_transport_pauses_discovery(scanner, monkeypatch):
+    path = b"/org/bluez/hci0/dev_AA_00_00_00_00_01/sep1/fd0"
+    lines = [
+        b"[\x1b[0;93mCHG\x1b[0m] Transport " + path + b" State: active\n",
+        b"[\x1b[0;93mCHG\x1b[0m] Device AA:00:00:00:00:01 RSSI: -60\n",
+    ]
+    monkeypatch.setattr(app, "_apply_scan_updates", lambda macs, now: None)
+    app._scan_reader(iter(lines))
+    assert app.audio_streaming()
+    assert scanner.sent() == ["scan off"]
+    assert app.scan_duty_status()["paused"] == ["audio"]
+
+    app._scan_reader(iter([b"[\x1b[0;91mDEL\x1b[0m] Transport " + path + b"\n"]))
+    assert not app.audio_streaming()
+    assert scanner.sent() == ["scan off", "scan on"]
+
+
+def test_idle_auto_stop(scanner, monkeypatch):
+    stopped = []
+    monkeypatch.setattr(app, "_stop_persistent_scan", lambda: stopped.append(1))
+    app.SCAN_DUTY["idle_timeout"] = 60.0
+    assert app._scan_tick(1030.0) == pytest.approx(5.0)
+    assert app._scan_tick(1058.0) == pytest.approx(2.0)
+    assert app._scan_tick(1061.0) is None
+    assert stopped == [1]
+    assert app.SCAN_STATE["wanted"] is False
+    assert app.SCAN_DUTY["auto_stopped"]["reason"] == "idle"
+
+
+def test_client_polls_keep_scan_alive(scanner, monkeypatch):
+    monkeypatch.setattr(app, "device_list_payload", lambda audio_only, caps: {"devices": []})
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(args={}))
+    app.SCAN_DUTY["last_client"] = 0.0
+    app.api_devices()
+    assert app.SCAN_DUTY["last_client"] > 1000.0
@@ -0,0 +1,105 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def test_parse_scan_filter_accepts_all_fields():
+    flt = app.parse_scan_filter(
+        {"transport": "LE", "rssi": "-70", "uuids": "110B,0000110e-0000-1000-8000-00805f9b34fb", "duplicate_data": "0"}
+    )
+    assert flt == {
+        "transport": "le",
+        "rssi": -70,
+        "uuids": ["110b", "0000110e-0000-1000-8000-00805f9b34fb"],
+        "duplicate_data": False,
+    }
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{"transport": "usb"}, {"rssi": "loud"}, {"rssi": "-200"}, {"uuids": "not-a-uuid"}],
+)
+def test_parse_scan_filter_rejects_bad_input(params):
+    with pytest.raises(ValueError):
+        app.parse_scan_filter(params)
+
+
+def test_scan_filter_cmds_use_menu_scan():
+    flt = {"transport": "le", "rssi": -70, "uuids": ["110b"], "duplicate_data": False}
+    assert app.scan_filter_cmds(flt) == [
+        "menu scan", "clear", "transport le", "rssi -70", "uuids 110b", "duplicate-data off", "back",
+    ]
+
+
+def test_scan_on_rejects_bad_filter(monkeypatch):
+    started = []
+    monkeypatch.setattr(app, "_start_persistent_scan", lambda: started.append(1))
+    monkeypatch.setattr(app, "_request_params", lambda: {"transport": "usb"})
+    app.SCAN_STATE["wanted"] = False
+    resp, code = app.api_scan_on()
+    assert code == 400
+    assert resp["ok"] is False
+    assert started == []
+    assert app.SCAN_STATE["wanted"] is False
+
+
+def test_scan_reader_counts_lines(monkeypatch):
+    monkeypatch.setattr(app, "get_info", lambda mac: {})
+    app._reset_scan_stats(keep_previous=False)
+    app._scan_reader([
+        "[NEW] Device AA:BB:CC:DD:EE:FF Foo\n",
+        "Discovery started\n",
+        "[CHG] Device AA:BB:CC:DD:EE:FF RSSI: -60\n",
+    ])
+    rate = app.scan_rate()
+    assert rate["lines"] == 3
+    assert rate["matched"] == 2
+
+
+def test_restart_with_same_filter_keeps_previous(monkeypatch):
+    monkeypatch.setattr(app, "get_info", lambda mac: {})
+    monkeypatch.setattr(app, "SCAN_FILTER", dict(app.SCAN_FILTER, transport="auto"))
+    monkeypatch.setattr(app, "SCAN_STATS", dict(app.SCAN_STATS))
+    app._reset_scan_stats(keep_previous=False)
+    app._scan_reader(["[NEW] Device AA:BB:CC:DD:EE:FF Foo\n"] * 4)
+    # Filter change: the auto-transport window becomes "previous"
+    app.SCAN_FILTER.update(transport="le")
+    app._reset_scan_stats()
+    assert app.SCAN_STATS["previous"]["lines"] == 4
+    assert app.SCAN_STATS["previous"]["filter"]["transport"] == "auto"
+    # Scanner restarts under the same filter start a fresh window only
+    app._scan_reader(["[CHG] Device AA:BB:CC:DD:EE:FF RSSI: -60\n"])
+    app._reset_scan_stats()
+    app._reset_scan_stats()
+    assert app.SCAN_STATS["previous"]["lines"] == 4
+    assert app.SCAN_STATS["lines"] == 0 and app.SCAN_STATS["filter"]["transport"] == "le"
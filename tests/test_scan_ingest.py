@@ -0,0 +1,114 @@
+import importlib.util
+import io
+import sys
+import threading
+import types
+from pathlib import Path
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def _fresh(monkeypatch, lookups):
+    monkeypatch.setattr(app, "LAST_SEEN", {})
+    monkeypatch.setattr(app, "IDENTITY_CACHE", {})
+    monkeypatch.setattr(app, "get_info", lambda mac: lookups.append(mac) or {"identity": None})
+    app._reset_scan_stats(keep_previous=False)
+
+
+def test_lines_split_across_chunks(monkeypatch):
+    lookups = []
+    _fresh(monkeypatch, lookups)
+    chunks = [b"[NEW] Device AA:BB:CC:", b"DD:EE:FF Foo\n[CHG] Dev", b"ice 11:22:33:44:55:66 RSSI: -50\n"]
+    app._scan_reader(chunks)
+    assert set(app.LAST_SEEN) == {"AA:BB:CC:DD:EE:FF", "11:22:33:44:55:66"}
+    assert app.SCAN_STATS["lines"] == 2
+
+
+def test_repeat_sightings_coalesce(monkeypatch):
+    lookups = []
+    _fresh(monkeypatch, lookups)
+    monkeypatch.setattr(app, "SCAN_READ_SIZE", 64)
+    monkeypatch.setattr(app, "SCAN_COALESCE_WINDOW", 60.0)
+    line = b"[\x1b[0;93mCHG\x1b[0m] Device AA:BB:CC:DD:EE:FF RSSI: -60\n"
+    data = line * 50 + b"[CHG] Device 11:22:33:44:55:66 ManufacturerData Key: 0x004c\n  02 15 aa\n"
+    app._scan_reader(io.BufferedReader(io.BytesIO(data), 64))
+    assert app.identity_drain(5)
+    stats = app.scan_rate()
+    assert stats["lines"] == 52
+    assert stats["matched"] == 51
+    assert stats["updates"] < 10
+    assert sorted(set(lookups)) == ["11:22:33:44:55:66", "AA:BB:CC:DD:EE:FF"]
+    assert len(lookups) == 2
+
+
+def test_identity_address_marked_seen(monkeypatch):
+    _fresh(monkeypatch, [])
+    monkeypatch.setattr(app, "get_info", lambda mac: {"identity": "BB:BB:BB:BB:BB:01"})
+    app._scan_reader([b"[NEW] Device 7E:00:00:00:00:01 Foo"])  # no trailing newline
+    assert app.identity_drain(5)
+    assert "BB:BB:BB:BB:BB:01" in app.LAST_SEEN
+    assert "7E:00:00:00:00:01" in app.LAST_SEEN
+
+
+def test_identity_lookups_do_not_block_the_reader(monkeypatch):
+    lookups = []
+    _fresh(monkeypatch, lookups)
+    release = threading.Event()
+
+    def slow_info(mac):
+        lookups.append(mac)
+        release.wait(5)
+        return {"identity": "BB:BB:BB:BB:BB:0" + mac[-1]}
+
+    monkeypatch.setattr(app, "get_info", slow_info)
+    lines = [b"[CHG] Device 7E:00:00:00:00:0%d RSSI: -60\n" % (i % 3) for i in range(30)]
+    app._scan_reader(lines)
+    # The reader finished while the first lookup is still stuck in bluetoothctl
+    assert set(app.LAST_SEEN) == {"7E:00:00:00:00:00", "7E:00:00:00:00:01", "7E:00:00:00:00:02"}
+    assert app.identity_status()["backlog"] == 3
+    release.set()
+    assert app.identity_drain(5)
+    assert sorted(lookups) == ["7E:00:00:00:00:00", "7E:00:00:00:00:01", "7E:00:00:00:00:02"]
+    assert "BB:BB:BB:BB:BB:02" in app.LAST_SEEN
+
+    # Fresh cache entries are used directly; nothing is queued again
+    app._scan_reader([b"[CHG] Device 7E:00:00:00:00:01 RSSI: -50\n"])
+    assert app.identity_status()["backlog"] == 0
+    assert len(lookups) == 3
+
+
+def test_failed_identity_lookup_is_retried(monkeypatch):
+    _fresh(monkeypatch, [])
+
+    def broken(mac):
+        raise RuntimeError("bluetoothctl failed")
+
+    monkeypatch.setattr(app, "get_info", broken)
+    app._scan_reader([b"[NEW] Device 7E:00:00:00:00:01 Foo\n"])
+    assert app.identity_drain(5)
+    assert "7E:00:00:00:00:01" not in app.IDENTITY_CACHE
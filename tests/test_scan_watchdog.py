@@ -0,0 +1,224 @@
+import importlib.util
+import os
+import sys
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+ROOT = Path(__file__).resolve().parents[1]
+spec = importlib.util.spec_from_file_location("app", ROOT / "web-bt" / "app.py")
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+class FakeProc:
+    def __init__(self):
+        self.sent = []
+        self.killed = False
+        self.stdin = self
+        self.last_output = time.time()
+
+    def write(self, data):
+        self.sent.append(data.decode().strip())
+
+    def flush(self):
+        pass
+
+    def poll(self):
+        return 1 if self.killed else None
+
+    def kill(self):
+        self.killed = True
+
+    def wait(self, timeout=None):
+        return 1
+
+
+@pytest.fixture
+def watch(monkeypatch):
+    now = time.time()
+    p = FakeProc()
+    p.last_output = now
+    monkeypatch.setattr(app, "SCAN_PROC", {"p": p, "adapter": None, "t": None})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": True, "start_ts": now})
+    monkeypatch.setattr(app, "SCAN_WATCH", {**app.SCAN_WATCH, "started": now,
+                                            "eof": None, "probe_sent": 0.0, "down_since": None,
+                                            "restarts": 0, "exits": 0, "hangs": 0, "failures": 0,
+                                            "heartbeats": 0, "downtime": 0.0, "last_restart": None})
+    monkeypatch.setattr(app, "OP_LOG", app.deque(maxlen=50))
+    started = []
+
+    def fake_start():
+        started.append(FakeProc())
+        app.SCAN_PROC["p"] = started[-1]
+        app.SCAN_WATCH.update(started=time.time(), eof=None, probe_sent=0.0)
+
+    monkeypatch.setattr(app, "_start_persistent_scan", fake_start)
+    return now, p, started
+
+
+def test_reader_eof_restarts(watch):
+    now, p, started = watch
+    app.SCAN_WATCH["eof"] = now - 1.5
+    app._scan_watchdog(now)
+    assert p.killed and len(started) == 1
+    st = app.scan_watch_status()
+    assert (st["restarts"], st["exits"], st["hangs"], st["down"]) == (1, 1, 0, False)
+    assert st["downtime_s"] >= 1.5
+    assert st["last_restart"]["reason"] == "exit"
+    assert "scanner-restart" in app.OP_LOG[-1]["text"]
+
+
+def test_quiet_session_gets_heartbeat(watch):
+    now, p, started = watch
+    assert app._scan_watchdog(now + 1) == pytest.approx(app.SCAN_HEARTBEAT_IDLE - 1)
+    assert app._scan_watchdog(now + app.SCAN_HEARTBEAT_IDLE) == app.SCAN_HEARTBEAT_TIMEOUT
+    assert p.sent == ["version"]
+    # output after the probe means the session is alive
+    p.last_output = now + app.SCAN_HEARTBEAT_IDLE + 0.1
+    app._scan_watchdog(now + app.SCAN_HEARTBEAT_IDLE + 1)
+    assert app.SCAN_WATCH["probe_sent"] == 0.0 and not started
+
+
+def test_unanswered_heartbeat_is_a_hang(watch):
+    now, p, started = watch
+    t = now + app.SCAN_HEARTBEAT_IDLE
+    app._scan_watchdog(t)
+    assert app._scan_watchdog(t + 1) == pytest.approx(app.SCAN_HEARTBEAT_TIMEOUT - 1)
+    assert not started
+    app._scan_watchdog(t + app.SCAN_HEARTBEAT_TIMEOUT)
+    assert p.killed and len(started) == 1
+    st = app.scan_watch_status()
+    assert st["hangs"] == 1 and st["last_restart"]["reason"] == "hang"
+
+
+def test_output_of_replaced_session_does_not_answer_probe(watch, monkeypatch):
+    now, p, started = watch
+    monkeypatch.setattr(app, "_apply_scan_updates", lambda macs, now: None)
+    p.last_output = quiet = now - app.SCAN_HEARTBEAT_IDLE
+    app._scan_watchdog(now)
+    assert p.sent == ["version"]
+    # the killed session's reader is still draining its pipe after the probe
+    old = FakeProc()
+    old.stdout = iter([b"[CHG] Device AA:BB:CC:DD:EE:FF RSSI: -60\n"])
+    app._scan_reader_main(old)
+    assert old.last_output >= now and p.last_output == quiet
+    app._scan_watchdog(now + app.SCAN_HEARTBEAT_TIMEOUT)
+    assert p.killed and app.scan_watch_status()["hangs"] == 1
+
+
+def test_slow_identity_lookup_does_not_stall_liveness(watch, monkeypatch):
+    now, p, started = watch
+    release = app.threading.Event()
+    monkeypatch.setattr(app, "get_info", lambda mac: release.wait(5) and {})
+    monkeypatch.setattr(app, "IDENTITY_CACHE", {})
+    try:
+        app._scan_reader([b"[NEW] Device 7E:00:00:00:00:01 Foo\n"] * 3, session=p)
+        assert p.last_output >= now
+        assert app._scan_watchdog(p.last_output + 1) > 0 and not p.sent
+    finally:
+        release.set()
+        app.identity_drain(5)
+
+
+def test_failed_restarts_back_off(watch, monkeypatch):
+    now, p, started = watch
+    monkeypatch.setattr(app, "_start_persistent_scan", lambda: (_ for _ in ()).throw(OSError("gone")))
+    p.kill()
+    waits = [app._scan_watchdog(now) for _ in range(6)]
+    assert waits == [1.0, 2.0, 4.0, 5.0, 5.0, 5.0]
+    st = app.scan_watch_status()
+    assert st["down"] and st["exits"] == 1 and st["failed_starts"] == 6
+
+
+def test_eof_of_replaced_session_is_ignored(watch):
+    now, p, started = watch
+    old = FakeProc()
+    old.stdout = iter([])
+    app._scan_reader_main(old)
+    assert app.SCAN_WATCH["eof"] is None
+    p.stdout = iter([])
+    app._scan_reader_main(p)
+    assert app.SCAN_WATCH["eof"] is not None
+
+
+def test_no_restart_after_scan_off(watch):
+    now, p, started = watch
+    # /api/scan_off lands between _scan_tick's wanted check and the watchdog
+    app.SCAN_STATE["wanted"] = False
+    app.SCAN_PROC["p"] = None
+    app._scan_watchdog(now)
+    assert not started and app.SCAN_PROC["p"] is None
+    assert app.scan_watch_status()["restarts"] == 0
+
+
+def test_no_restart_during_shutdown(watch, monkeypatch):
+    now, p, started = watch
+    monkeypatch.setattr(app, "SHUTTING_DOWN", app.threading.Event())
+    monkeypatch.setattr(app, "_stop_persistent_scan", lambda: app.SCAN_PROC.update(p=None))
+    # atexit cleanup keeps wanted=True for the snapshot
+    app._cleanup()
+    assert app.SCAN_STATE["wanted"] and app.SHUTTING_DOWN.is_set()
+    app._scan_watchdog(now)
+    assert not started and app.SCAN_PROC["p"] is None
+
+
+def test_init_replays_agent_and_filter(monkeypatch):
+    monkeypatch.setattr(app, "SCAN_FILTER", {"transport": "le", "rssi": None, "uuids": [],
+                                             "duplicate_data": None})
+    cmds = app.scan_init_cmds("00:11:22:33:44:55")
+    assert cmds[0] == "select 00:11:22:33:44:55"
+    assert {"agent NoInputNoOutput", "default-agent", "pairable on", "transport le"} <= set(cmds)
+    assert cmds[-1] == "scan on"
+
+
+def test_killed_bluetoothctl_is_restarted(monkeypatch, tmp_path):
+    monkeypatch.setenv("PATH", str(ROOT / "tools" / "fake-bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_BCTL_DEVICES", "3")
+    monkeypatch.setenv("FAKE_BCTL_DELAY", "0")
+    monkeypatch.setenv("FAKE_BCTL_SCAN_RATE", "0")
+    monkeypatch.setenv("FAKE_BCTL_STATE", str(tmp_path / "state.json"))
+    monkeypatch.setattr(app, "SCAN_PROC", {"p": None, "adapter": None, "t": None})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": True, "start_ts": time.time()})
+    monkeypatch.setattr(app, "SCAN_WATCH", dict(app.SCAN_WATCH, restarts=0, exits=0, downtime=0.0))
+    monkeypatch.setattr(app, "LAST_SEEN", {})
+    monkeypatch.setattr(app, "IDENTITY_CACHE", {})
+    try:
+        app._start_persistent_scan()
+        assert app._wait_scanner_ready()
+        first = app.SCAN_PROC["p"]
+        first.kill()
+        deadline = time.time() + 5
+        while app.SCAN_WATCH["eof"] is None and time.time() < deadline:
+            time.sleep(0.02)
+        app._scan_watchdog(time.time())
+        second = app.SCAN_PROC["p"]
+        assert second is not first and second.poll() is None
+        assert app._wait_scanner_ready()
+        assert app.scan_watch_status()["restarts"] == 1
+    finally:
+        monkeypatch.setattr(app, "SCAN_STATE", {"wanted": False, "start_ts": 0})
+        app._stop_persistent_scan()
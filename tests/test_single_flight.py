@@ -0,0 +1,121 @@
+import importlib.util
+import sys
+import threading
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def _reset(monkeypatch):
+    monkeypatch.setattr(app, "SINGLE_FLIGHT", {})
+    monkeypatch.setattr(app, "SINGLE_FLIGHT_STATS", {"hits": 0, "misses": 0, "shared": 0})
+
+
+def test_concurrent_callers_share_one_call(monkeypatch):
+    _reset(monkeypatch)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return {"devices": []}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(app.single_flight("k", slow)))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    while app.SINGLE_FLIGHT_STATS["shared"] < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"devices": []}] * 5
+    assert app.SINGLE_FLIGHT_STATS == {"hits": 0, "misses": 1, "shared": 4}
+
+
+def test_result_reused_within_ttl_and_invalidated(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+    fn = lambda: calls.append(1) or len(calls)
+    assert app.single_flight("k", fn) == 1
+    assert app.single_flight("k", fn) == 1
+    assert app.SINGLE_FLIGHT_STATS["hits"] == 1
+    assert app.single_flight("k", fn, ttl=0) == 2
+    app.single_flight_invalidate()
+    assert app.single_flight("k", fn) == 3
+
+
+def test_errors_are_not_cached(monkeypatch):
+    _reset(monkeypatch)
+
+    def boom():
+        raise RuntimeError("bluetoothctl")
+
+    with pytest.raises(RuntimeError):
+        app.single_flight("k", boom)
+    assert app.single_flight("k", lambda: "ok") == "ok"
+
+
+def test_api_info_coalesced_per_mac(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+    monkeypatch.setattr(app, "get_info", lambda mac: calls.append(mac) or {"mac": mac})
+    for mac in ("AA:00:00:00:00:01", "aa:00:00:00:00:01", "BB:00:00:00:00:02"):
+        monkeypatch.setattr(app, "request", types.SimpleNamespace(args={"mac": mac}))
+        app.api_info()
+    assert calls == ["AA:00:00:00:00:01", "BB:00:00:00:00:02"]
+    assert app.api_stats()["single_flight"]["hits"] == 1
+
+
+@pytest.mark.parametrize("mac", ["", "AA", "AA:00:00:00:00:0G", "AA:00:00:00:00:01\nquit",
+                                 "AA:00:00:00:00:01\n"])
+def test_api_info_rejects_bad_mac(monkeypatch, mac):
+    _reset(monkeypatch)
+    monkeypatch.setattr(app, "get_info", lambda mac: pytest.fail("get_info called"))
+    monkeypatch.setattr(app, "request", types.SimpleNamespace(args={"mac": mac}))
+    assert app.api_info() == ({"ok": False, "error": "invalid mac"}, 400)
+    assert app.SINGLE_FLIGHT == {}
+
+
+def test_expired_slots_are_pruned(monkeypatch):
+    _reset(monkeypatch)
+    for i in range(50):
+        app.single_flight(("info", i), lambda: i, ttl=0.0)
+    # Only the latest finished slot is left; the others expired
+    assert list(app.SINGLE_FLIGHT) == [("info", 49)]
+    app.single_flight("fresh", lambda: 1, ttl=60)
+    app.single_flight("next", lambda: 2, ttl=60)
+    assert set(app.SINGLE_FLIGHT) == {"fresh", "next"}
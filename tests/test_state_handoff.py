@@ -0,0 +1,90 @@
+import importlib.util
+import json
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def _fresh(monkeypatch):
+    monkeypatch.setattr(app, "LAST_SEEN", {})
+    monkeypatch.setattr(app, "IDENTITY_CACHE", {})
+    monkeypatch.setattr(app, "SCAN_STATE", {"wanted": False, "start_ts": 0})
+    monkeypatch.setattr(app, "ADAPTER_CACHE", {"mac": None, "ts": 0.0})
+
+
+def test_state_round_trip(monkeypatch, tmp_path):
+    path = str(tmp_path / "state.json")
+    _fresh(monkeypatch)
+    now = app.time.time()
+    app.LAST_SEEN["AA:AA"] = now
+    app.IDENTITY_CACHE["AA:AA"] = ("BB:BB", now)
+    app.SCAN_STATE.update(wanted=True, start_ts=now - 5)
+    app.ADAPTER_CACHE.update(mac="00:11:22:33:44:55", ts=now)
+    app.save_state(path)
+
+    _fresh(monkeypatch)
+    assert app.load_state(path) is True
+    assert app.LAST_SEEN == {"AA:AA": now}
+    assert app.IDENTITY_CACHE == {"AA:AA": ("BB:BB", now)}
+    assert app.SCAN_STATE["wanted"] is True
+    assert app.ADAPTER_CACHE["mac"] == "00:11:22:33:44:55"
+
+
+def test_stale_or_missing_snapshot_is_ignored(monkeypatch, tmp_path):
+    _fresh(monkeypatch)
+    assert app.load_state(str(tmp_path / "missing.json")) is False
+    path = tmp_path / "old.json"
+    path.write_text(json.dumps({"ts": 0, "scan_state": {"wanted": True}}))
+    assert app.load_state(str(path)) is False
+    assert app.SCAN_STATE["wanted"] is False
+
+
+def test_systemd_listen_fd(monkeypatch):
+    monkeypatch.setenv("LISTEN_FDS", "1")
+    monkeypatch.setenv("LISTEN_PID", str(app.os.getpid()))
+    assert app._systemd_listen_fd() == 3
+    monkeypatch.setenv("LISTEN_PID", "1")
+    assert app._systemd_listen_fd() is None
+    monkeypatch.delenv("LISTEN_FDS")
+    assert app._systemd_listen_fd() is None
+
+
+@pytest.mark.parametrize("family, host", [("AF_INET", "0.0.0.0"), ("AF_INET6", "::")])
+def test_listen_host_follows_inherited_socket(family, host):
+    fam = getattr(app.socket, family)
+    try:
+        s = app.socket.socket(fam, app.socket.SOCK_STREAM)
+    except OSError:
+        pytest.skip(f"{family} not available")
+    with s:
+        assert app._listen_host(s.fileno()) == host
+    assert app._listen_host(None) == "0.0.0.0"
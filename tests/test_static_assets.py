@@ -0,0 +1,143 @@
+import gzip
+import importlib.util
+import re
+import shutil
+import subprocess
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# Minimal Flask stub
+flask_stub = types.ModuleType("flask")
+
+class _Flask:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def route(self, *args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    get = route
+    post = route
+
+flask_stub.Flask = _Flask
+flask_stub.jsonify = lambda obj=None, **k: obj
+flask_stub.request = types.SimpleNamespace(args={})
+flask_stub.render_template = lambda *a, **k: None
+sys.modules.setdefault("flask", flask_stub)
+
+spec = importlib.util.spec_from_file_location(
+    "app", Path(__file__).resolve().parents[1] / "web-bt" / "app.py"
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+class FakeResponse:
+    def __init__(self, body=b"", status=200, mimetype=None):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.headers = {}
+
+
+def _setup(monkeypatch, tmp_path, accept="gzip, br"):
+    (tmp_path / "vendor").mkdir(exist_ok=True)
+    (tmp_path / "script.js").write_text("console.log('hi');\n" * 50)
+    (tmp_path / "vendor" / "lib.min.css").write_text("body{margin:0}")
+    (tmp_path / "notes.txt").write_text("ignored")
+    monkeypatch.setattr(app, "ASSETS", {"by_name": None, "by_path": {}})
+    monkeypatch.setattr(app.app, "response_class", FakeResponse, raising=False)
+    monkeypatch.setattr(
+        app, "request", types.SimpleNamespace(args={}, headers={"Accept-Encoding": accept})
+    )
+    return app.build_assets(str(tmp_path))
+
+
+def test_build_assets_fingerprints_js_and_css(monkeypatch, tmp_path):
+    assets = _setup(monkeypatch, tmp_path)
+    assert sorted(assets) == ["script.js", "vendor/lib.min.css"]
+    url = app.asset_url("vendor/lib.min.css")
+    assert url.startswith("/assets/vendor/lib.min.") and url.endswith(".css")
+    assert app.asset_url("missing.css", "https://cdn.example/x.css") == "https://cdn.example/x.css"
+
+
+def test_asset_served_precompressed_and_immutable(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path, accept="gzip;q=1.0, br;q=0")
+    path = app.asset_url("script.js")[len("/assets/"):]
+    resp = app.static_asset(path)
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "immutable" in resp.headers["Cache-Control"]
+    assert gzip.decompress(resp.body) == (tmp_path / "script.js").read_bytes()
+
+
+def test_sidecars_used_and_the_rest_compressed_on_request(monkeypatch, tmp_path):
+    body = "console.log('hi');\n" * 50
+    (tmp_path / "script.js.gz").write_bytes(gzip.compress(body.encode(), 9, mtime=0))
+    (tmp_path / "vendor").mkdir(exist_ok=True)
+    (tmp_path / "vendor" / "lib.min.css.gz").write_bytes(gzip.compress(b"stale"))
+    assets = _setup(monkeypatch, tmp_path, accept="gzip")
+    assert assets["script.js"]["gzip"] == (tmp_path / "script.js.gz").read_bytes()
+    # Stale sidecar ignored; nothing is compressed at start-up
+    assert assets["vendor/lib.min.css"]["gzip"] is None
+    resp = app.static_asset(app.asset_url("vendor/lib.min.css")[len("/assets/"):])
+    assert gzip.decompress(resp.body) == b"body{margin:0}"
+    assert assets["vendor/lib.min.css"]["gzip"] is not None
+
+
+def test_unknown_asset_is_404(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    resp, code = app.static_asset("script.deadbeef0000.js")
+    assert code == 404
+
+
+def test_pick_encoding():
+    variants = {"identity": b"x", "gzip": b"g", "br": None}
+    assert app.pick_encoding("br, gzip", variants) == "gzip"
+    assert app.pick_encoding("gzip;q=0", variants) == "identity"
+    assert app.pick_encoding("", variants) == "identity"
+
+
+def test_index_rendered_once(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path, accept="")
+    calls = []
+
+    def fake_render(name, **ctx):
+        calls.append(ctx["version"])
+        return "<html>" + ctx["asset_url"]("script.js") + "</html>"
+
+    monkeypatch.setattr(app, "render_template", fake_render)
+    monkeypatch.setattr(app, "INDEX_CACHE", {"html": None, "gzip": None, "etag": None})
+    first = app.index()
+    second = app.index()
+    assert len(calls) == 1
+    assert first.body == second.body
+    assert b"/assets/script." in first.body
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    app.request.headers["If-None-Match"] = first.headers["ETag"]
+    assert app.index().status == 304
+
+
+STATIC = Path(__file__).resolve().parents[1] / "web-bt" / "static"
+
+
+def test_log_renderer_escapes_html():
+    # Device names reach the log box through insertAdjacentHTML
+    js = (STATIC / "script.js").read_text()
+    assert re.search(r"new AnsiToHtml\(\{\s*escapeXML: true\s*\}\)", js)
+    if not shutil.which("node"):
+        pytest.skip("node is not installed")
+    check = (
+        "const A = require(process.argv[1]);"
+        "process.stdout.write(new A({escapeXML: true}).toHtml("
+        "'\\x1b[1mJBL <img src=x onerror=alert(1)> & co\\x1b[0m'));"
+    )
+    out = subprocess.run(["node", "-e", check, str(STATIC / "ansi-to-html.min.js")],
+                         capture_output=True, text=True, check=True).stdout
+    assert "<img" not in out
+    assert "JBL &lt;img src=x onerror=alert(1)&gt; &amp; co" in out
@@ -1,8 +1,11 @@
 import importlib.util
+import json
 import sys
 import types
 from pathlib import Path
 
+import pytest
+
 # Minimal Flask stub for webhook tests
 flask_stub = types.ModuleType("flask")
 
@@ -30,33 +33,145 @@ spec = importlib.util.spec_from_file_location(
 app = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(app)
 
-def test_webhook_returns_script_output(monkeypatch):
-    def fake_run(cmd, *a, **k):
+class FakePopen:
+    returncode = 0
+    stdout_text = "deploy ok\n"
+    stderr_text = ""
+    hang = False
+
+    def __init__(self, cmd, *a, **k):
         assert cmd == ["bash", app.DEFAULT_WEBHOOK_SCRIPT]
-        class Dummy:
-            returncode = 0
-            stdout = "deploy ok\n"
-            stderr = ""
-        return Dummy()
-    monkeypatch.setattr(app.subprocess, "run", fake_run)
-    req = types.SimpleNamespace(headers={"X-GitHub-Event": "push"}, data=b"")
-    monkeypatch.setattr(app, "request", req)
-    resp, code = app.github_webhook()
-    assert code == 200
-    assert resp == {"ok": True, "stdout": "deploy ok\n", "stderr": ""}
+        self.pid = 4242
+        self.calls = 0
+        # The script writes to the log files it was given
+        for name, text in (("stdout", self.stdout_text), ("stderr", self.stderr_text)):
+            with open(k[name].name, "w") as f:
+                f.write(text)
 
+    def communicate(self, timeout=None):
+        self.calls += 1
+        if self.hang and self.calls == 1:
+            raise app.subprocess.TimeoutExpired("bash", timeout)
+        return None, None
 
-def test_webhook_handles_script_failure(monkeypatch):
-    def fake_run(cmd, *a, **k):
-        assert cmd == ["bash", app.DEFAULT_WEBHOOK_SCRIPT]
-        class Dummy:
-            returncode = 1
-            stdout = ""
-            stderr = "boom\n"
-        return Dummy()
-    monkeypatch.setattr(app.subprocess, "run", fake_run)
+    def kill(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def state_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("BT_WEB_STATE_FILE", str(tmp_path / "state.json"))
+    return tmp_path
+
+
+def _reset_queue(monkeypatch):
+    monkeypatch.setattr(app, "DEPLOYS", {})
+    monkeypatch.setattr(app, "DEPLOY_QUEUE", {"pending": None, "worker": None})
+    monkeypatch.setattr(app, "_ensure_deploy_worker", lambda: None)
+
+
+def _push(monkeypatch):
     req = types.SimpleNamespace(headers={"X-GitHub-Event": "push"}, data=b"")
     monkeypatch.setattr(app, "request", req)
-    resp, code = app.github_webhook()
-    assert code == 200
-    assert resp == {"ok": False, "stdout": "", "stderr": "boom\n"}
+    return app.github_webhook()
+
+
+def test_webhook_queues_deploy_and_returns_202(monkeypatch):
+    _reset_queue(monkeypatch)
+    resp, code = _push(monkeypatch)
+    assert code == 202
+    assert resp["ok"] is True
+    assert resp["coalesced"] is False
+    assert app.DEPLOYS[resp["deploy_id"]]["status"] == "queued"
+
+
+def test_webhook_coalesces_pending_pushes(monkeypatch):
+    _reset_queue(monkeypatch)
+    first, _ = _push(monkeypatch)
+    second, code = _push(monkeypatch)
+    assert code == 202
+    assert second["coalesced"] is True
+    assert second["deploy_id"] == first["deploy_id"]
+    assert app.DEPLOYS[first["deploy_id"]]["pushes"] == 2
+
+
+def test_run_deploy_captures_output(monkeypatch):
+    _reset_queue(monkeypatch)
+    monkeypatch.setattr(app.subprocess, "Popen", FakePopen)
+    resp, _ = _push(monkeypatch)
+    rec = app.DEPLOY_QUEUE["pending"]
+    app.run_deploy(rec)
+    status = app.api_deploy_status(resp["deploy_id"])
+    assert status["status"] == "succeeded"
+    assert status["returncode"] == 0
+    assert status["stdout"] == "deploy ok\n"
+
+
+def test_run_deploy_reports_failure(monkeypatch):
+    _reset_queue(monkeypatch)
+    fail = type("FailPopen", (FakePopen,), {"returncode": 1, "stdout_text": "", "stderr_text": "boom\n"})
+    monkeypatch.setattr(app.subprocess, "Popen", fail)
+    _push(monkeypatch)
+    rec = app.run_deploy(app.DEPLOY_QUEUE["pending"])
+    assert rec["status"] == "failed"
+    assert rec["stderr"] == "boom\n"
+
+
+def test_run_deploy_enforces_timeout(monkeypatch):
+    _reset_queue(monkeypatch)
+    hung = type("HungPopen", (FakePopen,), {"hang": True, "stdout_text": "partial\n"})
+    monkeypatch.setattr(app.subprocess, "Popen", hung)
+    killed = []
+    monkeypatch.setattr(app.os, "killpg", lambda pid, sig: killed.append(pid))
+    _push(monkeypatch)
+    rec = app.run_deploy(app.DEPLOY_QUEUE["pending"], timeout=0.01)
+    assert rec["status"] == "timeout"
+    assert killed == [4242]
+    assert "timed out" in rec["stderr"]
+
+
+def test_unknown_deploy_is_404(monkeypatch):
+    _reset_queue(monkeypatch)
+    resp, code = app.api_deploy_status("nope")
+    assert code == 404
+
+
+def test_deploy_cut_off_by_restart_is_finished_by_next_process(monkeypatch, state_dir):
+    _reset_queue(monkeypatch)
+    resp, _ = _push(monkeypatch)
+    rec = app.DEPLOY_QUEUE["pending"]
+    app.DEPLOY_QUEUE["pending"] = None
+    # What is on disk when deploy.sh reaches "systemctl restart bt-web"
+    rec["status"], rec["start_ts"] = "running", 1.0
+    app.save_deploys()
+    (state_dir / f"deploy-{rec['id']}.stdout").write_text("Syncing files\nRestarting bt-web service...\n")
+    (state_dir / f"deploy-{rec['id']}.stderr").write_text("+ sudo systemctl restart bt-web\n")
+
+    # The new process starts with empty memory
+    _reset_queue(monkeypatch)
+    assert app.load_deploys() == 1
+    status = app.api_deploy_status(resp["deploy_id"])
+    assert status["status"] == "restarted" and status["end_ts"]
+    assert status["stdout"].endswith("Restarting bt-web service...\n")
+    assert status["stderr"] == "+ sudo systemctl restart bt-web\n"
+    assert not list(state_dir.glob("deploy-*"))
+    assert json.loads((state_dir / "deploys.json").read_text())[0]["status"] == "restarted"
+
+
+def test_deploy_records_written_as_they_change(monkeypatch, state_dir):
+    _reset_queue(monkeypatch)
+    monkeypatch.setattr(app.subprocess, "Popen", FakePopen)
+    _push(monkeypatch)
+    saved = json.loads((state_dir / "deploys.json").read_text())
+    assert [r["status"] for r in saved] == ["queued"]
+    rec = app.DEPLOY_QUEUE["pending"]
+    app.DEPLOY_QUEUE["pending"] = None
+    app.run_deploy(rec)
+    saved = json.loads((state_dir / "deploys.json").read_text())
+    assert saved[0]["status"] == "succeeded" and saved[0]["stdout"] == "deploy ok\n"
+
+    # A queued deploy lost with the old process is queued again
+    _push(monkeypatch)
+    _reset_queue(monkeypatch)
+    assert app.load_deploys() == 2
+    assert app.DEPLOY_QUEUE["pending"]["status"] == "queued"
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Measure scan ingestion throughput (lines/second) of ``_scan_reader``.
+
+Feeds a bluetoothctl scan transcript through the app's chunked, coalescing
+reader and through a per-line reference loop equivalent to the old reader,
+and prints both rates as JSON. Without ``--transcript`` a crowded-venue
+transcript is synthesized: hundreds of BLE devices with rotating random
+addresses, RSSI / ManufacturerData churn, colored tags and prompts.
+
+The reader is then run again with ``get_info`` taking ``--info-latency``
+seconds (a bluetoothctl spawn), paced at ``--rate`` lines/s like a live
+session, to show that identity lookups stay off the reader and how far the
+lookup queue falls behind.
+
+    python3 tools/bench_scan.py --devices 400 --lines 200000
+    python3 tools/bench_scan.py --info-latency 0.08 --rate 2000
+    python3 tools/bench_scan.py --transcript scan.raw
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("app", os.path.join(ROOT, "web-bt", "app.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+def crowded_venue(devices=400, lines=200_000, seed=1):
+    """Synthesize scan output shaped like a busy venue."""
+    rng = random.Random(seed)
+    macs = ["%02X:%02X:%02X:%02X:%02X:%02X" % tuple(rng.randrange(256) for _ in range(6))
+            for _ in range(devices)]
+    tag = lambda t: f"[\x1b[0;93m{t}\x1b[0m]"
+    out = []
+    for mac in macs:
+        out.append(f"{tag('NEW')} Device {mac} {mac.replace(':', '-')}")
+    while len(out) < lines:
+        mac = rng.choice(macs)
+        r = rng.random()
+        if r < 0.55:
+            out.append(f"{tag('CHG')} Device {mac} RSSI: {rng.randint(-100, -40)}")
+        elif r < 0.85:
+            out.append(f"{tag('CHG')} Device {mac} ManufacturerData Key: 0x004c")
+            out.append(f"{tag('CHG')} Device {mac} ManufacturerData Value:")
+            out.append("  02 15 " + " ".join("%02x" % rng.randrange(256) for _ in range(14)))
+        elif r < 0.95:
+            out.append(f"{tag('CHG')} Device {mac} TxPower: {rng.randint(-20, 10)}")
+        else:
+            # random-address rotation
+            idx = macs.index(mac)
+            macs[idx] = "%02X:%02X:%02X:%02X:%02X:%02X" % tuple(rng.randrange(256) for _ in range(6))
+            out.append(f"{tag('DEL')} Device {mac} {mac.replace(':', '-')}")
+            out.append(f"{tag('NEW')} Device {macs[idx]} {macs[idx].replace(':', '-')}")
+        if rng.random() < 0.01:
+            out.append("\x1b[0;94m[bluetooth]\x1b[0m# ")
+    return ("\n".join(out[:lines]) + "\n").encode()
+
+
+def reference_reader(app, text_lines):
+    """Per-line loop equivalent to the reader before chunked ingestion."""
+    for line in text_lines:
+        m = app.DEVICE_LINE.search(line)
+        if not m:
+            continue
+        mac = m.group(1)
+        now = time.time()
+        app.LAST_SEEN[mac] = now
+        cached = app.IDENTITY_CACHE.get(mac)
+        if cached and now - cached[1] < 5.0:
+            pub = cached[0]
+        else:
+            pub = app.get_info(mac).get("identity")
+            app.IDENTITY_CACHE[mac] = (pub, now)
+        if pub:
+            app.LAST_SEEN[pub] = now
+
+
+def _reset(app):
+    app.identity_drain()
+    app.LAST_SEEN.clear()
+    app.IDENTITY_CACHE.clear()
+    app.IDENTITY_QUEUE.update(lookups=0, dropped=0, backlog_max=0)
+    app._reset_scan_stats(keep_previous=False)
+
+
+def paced(data, rate, size=4096):
+    """Yield ``data`` in chunks no faster than ``rate`` lines per second."""
+    t0 = time.perf_counter()
+    lines = 0
+    for i in range(0, len(data), size):
+        chunk = data[i:i + size]
+        lines += chunk.count(b"\n")
+        ahead = t0 + lines / rate - time.perf_counter()
+        if ahead > 0:
+            time.sleep(ahead)
+        yield chunk
+
+
+def bench_identity(app, data, latency, rate):
+    """Run the reader with slow identity lookups; report throughput and backlog."""
+    def slow_info(mac):
+        time.sleep(latency)
+        return {"identity": None}
+
+    app.get_info = slow_info
+    n_lines = data.count(b"\n")
+    _reset(app)
+    t0 = time.perf_counter()
+    app._scan_reader(paced(data, rate) if rate else [data[i:i + 4096] for i in range(0, len(data), 4096)])
+    reader = time.perf_counter() - t0
+    backlog = app.identity_status()["backlog"]
+    app.identity_drain()
+    drained = time.perf_counter() - t0
+    st = app.identity_status()
+    return {
+        "info_latency_s": latency,
+        "paced_lines_per_sec": rate or None,
+        "reader_seconds": round(reader, 4),
+        "lines_per_sec": round(n_lines / reader),
+        "lookups": st["lookups"],
+        "dropped": st["dropped"],
+        "backlog_max": st["backlog_max"],
+        "backlog_at_end": backlog,
+        "drain_seconds": round(drained - reader, 2),
+    }
+
+
+def bench(app, data, repeat=3, latency=0.05, rate=0):
+    app.get_info = lambda mac: {}  # identity lookups are measured separately
+    n_lines = data.count(b"\n")
+    results = {}
+
+    best = None
+    for _ in range(repeat):
+        _reset(app)
+        lines = io.TextIOWrapper(io.BytesIO(data), errors="ignore", newline="\n")
+        t0 = time.perf_counter()
+        reference_reader(app, lines)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    results["per_line"] = {"seconds": round(best, 4), "lines_per_sec": round(n_lines / best)}
+
+    best = None
+    for _ in range(repeat):
+        _reset(app)
+        t0 = time.perf_counter()
+        app._scan_reader(io.BufferedReader(io.BytesIO(data), app.SCAN_READ_SIZE))
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    results["chunked"] = {
+        "seconds": round(best, 4),
+        "lines_per_sec": round(n_lines / best),
+        "state_updates": app.SCAN_STATS["updates"],
+        "device_lines": app.SCAN_STATS["matched"],
+    }
+    results["lines"] = n_lines
+    results["speedup"] = round(results["per_line"]["seconds"] / results["chunked"]["seconds"], 2)
+    if latency:
+        results["identity"] = bench_identity(app, data, latency, rate)
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--transcript", help="raw bluetoothctl scan output to replay")
+    ap.add_argument("--devices", type=int, default=400)
+    ap.add_argument("--lines", type=int, default=200_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--info-latency", type=float, default=0.05,
+                    help="seconds per get_info call in the identity run (0 skips it)")
+    ap.add_argument("--rate", type=float, default=0,
+                    help="pace the identity run at this many lines/s (0 = as fast as possible)")
+    args = ap.parse_args(argv)
+
+    if args.transcript:
+        with open(args.transcript, "rb") as f:
+            data = f.read()
+    else:
+        data = crowded_venue(args.devices, args.lines)
+    print(json.dumps(bench(load_app(), data, args.repeat, args.info_latency, args.rate), indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""End-to-end HTTP load test for the Bluetooth web UI.
+
+Simulates N browser clients behaving like ``static/script.js``: page load,
+scan status, device polling every 2.5 s (scan status every fourth poll),
+``/api/info`` when the selected device changes, and occasional
+connect/disconnect with log streaming. By
+default it starts a local instance of ``web-bt/app.py`` backed by the fake
+``bluetoothctl`` in ``tools/fake-bin``; pass ``--url`` to target a running
+server instead.
+
+Prints a JSON report with per-route throughput, latency percentiles and
+error counts, e.g.::
+
+    python3 tools/loadtest.py --clients 10 --duration 60 --output load.json
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+APP = os.path.join(ROOT, "web-bt", "app.py")
+FAKE_BIN = os.path.join(ROOT, "tools", "fake-bin")
+# Same projections as static/script.js
+DEVICE_FIELDS = "mac,name,alias,identity,paired,trusted,connected"
+INFO_FIELDS = "alias,identity,paired,trusted,connected"
+# script.js re-checks /api/scan_status every SCAN_UI_EVERY device polls
+SCAN_UI_EVERY = 4
+
+
+class Recorder:
+    """Thread-safe per-route latency and error collection."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    total, total_err = 0, 0
+    for route, vals in sorted(recorder.samples.items()):
+        vals = sorted(vals)
+        errs = recorder.errors.get(route, 0)
+        total += len(vals)
+        total_err += errs
+        routes[route] = {
+            "count": len(vals),
+            "errors": errs,
+            "error_rate": round(errs / len(vals), 4),
+            "rps": round(len(vals) / elapsed, 3) if elapsed else 0.0,
+            "p50_ms": round(percentile(vals, 50) * 1000, 1),
+            "p95_ms": round(percentile(vals, 95) * 1000, 1),
+            "p99_ms": round(percentile(vals, 99) * 1000, 1),
+            "max_ms": round(vals[-1] * 1000, 1),
+        }
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "errors": total_err,
+        "rps": round(total / elapsed, 3) if elapsed else 0.0,
+        "routes": routes,
+    }
+
+
+class Client(threading.Thread):
+    """One simulated browser tab."""
+
+    def __init__(self, base, rec, stop, rng, args, leader=False):
+        super().__init__(daemon=True)
+        self.base, self.rec, self.stop, self.rng, self.args = base, rec, stop, rng, args
+        self.leader = leader
+        self.devices = []
+        self.selected = ""
+        self.log_cursor = 0
+        self.log_boot = ""
+        self.poll_ticks = 0
+
+    def call(self, method, path, route=None, body=None):
+        route = route or f"{method} {path.split('?')[0]}"
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base + path, data=data, method=method)
+        req.add_header("Accept-Encoding", "gzip")
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        t0 = time.perf_counter()
+        ok, payload = False, None
+        try:
+            with urllib.request.urlopen(req, timeout=self.args.timeout) as resp:
+                raw = resp.read()
+                if resp.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                ok = 200 <= resp.status < 300
+                if "json" in (resp.headers.get("Content-Type") or ""):
+                    payload = json.loads(raw)
+        except (urllib.error.URLError, OSError, ValueError):
+            ok = False
+        self.rec.add(route, time.perf_counter() - t0, ok)
+        return payload
+
+    # script.js: fetchDevices() -> renderList() -> syncStatus()
+    def fetch_devices(self):
+        data = self.call("GET", "/api/devices?audio_only=1&limit=100&fields=" + DEVICE_FIELDS
+                         + "&format=rows", route="GET /api/devices") or {}
+        fields = data.get("fields") or []
+        self.devices = [dict(zip(fields, row)) for row in data.get("rows") or []]
+        if not self.selected and self.devices:
+            self.selected = self.devices[0]["mac"]
+        if self.selected and not any(d.get("mac") == self.selected for d in self.devices):
+            self.refresh_info()
+
+    def refresh_info(self):
+        if self.selected:
+            self.call("GET", f"/api/info?mac={self.selected}&fields={INFO_FIELDS}")
+
+    def fetch_logs(self):
+        data = self.call("GET", f"/api/logs?cursor={self.log_cursor}&boot={self.log_boot}") or {}
+        self.log_cursor = data.get("cursor", self.log_cursor)
+        self.log_boot = data.get("boot", self.log_boot)
+
+    def action(self):
+        """Connect or disconnect the selected device, streaming logs meanwhile."""
+        if not self.selected:
+            return
+        dev = next((d for d in self.devices if d.get("mac") == self.selected), {})
+        op = "disconnect" if dev.get("connected") else "connect"
+        done = threading.Event()
+
+        def stream():
+            while not done.wait(1.0):
+                self.fetch_logs()
+
+        t = threading.Thread(target=stream, daemon=True)
+        t.start()
+        self.call("POST", f"/api/{op}", body={"mac": self.selected})
+        done.set()
+        t.join()
+        self.fetch_logs()
+        self.refresh_info()
+
+    def run(self):
+        self.call("GET", "/")
+        self.call("GET", "/api/scan_status")
+        if self.leader:
+            self.call("POST", "/api/scan_on")
+            self.call("GET", "/api/scan_status")
+        self.fetch_devices()
+        self.fetch_logs()
+        # Tabs do not open in lock-step
+        if self.stop.wait(self.rng.uniform(0, self.args.poll_interval)):
+            return
+        while not self.stop.is_set():
+            t0 = time.monotonic()
+            # script.js: pollTick()
+            self.fetch_devices()
+            self.poll_ticks += 1
+            if self.poll_ticks % SCAN_UI_EVERY == 0:
+                self.call("GET", "/api/scan_status")
+            if self.devices and self.rng.random() < self.args.select_rate:
+                self.selected = self.rng.choice(self.devices)["mac"]
+                self.refresh_info()
+            if self.rng.random() < self.args.action_rate:
+                self.action()
+            self.stop.wait(max(0.0, self.args.poll_interval - (time.monotonic() - t0)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_local(args, workdir):
+    """Start web-bt/app.py against the fake bluetoothctl; return (url, process)."""
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "PATH": FAKE_BIN + os.pathsep + env.get("PATH", ""),
+        "FAKE_BCTL_DEVICES": str(args.devices),
+        "FAKE_BCTL_DELAY": str(args.bctl_delay),
+        "FAKE_BCTL_STATE": os.path.join(workdir, "fake-bctl.json"),
+        "BT_WEB_STATE_FILE": os.path.join(workdir, "state.json"),
+    })
+    env.pop("LISTEN_FDS", None)
+    proc = subprocess.Popen([sys.executable, APP], env=env, cwd=os.path.dirname(APP),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with {proc.returncode} during start-up")
+        try:
+            urllib.request.urlopen(url + "/api/logs", timeout=1).read()
+            return url, proc
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("app did not start within 30s")
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    rec = Recorder()
+    stop = threading.Event()
+    proc = None
+    with tempfile.TemporaryDirectory() as workdir:
+        url = args.url
+        if not url:
+            url, proc = start_local(args, workdir)
+        try:
+            clients = [
+                Client(url.rstrip("/"), rec, stop, random.Random(rng.random()), args, leader=(i == 0))
+                for i in range(args.clients)
+            ]
+            t0 = time.monotonic()
+            for c in clients:
+                c.start()
+            stop.wait(args.duration)
+            stop.set()
+            for c in clients:
+                c.join(args.timeout + 1)
+            elapsed = time.monotonic() - t0
+        finally:
+            if proc:
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+    report = summarize(rec, elapsed)
+    report["config"] = {
+        "clients": args.clients,
+        "duration_s": args.duration,
+        "poll_interval_s": args.poll_interval,
+        "select_rate": args.select_rate,
+        "action_rate": args.action_rate,
+        "target": args.url or "local+fake-bluetoothctl",
+        "devices": None if args.url else args.devices,
+        "bctl_delay_s": None if args.url else args.bctl_delay,
+        "ts": time.time(),
+    }
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--clients", type=int, default=5, help="simulated browser tabs")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    ap.add_argument("--url", help="target a running server instead of starting one")
+    ap.add_argument("--poll-interval", type=float, default=2.5, help="device poll interval (script.js)")
+    ap.add_argument("--select-rate", type=float, default=0.05, help="chance per poll of selecting another device")
+    ap.add_argument("--action-rate", type=float, default=0.01, help="chance per poll of connect/disconnect")
+    ap.add_argument("--devices", type=int, default=20, help="fake bluetoothctl device count")
+    ap.add_argument("--bctl-delay", type=float, default=0.05, help="fake bluetoothctl start-up latency")
+    ap.add_argument("--timeout", type=float, default=60.0, help="per-request timeout")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if report["requests"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Replay recorded bluetoothctl sessions through the app and check the results.
+
+Takes a transcript written by the app with ``BT_WEB_CAPTURE=<file>`` and
+drives the app's parsers with it: the scanner session goes through
+``_scan_reader``, every recorded ``info`` through ``get_info`` and the device
+listing through the ``/api/devices`` pipeline (``device_list_payload`` and
+``device_page``). bluetoothctl itself is replaced by the transcript: each call
+is answered with the recorded output after the recorded delay divided by
+``--speed`` (0 = no delays).
+
+Results are compared with an expectations file holding golden values and
+per-stage time budgets (seconds of app-side processing, replay delays not
+counted); ``--update`` rewrites it from the current run. Exits 1 on any
+mismatch, budget overrun or call the transcript cannot answer.
+
+    BT_WEB_CAPTURE=/tmp/bt.jsonl.gz python3 web-bt/app.py
+    python3 tools/replay.py /tmp/bt.jsonl.gz --expected bt.expected.json --update
+    python3 tools/replay.py /tmp/bt.jsonl.gz --expected bt.expected.json --speed 10
+"""
+import argparse
+import gzip
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# Budgets written by --update are this multiple of the measured time
+BUDGET_FACTOR = 10.0
+BUDGET_FLOOR = 0.25
+# Fields that depend on when the replay ran rather than on the transcript
+VOLATILE = ("last_seen",)
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("app", os.path.join(ROOT, "web-bt", "app.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+def load_transcript(path):
+    """Parse a capture file into its header and a list of sessions."""
+    opener = gzip.open if path.endswith(".gz") else open
+    sessions = {}
+    with opener(path, "rt", encoding="utf-8", errors="surrogateescape") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != "bt-web-capture":
+            raise ValueError(f"{path}: not a bt-web capture")
+        for line in f:
+            if not line.strip():
+                continue
+            t, sid, kind, data = json.loads(line)
+            if kind == "start":
+                sessions[sid] = {"sid": sid, "role": data["role"], "argv": data["argv"],
+                                 "t0": t, "in": [], "out": [], "exit": None}
+            elif sid in sessions:
+                s = sessions[sid]
+                if kind == "exit":
+                    s["exit"] = (t, data)
+                else:
+                    s[kind].append((t - s["t0"], data))
+    return {"header": header, "sessions": [sessions[k] for k in sorted(sessions)]}
+
+
+def _commands(script):
+    """Commands of a one-shot script minus the adapter/power/quit boilerplate."""
+    out = []
+    for line in (script or "").splitlines():
+        line = line.strip()
+        if line and line != "power on" and line != "quit" and not line.startswith("select "):
+            out.append(line)
+    return tuple(out)
+
+
+def _session_key(role, argv, script):
+    return role, tuple(argv[1:]), _commands(script)
+
+
+class Replay:
+    """Stand-in for the app's one-shot bluetoothctl calls, answered from a transcript."""
+
+    def __init__(self, transcript, speed=0.0):
+        self.speed = speed
+        self.slept = 0.0
+        self.calls = 0
+        self.misses = []
+        self.by_key = {}
+        self.cursor = {}
+        for s in transcript["sessions"]:
+            if s["role"] in ("run", "show"):
+                script = "".join(d for _, d in s["in"])
+                self.by_key.setdefault(_session_key(s["role"], s["argv"], script), []).append(s)
+        self.scans = [s for s in transcript["sessions"] if s["role"] == "scan"]
+
+    def sleep(self, seconds):
+        if self.speed > 0 and seconds > 0:
+            t0 = time.perf_counter()
+            time.sleep(seconds / self.speed)
+            self.slept += time.perf_counter() - t0
+
+    def rewind(self):
+        self.cursor = {}
+
+    def run(self, role, argv, script, timeout):
+        """Replacement for ``app._captured_run``."""
+        self.calls += 1
+        if isinstance(script, bytes):
+            script = script.decode("utf-8", "surrogateescape")
+        key = _session_key(role, argv, script)
+        recorded = self.by_key.get(key)
+        if not recorded:
+            self.misses.append(" ".join(key[1] + key[2]) or role)
+            return types.SimpleNamespace(returncode=1, stdout=b"", stderr=b"")
+        # Repeated calls walk through the recordings, then keep the last one
+        i = self.cursor.get(key, 0)
+        self.cursor[key] = i + 1
+        s = recorded[min(i, len(recorded) - 1)]
+        end, rc = s["exit"] or ((s["out"][-1][0] if s["out"] else 0) + s["t0"], 0)
+        self.sleep((end - s["t0"]) / 1000.0)
+        out = "".join(d for _, d in s["out"]).encode("utf-8", "surrogateescape")
+        return types.SimpleNamespace(returncode=rc, stdout=out, stderr=b"")
+
+    def scan_chunks(self, session):
+        """Yield a scanner session's output with its recorded pacing."""
+        last = 0
+        for t, data in session["out"]:
+            self.sleep((t - last) / 1000.0)
+            last = t
+            yield data.encode("utf-8", "surrogateescape")
+
+
+def _strip(obj):
+    if isinstance(obj, dict):
+        return {k: _strip(v) for k, v in obj.items() if k not in VOLATILE}
+    if isinstance(obj, list):
+        return [_strip(v) for v in obj]
+    return obj
+
+
+def _reset(app):
+    app.LAST_SEEN.clear()
+    app.IDENTITY_CACHE.clear()
+    app.CAPS_INDEX.clear()
+    app.SINGLE_FLIGHT.clear()
+    app.ADAPTER_CACHE.update(mac=None, ts=0.0)
+    app._reset_scan_stats(keep_previous=False)
+
+
+def run(app, transcript, speed=0.0):
+    """Replay ``transcript`` through ``app``; return the report."""
+    rp = Replay(transcript, speed)
+    saved = app._captured_run, dict(app.SCAN_STATE)
+    app._captured_run = rp.run
+    stages, results = {}, {}
+
+    def stage(name, fn):
+        rp.rewind()
+        slept0, calls0 = rp.slept, rp.calls
+        t0 = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - t0
+        stages[name] = {
+            "seconds": round(elapsed, 4),
+            "processing_s": round(elapsed - (rp.slept - slept0), 4),
+            "bctl_calls": rp.calls - calls0,
+        }
+        return out
+
+    try:
+        _reset(app)
+        app.SCAN_STATE.update(wanted=True, start_ts=time.time())
+
+        def scan():
+            for s in rp.scans:
+                app._scan_reader(rp.scan_chunks(s))
+            app.identity_drain()
+            return sorted(app.LAST_SEEN)
+
+        results["scan_macs"] = stage("scan", scan)
+        stages["scan"].update(lines=app.SCAN_STATS["lines"], device_lines=app.SCAN_STATS["matched"],
+                              updates=app.SCAN_STATS["updates"])
+
+        info_macs = sorted({cmd.split()[1] for key in rp.by_key for cmd in key[2]
+                            if cmd.startswith("info ") and len(cmd.split()) == 2})
+        results["info"] = stage("info", lambda: {mac: app.get_info(mac) for mac in info_macs})
+
+        def devices():
+            out = {}
+            for name, audio_only in (("all", False), ("audio", True)):
+                app.SINGLE_FLIGHT.clear()
+                views = app.device_views(app.device_list_payload(audio_only))
+                page = app.device_page(views, "connected", limit=app.DEVICE_PAGE_MAX)
+                out[name] = _strip(page)
+            return out
+
+        results["devices"] = stage("devices", devices)
+    finally:
+        app._captured_run, state = saved
+        app.SCAN_STATE.clear()
+        app.SCAN_STATE.update(state)
+    return {"speed": speed, "stages": stages, "results": results, "misses": sorted(set(rp.misses))}
+
+
+def expectations(report):
+    """Golden values and budgets for ``--update``."""
+    budgets = {name: round(max(st["processing_s"] * BUDGET_FACTOR, BUDGET_FLOOR), 3)
+               for name, st in report["stages"].items()}
+    return {"results": report["results"], "budgets": budgets}
+
+
+def check(report, expected):
+    """Return a list of human-readable failures (empty when everything matches)."""
+    failures = [f"no recording for bluetoothctl call: {m}" for m in report["misses"]]
+    # Compare as JSON so tuples/lists and int/float keys line up with the file
+    results = json.loads(json.dumps(report["results"]))
+    for key, want in expected.get("results", {}).items():
+        got = results.get(key)
+        if got != want:
+            failures.append(f"{key}: result differs from expectations")
+    for name, budget in expected.get("budgets", {}).items():
+        took = report["stages"].get(name, {}).get("processing_s")
+        if took is not None and took > budget:
+            failures.append(f"{name}: {took:.3f}s over budget {budget:.3f}s")
+    return failures
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("transcript", help="capture file written with BT_WEB_CAPTURE")
+    ap.add_argument("--expected", help="expectations file (golden results and budgets)")
+    ap.add_argument("--update", action="store_true", help="rewrite --expected from this run")
+    ap.add_argument("--speed", type=float, default=0.0,
+                    help="replay speed: 1 = as recorded, 10 = ten times faster, 0 = no delays")
+    args = ap.parse_args(argv)
+
+    report = run(load_app(), load_transcript(args.transcript), args.speed)
+    failures = []
+    if args.expected and args.update:
+        with open(args.expected, "w") as f:
+            json.dump(expectations(report), f, indent=1, sort_keys=True)
+            f.write("\n")
+    elif args.expected:
+        with open(args.expected) as f:
+            failures = check(report, json.load(f))
+    print(json.dumps({"stages": report["stages"], "misses": report["misses"],
+                      "failures": failures}, indent=2))
+    return 1 if failures or report["misses"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
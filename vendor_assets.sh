@@ -0,0 +1,64 @@
+#!/usr/bin/env bash
+# Download third-party front-end assets into web-bt/static/vendor so the UI
+# loads without internet access. Files already present are kept. Then writes
+# precompressed .gz/.br copies of every script and stylesheet under static/.
+set -euo pipefail
+
+cd "$(dirname "$0")"
+
+BOOTSTRAP_VERSION="5.3.3"
+CDN="https://cdn.jsdelivr.net/npm/bootstrap@${BOOTSTRAP_VERSION}/dist"
+VENDOR="web-bt/static/vendor"
+mkdir -p "$VENDOR"
+
+fetch() {
+  local url="$1" dest="$VENDOR/$2"
+  if [[ -s "$dest" ]]; then
+    echo "Keeping $dest"
+    return
+  fi
+  echo "Fetching $url"
+  if ! curl -fsSL --retry 3 -o "$dest.tmp" "$url"; then
+    rm -f "$dest.tmp"
+    echo "Warning: could not download $url; the page will fall back to the CDN" >&2
+    return
+  fi
+  mv "$dest.tmp" "$dest"
+}
+
+fetch "$CDN/css/bootstrap.min.css" bootstrap.min.css
+fetch "$CDN/js/bootstrap.bundle.min.js" bootstrap.bundle.min.js
+
+# Precompress every script and stylesheet once, at maximum compression, so
+# the app does not have to at start-up (gzip; brotli too if python3-brotli
+# is installed). The app ignores sidecars that no longer match their file.
+python3 - web-bt/static <<'PY'
+import gzip, os, sys
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+for root, _, files in os.walk(sys.argv[1]):
+    for fn in files:
+        if not fn.endswith((".js", ".css")):
+            continue
+        src = os.path.join(root, fn)
+        with open(src, "rb") as f:
+            body = f.read()
+        outs = [(".gz", gzip.decompress, lambda b: gzip.compress(b, 9, mtime=0))]
+        if brotli:
+            outs.append((".br", brotli.decompress, lambda b: brotli.compress(b, quality=11)))
+        for ext, unpack, pack in outs:
+            dst = src + ext
+            try:
+                with open(dst, "rb") as f:
+                    if unpack(f.read()) == body:
+                        continue
+            except Exception:
+                pass
+            with open(dst + ".tmp", "wb") as f:
+                f.write(pack(body))
+            os.replace(dst + ".tmp", dst)
+            print(f"Compressed {dst}")
+PY
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
-import os, re, time, atexit, subprocess, hmac, hashlib, threading
-import logging
+import os, re, json, time, atexit, subprocess, hmac, hashlib, threading, signal, socket
+import logging, gzip, heapq, functools, bisect, base64
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
 from logging.handlers import RotatingFileHandler
 from flask import Flask, jsonify, request, render_template
 
+try:
+    import brotli  # optional: serve .br variants when python3-brotli is installed
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
 # Configure file logging for debug purposes
@@ -23,32 +31,406 @@ if hasattr(app, "logger"):
 DEFAULT_WEBHOOK_SCRIPT = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "deploy.sh")
 )
+# Seconds a deploy may run before it is killed (GITHUB_WEBHOOK_TIMEOUT)
+DEFAULT_DEPLOY_TIMEOUT = 600
+# Finished deploys kept for /api/deploys/<id>
+DEPLOY_HISTORY = 20
+# bluetoothctl scheduler: priority classes (lower runs first), how many
+# sessions may run at once, and how long each class may sit in the queue
+# before it is dropped as stale (None = wait indefinitely).
+PRIO_INTERACTIVE, PRIO_REFRESH, PRIO_IDENTITY = 0, 1, 2
+PRIO_NAMES = {PRIO_INTERACTIVE: "interactive", PRIO_REFRESH: "refresh", PRIO_IDENTITY: "identity"}
+BCTL_MAX_CONCURRENT = 2
+BCTL_MAX_WAIT = {PRIO_INTERACTIVE: None, PRIO_REFRESH: 20.0, PRIO_IDENTITY: 5.0}
+# Capability tags derived from the Class of Device and service UUIDs
+COD_MAJOR = {1: "computer", 2: "phone", 3: "network", 4: "audio_video", 5: "peripheral",
+             6: "imaging", 7: "wearable", 8: "toy", 9: "health"}
+COD_AV_MINOR = {1: "headset", 2: "handsfree", 4: "microphone", 5: "loudspeaker",
+                6: "headphones", 7: "portable_audio", 8: "car_audio", 10: "hifi_audio"}
+COD_SERVICE = {16: "svc_positioning", 17: "svc_networking", 18: "svc_rendering",
+               19: "svc_capturing", 20: "svc_object_transfer", 21: "svc_audio",
+               22: "svc_telephony", 23: "svc_information"}
+UUID_CAPS = {
+    0x110A: "a2dp_source", 0x110B: "a2dp_sink",
+    0x110C: "avrcp", 0x110E: "avrcp", 0x110F: "avrcp",
+    0x1108: "hsp", 0x1112: "hsp", 0x111E: "hfp", 0x111F: "hfp_ag",
+    # LE Audio: ASCS, BASS, PACS, CAS, TMAS
+    0x184E: "le_audio", 0x184F: "le_audio", 0x1850: "le_audio", 0x1853: "le_audio", 0x1855: "le_audio",
+}
+CLASS_CAPS = frozenset(
+    list(COD_MAJOR.values()) + list(COD_AV_MINOR.values()) + list(COD_SERVICE.values())
+)
+UUID_CAP_NAMES = frozenset(UUID_CAPS.values())
+# "audio" is derived from both: an A/V major class or an A2DP sink UUID
+CAPABILITIES = CLASS_CAPS | UUID_CAP_NAMES | {"audio"}
+# Seconds an index entry may rule a device out before it is re-checked
+# (capabilities are fixed, but paired/connected can change outside the app)
+CAPS_INDEX_TTL = 300
+# Scanner pipe read size and the window over which repeat sightings of the
+# same device are folded into one state update
+SCAN_READ_SIZE = 64 * 1024
+SCAN_COALESCE_WINDOW = 0.25
+# Seconds a resolved identity address is reused before ``get_info`` is asked
+# again (a random address keeps its identity until it rotates, ~15 min), and
+# the most scanned addresses that may wait for a lookup at once
+IDENTITY_TTL = 300.0
+IDENTITY_QUEUE_MAX = 512
+# Scan Off is implied after this many seconds without a UI client polling
+# (BT_WEB_SCAN_IDLE_TIMEOUT, 0 = never); duty-cycle window bounds in seconds
+SCAN_IDLE_TIMEOUT = 300
+SCAN_DUTY_MIN_WINDOW = 1.0
+SCAN_DUTY_MAX_INTERVAL = 3600.0
+# Scanner watchdog: probe a session that has been quiet this long, treat it as
+# hung if the probe gets no output in time, and cap the restart retry delay
+SCAN_HEARTBEAT_IDLE = 15.0
+SCAN_HEARTBEAT_TIMEOUT = 5.0
+SCAN_RESTART_MAX_BACKOFF = 5.0
+# Seconds to wait for a freshly started scanner session to print something
+SCAN_READY_TIMEOUT = 2.0
+# /api/devices paging: default and maximum page size, and the sort orders
+DEVICE_PAGE_DEFAULT = 100
+DEVICE_PAGE_MAX = 500
+DEVICE_SORTS = ("connected", "paired", "name", "rssi", "last_seen")
+# Keys a client may project with ?fields= on /api/devices and /api/info
+DEVICE_FIELDS = ("mac", "name", "alias", "type", "identity", "paired", "trusted", "connected",
+                 "class", "uuids", "caps", "rssi", "last_seen")
+INFO_FIELDS = ("alias", "identity", "paired", "trusted", "connected", "class", "uuids", "rssi")
+# ?format=rows sends {"fields": [...], "rows": [[...], ...]} instead of objects
+DEVICE_FORMATS = ("objects", "rows")
+# JSON bodies at least this large are gzipped for clients that accept it
+JSON_GZIP_MIN = 1024
+JSON_GZIP_LEVEL = 6
+# Seconds a shared /api result may be reused by later identical requests
+SINGLE_FLIGHT_TTL = 2.0
+# Snapshots older than this (seconds) are ignored on start
+STATE_MAX_AGE = 600
+# First fd passed by systemd socket activation (sd_listen_fds)
+SD_LISTEN_FDS_START = 3
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+VERSION_FILE = os.path.join(os.path.dirname(__file__), "..", "VERSION")
+# Fingerprinted assets never change under the same URL
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_TYPES = {".js": "application/javascript", ".css": "text/css"}
+# vendor_assets.sh writes <file>.gz / <file>.br at maximum compression;
+# assets without them are compressed on first request at these cheaper levels
+ASSET_SIDECARS = {"gzip": ".gz", "br": ".br"}
+ASSET_GZIP_LEVEL = 6
+ASSET_BROTLI_QUALITY = 5
 
 # ------------------ Regex ------------------
 DEVICE_LINE = re.compile(r"Device ([0-9A-F:]{17})(?: \((random|public)\))? (.+)$")
 BOOL_LINE   = re.compile(r"^(Paired|Trusted|Connected):\s+(yes|no)$", re.I)
 ADAPTER_BOOL= re.compile(r"^(Powered|Discoverable|Pairable|Discovering):\s+(yes|no)$", re.I)
+SCAN_DEVICE_TOKEN = re.compile(rb"Device ([0-9A-F:]{17}) ")
+RSSI_LINE   = re.compile(r"^RSSI:\s+(?:0x[0-9a-f]+\s+\()?(-?\d+)\)?$", re.I)
+SCAN_TRANSPORT = re.compile(rb"(DEL|CHG)\S* Transport (/\S+)(?: State: (\w+))?")
+MAC_ADDR    = re.compile(r"[0-9A-F]{2}(?::[0-9A-F]{2}){5}", re.I)
+UUID_BASE   = re.compile(r"([0-9a-f]{8})-0000-1000-8000-00805f9b34fb", re.I)
+UUID_ARG    = re.compile(r"^(?:[0-9A-F]{4}|[0-9A-F]{8}|[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12})$", re.I)
 
 # ------------------ State ------------------
 SCAN_STATE = {"wanted": False, "start_ts": 0}
 SCAN_PROC  = {"p": None, "adapter": None, "t": None}
+SCAN_PROC_LOCK = threading.RLock()
 ADAPTER_CACHE = {"mac": None, "ts": 0.0}
 LAST_SEEN = {}
 # Cache for mapping a scanned address to its corresponding identity address.
 # This avoids repeatedly invoking `get_info` for the same MAC on every line of
 # scan output. Values are tuples of (identity_mac, timestamp).
 IDENTITY_CACHE = {}
+# Identity lookups handed off by the scan reader: MACs waiting for the worker
+# (in arrival order, each once) -> when they were seen, the MAC being looked
+# up, and counters for /api/scan_status
+IDENTITY_QUEUE = {"pending": {}, "busy": None, "worker": None,
+                  "lookups": 0, "dropped": 0, "backlog_max": 0}
+IDENTITY_COND = threading.Condition()
+# Discovery filter pushed down into bluetoothctl's ``menu scan`` so BlueZ drops
+# uninteresting advertisements before they reach ``_scan_reader``. ``None``
+# (or an empty list) leaves the BlueZ default in place.
+SCAN_FILTER = {"transport": None, "rssi": None, "uuids": [], "duplicate_data": None}
+SCAN_TRANSPORTS = ("auto", "le", "bredr")
+# Operation log shared by every request. Entries carry an increasing ``seq``
+# so clients can poll ``/api/logs?cursor=`` for only what they have not seen.
+OP_LOG = deque(maxlen=500)
+# "boot" changes with every process, so cursors from before a restart are detected
+OP_LOG_STATE = {"seq": 0, "boot": os.urandom(4).hex()}
+OP_LOG_LOCK = threading.Lock()
+# Static asset manifest built by ``build_assets``: logical name -> entry and
+# fingerprinted URL path -> entry. The rendered index page is cached alongside.
+ASSETS = {"by_name": None, "by_path": {}}
+INDEX_CACHE = {"html": None, "gzip": None, "etag": None}
+# Queue of waiting bluetoothctl calls as heap entries [priority, seq, cancelled]
+BCTL_SCHED = {"queue": [], "running": 0, "seq": 0}
+BCTL_COND = threading.Condition()
+BCTL_STATS = {name: {"runs": 0, "cancelled": 0, "wait_total": 0.0, "wait_max": 0.0}
+              for name in PRIO_NAMES.values()}
+_BCTL_LOCAL = threading.local()
+# Capability index: mac -> {"caps", "class", "paired", "connected", "ts"}.
+# Filled whenever ``get_info`` runs so /api/devices can skip devices that
+# cannot match a filter without spawning bluetoothctl for them.
+CAPS_INDEX = {}
+# Single-flight slots for read-only endpoints: concurrent identical requests
+# wait on one computation and reuse its result for SINGLE_FLIGHT_TTL seconds.
+SINGLE_FLIGHT = {}
+SINGLE_FLIGHT_LOCK = threading.Lock()
+SINGLE_FLIGHT_STATS = {"hits": 0, "misses": 0, "shared": 0}
+# Deploys requested by /github-webhook. One worker thread runs them in order;
+# pushes that arrive while a deploy is still queued join that deploy.
+DEPLOYS = {}
+DEPLOY_QUEUE = {"pending": None, "worker": None}
+DEPLOY_COND = threading.Condition()
+# Scan scheduler: duty cycle (discovery runs ``window`` seconds out of every
+# ``interval``), idle auto-stop and pause reasons (reason -> count). The
+# scheduler thread only runs while a scan is wanted.
+SCAN_DUTY = {"window": None, "interval": None, "idle_timeout": None, "cycle_start": 0.0,
+             "last_client": 0.0, "pauses": {}, "holds": {}, "discovering": False, "auto_stopped": None,
+             "thread": None}
+SCAN_DUTY_COND = threading.Condition(threading.RLock())
+# Media transports reported by the scanner session: object path -> state
+AUDIO_TRANSPORTS = {}
+# Scanner session health. Each session's reader stamps ``last_output`` on its
+# own process object for every chunk, so a killed session's reader cannot keep
+# its replacement looking alive. ``eof`` is set when the reader of the current
+# session hits EOF, and ``down_since`` marks the start of a coverage gap until
+# a restart succeeds.
+SCAN_WATCH = {"started": 0.0, "eof": None, "probe_sent": 0.0,
+              "down_since": None, "restarts": 0, "exits": 0, "hangs": 0, "failures": 0,
+              "heartbeats": 0, "downtime": 0.0, "last_restart": None}
+# Set by SIGTERM/atexit; ``wanted`` stays True for the snapshot, so the
+# watchdog needs this to know it must not bring the scanner back
+SHUTTING_DOWN = threading.Event()
+# bluetoothctl session capture (BT_WEB_CAPTURE): open transcript file, its
+# start time and the last session id handed out
+CAPTURE = {"fh": None, "path": None, "t0": 0.0, "sid": 0}
+CAPTURE_LOCK = threading.Lock()
+# Scan output counters. ``previous`` keeps the rate measured under the filter
+# that was active before the last change so the effect can be compared.
+SCAN_STATS = {"lines": 0, "matched": 0, "updates": 0, "since": 0.0, "filter": None, "previous": None}
 
 # ------------------ Utilities ------------------
+# Control characters stripped by ``clean_for_js`` (all C0 except \t, \n, ESC).
+_JS_DROP = dict.fromkeys(c for c in range(0x20) if c not in (0x09, 0x0A, 0x1B))
+
 def clean_for_js(text: str) -> str:
     """Keep printable plus ANSI escapes, newline and tab for client-side rendering."""
-    return "".join(ch for ch in text if ch in ("\n", "\t", "\x1b") or ord(ch) >= 0x20)
+    return text.translate(_JS_DROP)
+
+def log_append(text):
+    """Sanitize ``text`` and add it to the shared operation log."""
+    text = clean_for_js(text)
+    with OP_LOG_LOCK:
+        OP_LOG_STATE["seq"] += 1
+        entry = {"seq": OP_LOG_STATE["seq"], "ts": time.time(), "text": text}
+        OP_LOG.append(entry)
+    return entry
+
+def log_step(tag, out=""):
+    return log_append(f"\x1b[1m== {tag}\x1b[0m\n{out}")
+
+def log_since(cursor, boot=None):
+    """Return ``(entries, head, reset)`` for entries newer than ``cursor``.
+
+    ``reset`` tells the client its cursor is unusable (entries were evicted or
+    ``boot`` names another server process) and it should redraw from the
+    returned entries.
+    """
+    with OP_LOG_LOCK:
+        head = OP_LOG_STATE["seq"]
+        oldest = OP_LOG[0]["seq"] if OP_LOG else head + 1
+        reset = (cursor > head or cursor < oldest - 1
+                 or (bool(boot) and boot != OP_LOG_STATE["boot"]))
+        start = 0 if reset else cursor - oldest + 1
+        entries = list(islice(OP_LOG, start, None))
+    return entries, head, reset
+
+def _truthy(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes", "on")
 
+def _request_params():
+    """Merge query args and an optional JSON body into a plain dict."""
+    args = getattr(request, "args", None) or {}
+    params = {k: args.get(k) for k in args}
+    body = request.get_json(silent=True) if hasattr(request, "get_json") else None
+    if isinstance(body, dict):
+        params.update(body)
+    return params
+
+# ------------------ bluetoothctl scheduler ------------------
+class BctlCancelled(RuntimeError):
+    """A queued bluetoothctl call was dropped before it could run."""
+
+def _bctl_acquire(priority):
+    """Wait for a free bluetoothctl slot in priority order; return seconds waited."""
+    max_wait = BCTL_MAX_WAIT.get(priority)
+    stats = BCTL_STATS[PRIO_NAMES[priority]]
+    t0 = time.time()
+    with BCTL_COND:
+        BCTL_SCHED["seq"] += 1
+        ticket = [priority, BCTL_SCHED["seq"], False]
+        heapq.heappush(BCTL_SCHED["queue"], ticket)
+        while not (BCTL_SCHED["running"] < BCTL_MAX_CONCURRENT and BCTL_SCHED["queue"][0] is ticket):
+            remaining = None if max_wait is None else max_wait - (time.time() - t0)
+            if ticket[2] or (remaining is not None and remaining <= 0):
+                BCTL_SCHED["queue"].remove(ticket)
+                heapq.heapify(BCTL_SCHED["queue"])
+                stats["cancelled"] += 1
+                BCTL_COND.notify_all()
+                raise BctlCancelled(f"{PRIO_NAMES[priority]} bluetoothctl call dropped after {time.time() - t0:.1f}s")
+            BCTL_COND.wait(remaining)
+        heapq.heappop(BCTL_SCHED["queue"])
+        BCTL_SCHED["running"] += 1
+        waited = time.time() - t0
+        stats["runs"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        # Another waiter may be runnable if slots remain
+        BCTL_COND.notify_all()
+    return waited
+
+def _bctl_release():
+    with BCTL_COND:
+        BCTL_SCHED["running"] -= 1
+        BCTL_COND.notify_all()
+
+def bctl_cancel_queued(min_priority):
+    """Drop queued calls at ``min_priority`` or lower; running ones finish."""
+    with BCTL_COND:
+        for ticket in BCTL_SCHED["queue"]:
+            if ticket[0] >= min_priority:
+                ticket[2] = True
+        BCTL_COND.notify_all()
+
+@contextmanager
+def bctl_priority(priority):
+    """Run bluetoothctl calls made in this block at ``priority``."""
+    prev = getattr(_BCTL_LOCAL, "priority", None)
+    _BCTL_LOCAL.priority = priority
+    try:
+        yield
+    finally:
+        _BCTL_LOCAL.priority = prev
+
+@contextmanager
+def bctl_slot():
+    """Hold one scheduler slot; nested use on the same thread reuses it."""
+    if getattr(_BCTL_LOCAL, "held", 0):
+        _BCTL_LOCAL.held += 1
+        try:
+            yield
+        finally:
+            _BCTL_LOCAL.held -= 1
+        return
+    priority = getattr(_BCTL_LOCAL, "priority", None)
+    _bctl_acquire(PRIO_REFRESH if priority is None else priority)
+    _BCTL_LOCAL.held = 1
+    try:
+        yield
+    finally:
+        _BCTL_LOCAL.held = 0
+        _bctl_release()
+
+def interactive(fn):
+    """Mark a route as user-driven: its bluetoothctl calls jump the queue and
+    queued identity lookups are dropped."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bctl_cancel_queued(PRIO_IDENTITY)
+        with bctl_priority(PRIO_INTERACTIVE):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def busy_as_503(fn):
+    """Answer a polling route with a JSON 503 when its bluetoothctl calls were
+    dropped from the queue, instead of an HTML 500 for every waiter."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except BctlCancelled:
+            return jsonify({"ok": False, "error": "busy"}), 503, {"Retry-After": "2"}
+    return wrapper
+
+def bctl_stats():
+    with BCTL_COND:
+        out = {"running": BCTL_SCHED["running"], "queued": len(BCTL_SCHED["queue"]),
+               "max_concurrent": BCTL_MAX_CONCURRENT}
+        for name, st in BCTL_STATS.items():
+            runs = st["runs"]
+            out[name] = {**st, "wait_avg": round(st["wait_total"] / runs, 4) if runs else 0.0}
+    return out
+
+# ------------------ Session capture ------------------
+# Transcript format: JSON lines. The first line is a header object; every
+# other line is [ms_since_start, session_id, kind, data] with kind "start"
+# (data = {"role", "argv"}), "in", "out" (text, undecodable bytes kept via
+# surrogateescape) or "exit" (return code). Paths ending in .gz are gzipped.
+def capture_start(path):
+    if not path:
+        return False
+    opener = gzip.open if path.endswith(".gz") else open
+    with CAPTURE_LOCK:
+        CAPTURE["fh"] = opener(path, "wt", encoding="utf-8", errors="surrogateescape")
+        CAPTURE["path"] = path
+        CAPTURE["t0"] = time.time()
+        CAPTURE["sid"] = 0
+        CAPTURE["fh"].write(json.dumps({"format": "bt-web-capture", "version": 1,
+                                        "ts": CAPTURE["t0"]}) + "\n")
+    return True
+
+@atexit.register
+def capture_stop():
+    with CAPTURE_LOCK:
+        fh, CAPTURE["fh"] = CAPTURE["fh"], None
+        if fh:
+            fh.close()
+
+def _capture(sid, kind, data):
+    if sid is None:
+        return
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "surrogateescape")
+    with CAPTURE_LOCK:
+        fh = CAPTURE["fh"]
+        if fh:
+            t = round((time.time() - CAPTURE["t0"]) * 1000)
+            fh.write(json.dumps([t, sid, kind, data], separators=(",", ":")) + "\n")
+
+def capture_session(role, argv):
+    """Open a transcript session; None when capture is off."""
+    if not CAPTURE["fh"]:
+        return None
+    with CAPTURE_LOCK:
+        CAPTURE["sid"] += 1
+        sid = CAPTURE["sid"]
+    _capture(sid, "start", {"role": role, "argv": list(argv)})
+    return sid
+
+def _captured_run(role, argv, script, timeout):
+    """``subprocess.run`` for one-shot bluetoothctl calls, recorded when capturing."""
+    sid = capture_session(role, argv)
+    if script is not None:
+        _capture(sid, "in", script)
+    p = subprocess.run(argv, input=script, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       timeout=timeout)
+    _capture(sid, "out", p.stdout)
+    _capture(sid, "exit", p.returncode)
+    return p
+
+def _captured_chunks(pipe, sid):
+    for chunk in _scan_chunks(pipe):
+        _capture(sid, "out", chunk)
+        yield chunk
+
+# ------------------ bluetoothctl helpers ------------------
 def _get_adapter_mac(timeout=10):
     now = time.time()
     if ADAPTER_CACHE["mac"] and now - ADAPTER_CACHE["ts"] < 10:
         return ADAPTER_CACHE["mac"]
-    p = subprocess.run(["bluetoothctl", "show"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    with bctl_slot():
+        p = _captured_run("show", ["bluetoothctl", "show"], None, timeout)
     out = p.stdout.decode(errors="ignore")
     mac = None
     for line in out.splitlines():
@@ -63,15 +445,18 @@ def _get_adapter_mac(timeout=10):
     return mac
 
 def run_bctl(cmds, timeout=30):
-    """Run bluetoothctl non-interactively with a short script (fresh session)."""
-    adapter = _get_adapter_mac()
-    prefix = []
-    if adapter:
-        prefix.append(f"select {adapter}")
-    prefix += ["power on"]
-    script = "\n".join(prefix + list(cmds) + ["quit"]) + "\n"
-    p = subprocess.run(["bluetoothctl"], input=script.encode(),
-                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    """Run bluetoothctl non-interactively with a short script (fresh session).
+
+    Calls go through the scheduler at the calling thread's priority.
+    """
+    with bctl_slot():
+        adapter = _get_adapter_mac()
+        prefix = []
+        if adapter:
+            prefix.append(f"select {adapter}")
+        prefix += ["power on"]
+        script = "\n".join(prefix + list(cmds) + ["quit"]) + "\n"
+        p = _captured_run("run", ["bluetoothctl"], script.encode(), timeout)
     return p.returncode, p.stdout.decode(errors="ignore"), p.stderr.decode(errors="ignore")
 
 def adapter_status():
@@ -121,8 +506,9 @@ def get_info(mac):
         "uuids": [],
         "class": None,
         "identity": None,
+        "rssi": None,
     }
-    alias = None; uuids = []; cls = None; identity = None
+    alias = None; uuids = []; cls = None; identity = None; resolved = False
     for line in out.splitlines():
         s = line.strip()
         b = BOOL_LINE.match(s)
@@ -135,24 +521,73 @@ def get_info(mac):
             uuids.append(s.split("UUID:", 1)[1].strip())
         elif s.startswith("Class:"):
             cls = s.split("Class:", 1)[1].strip()
+        elif s.startswith("ServicesResolved:"):
+            resolved = s.split(":", 1)[1].strip().lower() == "yes"
         elif s.startswith("Identity Address:"):
             identity = s.split("Identity Address:", 1)[1].strip().split()[0]
+        elif s.startswith("RSSI:"):
+            r = RSSI_LINE.match(s)
+            if r:
+                info["rssi"] = int(r.group(1))
     info["alias"] = alias
     info["uuids"] = uuids
     info["class"] = cls
     info["identity"] = identity
+    index_capabilities(mac, info, resolved)
     return info
 
-def is_audio_capable(info):
-    """Check Bluetooth class of device for Audio/Video major class."""
+def device_capabilities(info):
+    """Capability tags for a device from its Class of Device and UUIDs."""
+    caps = set()
     cls = info.get("class")
     if isinstance(cls, str):
         try:
             cod = int(cls, 16)
-            return ((cod >> 8) & 0x1F) == 0x04  # Audio/Video major class
         except ValueError:
-            pass
-    return False
+            cod = None
+        if cod is not None:
+            major = (cod >> 8) & 0x1F
+            if major in COD_MAJOR:
+                caps.add(COD_MAJOR[major])
+            if major == 0x04:
+                minor = (cod >> 2) & 0x3F
+                if minor in COD_AV_MINOR:
+                    caps.add(COD_AV_MINOR[minor])
+            caps.update(name for bit, name in COD_SERVICE.items() if cod & (1 << bit))
+    for u in info.get("uuids") or []:
+        m = UUID_BASE.search(u)
+        if m and int(m.group(1), 16) in UUID_CAPS:
+            caps.add(UUID_CAPS[int(m.group(1), 16)])
+    if "audio_video" in caps or "a2dp_sink" in caps:
+        caps.add("audio")
+    return frozenset(caps)
+
+def index_capabilities(mac, info, services_resolved=False):
+    CAPS_INDEX[mac] = {
+        "caps": device_capabilities(info),
+        "class": info.get("class"),
+        # BlueZ often learns Class/UUIDs after the first advertisement; a
+        # missing tag only counts once its source is known
+        "has_class": bool(info.get("class")),
+        # an empty UUID list is only final once BlueZ resolved the services
+        "has_uuids": bool(info.get("uuids")) or services_resolved,
+        "paired": bool(info.get("paired")),
+        "connected": bool(info.get("connected")),
+        "ts": time.time(),
+    }
+    return CAPS_INDEX[mac]
+
+def parse_caps(value):
+    """Parse ``?caps=a,b``; raise ValueError for unknown capability names."""
+    caps = frozenset(c.strip().lower() for c in (value or "").split(",") if c.strip())
+    unknown = caps - CAPABILITIES
+    if unknown:
+        raise ValueError(f"unknown capability: {', '.join(sorted(unknown))}")
+    return caps
+
+def is_audio_capable(info):
+    """Audio/Video major class, or an A2DP sink service."""
+    return "audio" in device_capabilities(info)
 
 def wait_info(mac, key, want=True, tries=12, delay=0.5):
     for _ in range(tries):
@@ -162,87 +597,575 @@ def wait_info(mac, key, want=True, tries=12, delay=0.5):
         time.sleep(delay)
     return get_info(mac)
 
-# ------------------ Persistent scanner session ------------------
+# ------------------ Scan filters ------------------
+def parse_scan_filter(params):
+    """Validate scan filter parameters; raise ValueError on bad input."""
+    flt = {"transport": None, "rssi": None, "uuids": [], "duplicate_data": None}
 
-def _scan_reader(pipe):
-    for line in pipe:
-        # bluetoothctl prefixes scan lines with markers like "[NEW]" or
-        # "[CHG]". Using ``search`` instead of ``match`` lets us extract the
-        # MAC address regardless of any leading tag so RSSI updates still bump
-        # the availability timestamp for known devices.
-        m = DEVICE_LINE.search(line)
-        if not m:
-            continue
-        mac = m.group(1)
-        now = time.time()
-        LAST_SEEN[mac] = now
+    transport = params.get("transport")
+    if transport not in (None, ""):
+        transport = str(transport).lower()
+        if transport not in SCAN_TRANSPORTS:
+            raise ValueError(f"transport must be one of {', '.join(SCAN_TRANSPORTS)}")
+        flt["transport"] = transport
 
-        # Resolve the public/identity address for devices that advertise with a
-        # temporary random address. Cache lookups to avoid excessive
-        # bluetoothctl calls when the same address appears repeatedly in the
-        # scan output.
-        cached = IDENTITY_CACHE.get(mac)
-        pub = None
-        if cached and now - cached[1] < 5.0:
-            pub = cached[0]
-        else:
+    rssi = params.get("rssi")
+    if rssi not in (None, ""):
+        try:
+            rssi = int(rssi)
+        except (TypeError, ValueError):
+            raise ValueError("rssi must be an integer (dBm)")
+        if not -127 <= rssi <= 20:
+            raise ValueError("rssi must be between -127 and 20 dBm")
+        flt["rssi"] = rssi
+
+    uuids = params.get("uuids") or []
+    if isinstance(uuids, str):
+        uuids = [u for u in re.split(r"[,\s]+", uuids) if u]
+    for u in uuids:
+        if not isinstance(u, str) or not UUID_ARG.match(u):
+            raise ValueError(f"invalid service UUID: {u}")
+    flt["uuids"] = [u.lower() for u in uuids]
+
+    dup = params.get("duplicate_data")
+    if dup not in (None, ""):
+        flt["duplicate_data"] = _truthy(dup)
+    return flt
+
+def scan_filter_active(flt):
+    return any(v not in (None, []) for v in flt.values())
+
+def scan_filter_cmds(flt):
+    """bluetoothctl commands that install ``flt`` as the discovery filter."""
+    cmds = ["menu scan", "clear"]
+    if flt.get("transport"):
+        cmds.append(f"transport {flt['transport']}")
+    if flt.get("rssi") is not None:
+        cmds.append(f"rssi {flt['rssi']}")
+    if flt.get("uuids"):
+        cmds.append("uuids " + " ".join(flt["uuids"]))
+    if flt.get("duplicate_data") is not None:
+        cmds.append("duplicate-data " + ("on" if flt["duplicate_data"] else "off"))
+    cmds.append("back")
+    return cmds
+
+def scan_rate(now=None):
+    now = now or time.time()
+    secs = max(now - SCAN_STATS["since"], 1e-6) if SCAN_STATS["since"] else 0.0
+    return {
+        "lines": SCAN_STATS["lines"],
+        "matched": SCAN_STATS["matched"],
+        "updates": SCAN_STATS["updates"],
+        "seconds": round(secs, 1),
+        "lines_per_sec": round(SCAN_STATS["lines"] / secs, 2) if secs else 0.0,
+    }
+
+def _reset_scan_stats(keep_previous=True):
+    """Start a new measurement window.
+
+    The old window becomes ``previous`` only if it saw output under another
+    filter, so scanner restarts with the same filter (scan off/on, pairing,
+    watchdog) never replace the "before the filter change" figures.
+    """
+    if keep_previous and SCAN_STATS["lines"] and SCAN_STATS["filter"] != SCAN_FILTER:
+        SCAN_STATS["previous"] = {**scan_rate(), "filter": dict(SCAN_STATS.get("filter") or {})}
+    SCAN_STATS["lines"] = 0
+    SCAN_STATS["matched"] = 0
+    SCAN_STATS["updates"] = 0
+    SCAN_STATS["since"] = time.time()
+    SCAN_STATS["filter"] = dict(SCAN_FILTER)
+
+# ------------------ Scan scheduler ------------------
+def _param_seconds(params, key, lo, hi):
+    value = params.get(key)
+    if value in (None, ""):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a number of seconds")
+    if not lo <= value <= hi:
+        raise ValueError(f"{key} must be between {lo:g} and {hi:g} seconds")
+    return value
+
+def parse_scan_duty(params):
+    """Validate duty-cycle / idle parameters; raise ValueError on bad input."""
+    window = _param_seconds(params, "window", SCAN_DUTY_MIN_WINDOW, SCAN_DUTY_MAX_INTERVAL)
+    interval = _param_seconds(params, "interval", SCAN_DUTY_MIN_WINDOW, SCAN_DUTY_MAX_INTERVAL)
+    if (window is None) != (interval is None):
+        raise ValueError("window and interval must be given together")
+    if window is not None and window > interval:
+        raise ValueError("window must not be longer than interval")
+    if window is not None and window == interval:
+        window = interval = None  # always on
+    idle = _param_seconds(params, "idle_timeout", 0, 7 * 86400)
+    if idle is None:
+        idle = float(os.environ.get("BT_WEB_SCAN_IDLE_TIMEOUT", SCAN_IDLE_TIMEOUT))
+    return {"window": window, "interval": interval, "idle_timeout": idle or None}
+
+def note_client():
+    """Record that a UI client is still polling (keeps a wanted scan alive)."""
+    SCAN_DUTY["last_client"] = time.time()
+
+def audio_streaming():
+    return any(st in ("active", "pending") for st in AUDIO_TRANSPORTS.values())
+
+def _duty_phase(now):
+    """(discovery on?, seconds until the duty cycle flips; None if continuous)."""
+    window, interval = SCAN_DUTY["window"], SCAN_DUTY["interval"]
+    if not window:
+        return True, None
+    pos = (now - SCAN_DUTY["cycle_start"]) % interval
+    if pos < window:
+        return True, window - pos
+    return False, interval - pos
+
+def scan_pause_reasons():
+    reasons = sorted(r for r, n in SCAN_DUTY["pauses"].items() if n)
+    if audio_streaming():
+        reasons.append("audio")
+    return reasons
+
+def _discovery_wanted(now):
+    """Whether discovery should be on now; None leaves the session alone."""
+    if any(SCAN_DUTY["holds"].values()):
+        return True
+    if not SCAN_STATE.get("wanted"):
+        return None
+    if scan_pause_reasons():
+        return False
+    return _duty_phase(now)[0]
+
+def _apply_discovery(now=None):
+    """Send ``scan on``/``scan off`` to the scanner session if the schedule changed."""
+    with SCAN_DUTY_COND:
+        p = SCAN_PROC.get("p")
+        if not p or p.poll() is not None:
+            return
+        on = _discovery_wanted(now or time.time())
+        if on is None or on == SCAN_DUTY["discovering"]:
+            return
+        try:
+            _scan_send(p, ["scan on" if on else "scan off"])
+        except Exception:
+            return
+        SCAN_DUTY["discovering"] = on
+        SCAN_DUTY_COND.notify_all()
+
+@contextmanager
+def _scan_override(kind, reason):
+    with SCAN_DUTY_COND:
+        SCAN_DUTY[kind][reason] = SCAN_DUTY[kind].get(reason, 0) + 1
+    _apply_discovery()
+    try:
+        yield
+    finally:
+        with SCAN_DUTY_COND:
+            SCAN_DUTY[kind][reason] -= 1
+        _apply_discovery()
+
+def scan_paused(reason):
+    """Keep discovery off (e.g. while connecting or streaming) for the block."""
+    return _scan_override("pauses", reason)
+
+def scan_held(reason):
+    """Keep discovery on for the block, overriding pauses and the duty cycle."""
+    return _scan_override("holds", reason)
+
+def _last_output(p):
+    return getattr(p, "last_output", 0.0) if p is not None else 0.0
+
+def scan_watch_status(now=None):
+    now = now or time.time()
+    w = SCAN_WATCH
+    last = _last_output(SCAN_PROC.get("p"))
+    gap = now - w["down_since"] if w["down_since"] else 0.0
+    return {
+        "restarts": w["restarts"],
+        "exits": w["exits"],
+        "hangs": w["hangs"],
+        "failed_starts": w["failures"],
+        "heartbeats": w["heartbeats"],
+        "downtime_s": round(w["downtime"] + gap, 2),
+        "down": w["down_since"] is not None,
+        "quiet_s": round(now - last, 1) if last else None,
+        "last_restart": w["last_restart"],
+    }
+
+def _restart_scanner(reason, down_since):
+    """Replace a dead or hung scanner session; return seconds until the next check."""
+    w = SCAN_WATCH
+    with SCAN_PROC_LOCK:
+        # A scan_off or shutdown may have stopped the session since the caller looked
+        if not SCAN_STATE.get("wanted") or SHUTTING_DOWN.is_set():
+            return SCAN_HEARTBEAT_TIMEOUT
+        old = SCAN_PROC.get("p")
+        SCAN_PROC["p"] = None; SCAN_PROC["t"] = None
+        SCAN_DUTY["discovering"] = False
+        AUDIO_TRANSPORTS.clear()
+        if w["down_since"] is None:
+            w[reason + "s"] += 1
+            w["down_since"] = down_since
+        if old is not None:
             try:
-                info = get_info(mac)
-                pub = info.get("identity")
+                old.kill()
+                old.wait(1)
             except Exception:
-                pub = None
-            IDENTITY_CACHE[mac] = (pub, now)
+                pass
+        try:
+            _start_persistent_scan()
+        except Exception as e:
+            w["failures"] += 1
+            if hasattr(app, "logger"):
+                app.logger.warning("Scanner restart failed: %s", e)
+            return min(0.5 * 2 ** min(w["failures"], 10), SCAN_RESTART_MAX_BACKOFF)
+        now = time.time()
+        gap = now - w["down_since"]
+        w["downtime"] += gap
+        w["down_since"] = None
+        w["failures"] = 0
+        w["restarts"] += 1
+        w["last_restart"] = {"ts": now, "reason": reason, "gap_s": round(gap, 2)}
+    single_flight_invalidate()
+    log_append(f"\x1b[1m== scanner-restart\x1b[0m\nsession {reason}, scanning again after {gap:.1f}s")
+    return SCAN_HEARTBEAT_TIMEOUT
 
-        if pub:
-            LAST_SEEN[pub] = now
+def _scan_watchdog(now):
+    """Check the scanner session; return seconds until it needs another look."""
+    w = SCAN_WATCH
+    p = SCAN_PROC.get("p")
+    if p is None or w["eof"] or p.poll() is not None:
+        return _restart_scanner("exit", w["eof"] or now)
+    last = _last_output(p)
+    if w["probe_sent"]:
+        if last >= w["probe_sent"]:
+            w["probe_sent"] = 0.0
+        elif now - w["probe_sent"] >= SCAN_HEARTBEAT_TIMEOUT:
+            return _restart_scanner("hang", last)
+        else:
+            return w["probe_sent"] + SCAN_HEARTBEAT_TIMEOUT - now
+    quiet = now - last
+    if quiet < SCAN_HEARTBEAT_IDLE:
+        return SCAN_HEARTBEAT_IDLE - quiet
+    # "version" is answered by bluetoothctl itself without touching the radio
+    try:
+        _scan_send(p, ["version"])
+    except Exception:
+        return _restart_scanner("exit", now)
+    w["probe_sent"] = now
+    w["heartbeats"] += 1
+    return SCAN_HEARTBEAT_TIMEOUT
 
-def _start_persistent_scan():
-    if SCAN_PROC["p"] and SCAN_PROC["p"].poll() is None:
+def _auto_stop_scan(now):
+    idle = now - SCAN_DUTY["last_client"]
+    SCAN_STATE["wanted"] = False
+    SCAN_STATE["start_ts"] = 0
+    SCAN_DUTY["auto_stopped"] = {"reason": "idle", "ts": now, "idle_s": round(idle, 1)}
+    _stop_persistent_scan()
+    single_flight_invalidate()
+    log_append(f"\x1b[1m== scan-off\x1b[0m\nno client for {idle:.0f}s, discovery stopped")
+
+def _scan_tick(now):
+    """One scheduler step; return seconds to sleep, or None once scanning ended."""
+    if not SCAN_STATE.get("wanted"):
+        return None
+    idle = SCAN_DUTY["idle_timeout"]
+    if idle and now - SCAN_DUTY["last_client"] >= idle:
+        _auto_stop_scan(now)
+        return None
+    wait = min(5.0, _scan_watchdog(now))
+    _apply_discovery(now)
+    edge = _duty_phase(now)[1]
+    if edge is not None:
+        wait = min(wait, edge)
+    if idle:
+        wait = min(wait, SCAN_DUTY["last_client"] + idle - now)
+    return max(wait, 0.05)
+
+def _scan_scheduler():
+    while True:
+        wait = _scan_tick(time.time())
+        with SCAN_DUTY_COND:
+            if wait is None or not SCAN_STATE.get("wanted"):
+                SCAN_DUTY["thread"] = None
+                return
+            SCAN_DUTY_COND.wait(wait)
+
+def _ensure_scan_scheduler():
+    with SCAN_DUTY_COND:
+        t = SCAN_DUTY["thread"]
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_scan_scheduler, daemon=True)
+            SCAN_DUTY["thread"] = t
+            t.start()
+        SCAN_DUTY_COND.notify_all()
+
+def scan_duty_status(now=None):
+    now = now or time.time()
+    idle = SCAN_DUTY["idle_timeout"]
+    return {
+        "window": SCAN_DUTY["window"],
+        "interval": SCAN_DUTY["interval"],
+        "idle_timeout": idle,
+        "discovering": SCAN_DUTY["discovering"],
+        "paused": scan_pause_reasons(),
+        "streaming": audio_streaming(),
+        "idle_s": round(now - SCAN_DUTY["last_client"], 1) if SCAN_DUTY["last_client"] else None,
+        "auto_stopped": SCAN_DUTY["auto_stopped"],
+    }
+
+# ------------------ Persistent scanner session ------------------
+
+def _scan_chunks(pipe, size=None):
+    """Yield raw chunks from a binary pipe, or items from an iterable of lines."""
+    if not hasattr(pipe, "read"):
+        for item in pipe:
+            yield item.encode() if isinstance(item, str) else item
         return
-    adapter = _get_adapter_mac()
-    p = subprocess.Popen(
-        ["bluetoothctl"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-        text=True,
-        bufsize=1
-    )
-    SCAN_PROC["p"] = p
-    SCAN_PROC["adapter"] = adapter
-    t = threading.Thread(target=_scan_reader, args=(p.stdout,), daemon=True)
-    t.start()
-    SCAN_PROC["t"] = t
+    read = getattr(pipe, "read1", None) or pipe.read
+    size = size or SCAN_READ_SIZE
+    while True:
+        chunk = read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def _resolve_identity(mac, now):
+    # Resolve the public/identity address for devices that advertise with a
+    # temporary random address. Runs on the identity worker, never on the
+    # scan reader, since every lookup spawns bluetoothctl.
+    try:
+        with bctl_priority(PRIO_IDENTITY):
+            info = get_info(mac)
+        pub = info.get("identity")
+    except Exception:
+        # Failed or cancelled: not cached, so the next sighting retries
+        return None
+    IDENTITY_CACHE[mac] = (pub, now)
+    return pub
+
+def _queue_identity(macs):
+    """Hand scanned MACs to the identity worker; already queued ones are skipped."""
+    q = IDENTITY_QUEUE
+    with IDENTITY_COND:
+        pending = q["pending"]
+        for mac, seen in macs:
+            if mac == q["busy"]:
+                continue
+            if mac in pending or len(pending) < IDENTITY_QUEUE_MAX:
+                pending[mac] = seen
+            else:
+                # Not cached, so the next sighting queues it again
+                q["dropped"] += 1
+        q["backlog_max"] = max(q["backlog_max"], len(pending))
+        _ensure_identity_worker()
+        IDENTITY_COND.notify()
+
+def _identity_worker():
+    q = IDENTITY_QUEUE
+    while True:
+        with IDENTITY_COND:
+            while not q["pending"]:
+                IDENTITY_COND.wait()
+            mac = next(iter(q["pending"]))
+            seen = q["pending"].pop(mac)
+            q["busy"] = mac
+        pub = _resolve_identity(mac, time.time())
+        if pub:
+            LAST_SEEN[pub] = max(LAST_SEEN.get(pub, 0.0), LAST_SEEN.get(mac, seen))
+        with IDENTITY_COND:
+            q["busy"] = None
+            q["lookups"] += 1
+            IDENTITY_COND.notify_all()
+
+def _ensure_identity_worker():
+    t = IDENTITY_QUEUE["worker"]
+    if t is None or not t.is_alive():
+        t = threading.Thread(target=_identity_worker, daemon=True)
+        t.start()
+        IDENTITY_QUEUE["worker"] = t
+
+def identity_drain(timeout=None):
+    """Wait until every queued identity lookup has finished; False on timeout."""
+    q = IDENTITY_QUEUE
+    with IDENTITY_COND:
+        return IDENTITY_COND.wait_for(lambda: not q["pending"] and q["busy"] is None, timeout)
+
+def identity_status():
+    q = IDENTITY_QUEUE
+    return {"backlog": len(q["pending"]) + (q["busy"] is not None),
+            "backlog_max": q["backlog_max"], "lookups": q["lookups"], "dropped": q["dropped"]}
+
+def _apply_scan_updates(macs, now):
+    """Apply one coalesced batch of sightings to LAST_SEEN.
+
+    Identities come from IDENTITY_CACHE; addresses without a fresh entry are
+    queued for the identity worker instead of being looked up here.
+    """
+    stale = []
+    for raw in macs:
+        mac = raw.decode()
+        LAST_SEEN[mac] = now
+        cached = IDENTITY_CACHE.get(mac)
+        if cached:
+            if cached[0]:
+                LAST_SEEN[cached[0]] = now
+            if now - cached[1] < IDENTITY_TTL:
+                continue
+        stale.append((mac, now))
+    if stale:
+        _queue_identity(stale)
+    SCAN_STATS["updates"] += len(macs)
+
+def _note_transports(data, end):
+    """Track media transport state changes printed by the scanner session."""
+    changed = False
+    for kind, path, state in SCAN_TRANSPORT.findall(data, 0, end):
+        path = path.decode(errors="ignore")
+        if kind == b"DEL":
+            changed |= AUDIO_TRANSPORTS.pop(path, None) is not None
+        elif state:
+            state = state.decode()
+            changed |= AUDIO_TRANSPORTS.get(path) != state
+            AUDIO_TRANSPORTS[path] = state
+    if changed:
+        _apply_discovery()
+
+def _scan_reader(pipe, session=None):
+    """Ingest scanner output in large chunks, coalescing repeat sightings.
+
+    Complete lines in each chunk are scanned with one ``findall`` instead of
+    being split, and MACs seen within SCAN_COALESCE_WINDOW collapse into a
+    single LAST_SEEN/identity update. When a read comes back short the pipe
+    is drained, so pending updates are applied straight away. Output is
+    stamped on ``session`` (the bluetoothctl process) for the watchdog.
+    """
+    tail = b""
+    pending = set()
+    last_flush = time.time()
+    for chunk in _scan_chunks(pipe):
+        data = tail + chunk if tail else chunk
+        cut = data.rfind(b"\n") + 1
+        tail = data[cut:]
+        if cut:
+            SCAN_STATS["lines"] += data.count(b"\n", 0, cut)
+            # bluetoothctl prefixes scan lines with markers like "[NEW]" or
+            # "[CHG]". Searching for the "Device <MAC>" token extracts the
+            # address regardless of any leading tag so RSSI updates still
+            # bump the availability timestamp for known devices.
+            found = SCAN_DEVICE_TOKEN.findall(data, 0, cut)
+            if b"Transport" in data:
+                _note_transports(data, cut)
+            pending.update(found)
+            SCAN_STATS["matched"] += len(found)
+        now = time.time()
+        if session is not None:
+            session.last_output = now
+        if pending and (len(chunk) < SCAN_READ_SIZE or now - last_flush >= SCAN_COALESCE_WINDOW):
+            _apply_scan_updates(pending, now)
+            pending = set()
+            last_flush = now
+    if tail:
+        SCAN_STATS["lines"] += 1
+        m = SCAN_DEVICE_TOKEN.search(tail)
+        if m:
+            pending.add(m.group(1))
+            SCAN_STATS["matched"] += 1
+    if pending:
+        _apply_scan_updates(pending, time.time())
+
+def _scan_reader_main(p):
+    """Reader thread body; reports EOF of the current session to the supervisor."""
+    sid = getattr(p, "capture_sid", None)
+    try:
+        _scan_reader(_captured_chunks(p.stdout, sid) if sid else p.stdout, session=p)
+    except Exception:
+        if hasattr(app, "logger"):
+            app.logger.exception("Scanner reader failed")
+    if SCAN_PROC.get("p") is p:
+        SCAN_WATCH["eof"] = time.time()
+        with SCAN_DUTY_COND:
+            SCAN_DUTY_COND.notify_all()
+
+def _scan_send(p, cmds):
+    for c in cmds:
+        _capture(getattr(p, "capture_sid", None), "in", c + "\n")
+        p.stdin.write(c.encode() + b"\n")
+        p.stdin.flush()
+
+def scan_init_cmds(adapter):
+    """Commands that bring a new scanner session to the wanted state."""
     init = []
     if adapter: init.append(f"select {adapter}")
-    init += ["power on", "agent NoInputNoOutput", "default-agent", "pairable on", "scan on"]
-    for c in init:
+    init += ["power on", "agent NoInputNoOutput", "default-agent", "pairable on"]
+    if scan_filter_active(SCAN_FILTER):
+        init += scan_filter_cmds(SCAN_FILTER)
+    init.append("scan on")
+    return init
+
+def _start_persistent_scan():
+    with SCAN_PROC_LOCK:
+        if SCAN_PROC["p"] and SCAN_PROC["p"].poll() is None:
+            return
+        adapter = _get_adapter_mac()
+        p = subprocess.Popen(
+            ["bluetoothctl"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+        )
+        if CAPTURE["fh"]:
+            p.capture_sid = capture_session("scan", ["bluetoothctl"])
+        now = time.time()
+        p.last_output = now
+        SCAN_WATCH.update(started=now, eof=None, probe_sent=0.0)
+        SCAN_PROC["p"] = p
+        SCAN_PROC["adapter"] = adapter
+        _reset_scan_stats()
+        t = threading.Thread(target=_scan_reader_main, args=(p,), daemon=True)
+        t.start()
+        SCAN_PROC["t"] = t
         try:
-            p.stdin.write(c + "\n"); p.stdin.flush()
+            _scan_send(p, scan_init_cmds(adapter))
         except Exception:
-            break
+            pass
+        SCAN_DUTY["discovering"] = True
+    _apply_discovery()
+
+def _wait_scanner_ready(timeout=SCAN_READY_TIMEOUT):
+    """Wait until the current scanner session has printed something."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if _last_output(SCAN_PROC.get("p")) > SCAN_WATCH["started"]:
+            return True
+        time.sleep(0.05)
+    return False
 
 def _persistent_write(lines):
     p = SCAN_PROC.get("p")
     if not p or p.poll() is not None:
         _start_persistent_scan()
         p = SCAN_PROC["p"]
-        time.sleep(0.4)
+        _wait_scanner_ready()
     for cmd in lines:
         try:
-            p.stdin.write(cmd + "\n")
-            p.stdin.flush()
+            _scan_send(p, [cmd])
         except Exception:
             pass
 
 def _stop_persistent_scan():
-    p = SCAN_PROC.get("p")
-    SCAN_PROC["p"] = None; SCAN_PROC["adapter"] = None; SCAN_PROC["t"] = None
+    with SCAN_PROC_LOCK:
+        p = SCAN_PROC.get("p")
+        SCAN_PROC["p"] = None; SCAN_PROC["adapter"] = None; SCAN_PROC["t"] = None
+        SCAN_DUTY["discovering"] = False
+        SCAN_WATCH["down_since"] = None
+        AUDIO_TRANSPORTS.clear()
     if not p: return
     try:
         if p.poll() is None:
             for c in ["scan off", "quit"]:
-                try: p.stdin.write(c + "\n"); p.stdin.flush()
+                try: _scan_send(p, [c])
                 except Exception: pass
             for _ in range(10):
                 if p.poll() is not None: break
@@ -255,11 +1178,117 @@ def _stop_persistent_scan():
 
 @atexit.register
 def _cleanup():
+    SHUTTING_DOWN.set()
     _stop_persistent_scan()
 
+# ------------------ State handoff across restarts ------------------
+def _state_path():
+    path = os.environ.get("BT_WEB_STATE_FILE")
+    if path:
+        return path
+    # systemd sets STATE_DIRECTORY for StateDirectory=; fall back to the app dir
+    base = (os.environ.get("STATE_DIRECTORY") or "").split(":")[0]
+    return os.path.join(base or os.path.dirname(__file__), "state.json")
+
+def save_state(path=None):
+    """Write caches and scan state so the next process can start warm."""
+    path = path or _state_path()
+    snap = {
+        "ts": time.time(),
+        "last_seen": dict(LAST_SEEN),
+        "identity_cache": {k: list(v) for k, v in list(IDENTITY_CACHE.items())},
+        "scan_state": dict(SCAN_STATE),
+        "scan_filter": dict(SCAN_FILTER),
+        "scan_duty": {k: SCAN_DUTY[k] for k in ("window", "interval", "idle_timeout")},
+        "adapter": dict(ADAPTER_CACHE),
+        "caps_index": {k: {**v, "caps": sorted(v["caps"])} for k, v in list(CAPS_INDEX.items())},
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(snap, f)
+    os.replace(tmp, path)
+    return snap
+
+def load_state(path=None, max_age=STATE_MAX_AGE):
+    """Restore a snapshot written by ``save_state``; return True if applied."""
+    path = path or _state_path()
+    try:
+        with open(path) as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if time.time() - snap.get("ts", 0) > max_age:
+        return False
+    LAST_SEEN.update(snap.get("last_seen") or {})
+    for mac, (pub, ts) in (snap.get("identity_cache") or {}).items():
+        IDENTITY_CACHE[mac] = (pub, ts)
+    SCAN_STATE.update(snap.get("scan_state") or {})
+    SCAN_FILTER.update(snap.get("scan_filter") or {})
+    SCAN_DUTY.update(snap.get("scan_duty") or {})
+    ADAPTER_CACHE.update(snap.get("adapter") or {})
+    for mac, entry in (snap.get("caps_index") or {}).items():
+        CAPS_INDEX[mac] = {**entry, "caps": frozenset(entry.get("caps") or ())}
+    return True
+
+def _systemd_listen_fd():
+    """Return the socket fd handed over by systemd, if this process owns one."""
+    try:
+        if int(os.environ.get("LISTEN_PID", "0")) != os.getpid():
+            return None
+        if int(os.environ.get("LISTEN_FDS", "0")) < 1:
+            return None
+    except ValueError:
+        return None
+    return SD_LISTEN_FDS_START
+
+def _listen_host(fd):
+    """Bind address matching the family of an inherited socket.
+
+    werkzeug wraps ``fd`` with the family of the host it is given, and a plain
+    ``ListenStream=8080`` socket is dual-stack IPv6.
+    """
+    if fd is None:
+        return "0.0.0.0"
+    with socket.socket(fileno=os.dup(fd)) as s:
+        return "::" if s.family == socket.AF_INET6 else "0.0.0.0"
+
+def serve(port):
+    """Serve on the systemd-provided socket (or ``port``), draining on SIGTERM.
+
+    With socket activation the listening socket outlives the process, so
+    connections made during a restart wait in the backlog instead of being
+    refused. SIGTERM snapshots state, stops accepting and lets in-flight
+    requests finish before exiting.
+    """
+    from werkzeug.serving import make_server
+    fd = _systemd_listen_fd()
+    srv = make_server(_listen_host(fd), port, app, threaded=True, fd=fd)
+    srv.daemon_threads = False
+    srv.block_on_close = True
+
+    def _on_term(signum, frame):
+        SHUTTING_DOWN.set()
+        try:
+            save_state()
+        except Exception:
+            if hasattr(app, "logger"):
+                app.logger.exception("State snapshot failed")
+        # shutdown() blocks until serve_forever returns, so not from this thread
+        threading.Thread(target=srv.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _on_term)
+    try:
+        srv.serve_forever()
+    finally:
+        srv.server_close()
+
 # ------------------ Connect while holding the session ------------------
 def bctl_connect_wait(mac, wait_s=8):
     """Send connect and keep the bluetoothctl session alive while polling."""
+    with bctl_slot():
+        return _bctl_connect_wait(mac, wait_s)
+
+def _bctl_connect_wait(mac, wait_s):
     adapter = _get_adapter_mac()
     p = subprocess.Popen(
         ["bluetoothctl"],
@@ -269,11 +1298,13 @@ def bctl_connect_wait(mac, wait_s=8):
         text=True,
         bufsize=1,
     )
+    sid = capture_session("connect", ["bluetoothctl"])
     cmds = []
     if adapter: cmds.append(f"select {adapter}")
     cmds += ["power on", f"connect {mac}"]
     for c in cmds:
         try:
+            _capture(sid, "in", c + "\n")
             p.stdin.write(c + "\n"); p.stdin.flush()
         except Exception:
             break
@@ -287,6 +1318,7 @@ def bctl_connect_wait(mac, wait_s=8):
             if not line:
                 time.sleep(0.1)
             else:
+                _capture(sid, "out", line)
                 last_out.append(line)
                 if "Connection successful" in line or "Connected: yes" in line:
                     connected = True
@@ -300,6 +1332,7 @@ def bctl_connect_wait(mac, wait_s=8):
             break
 
     try:
+        _capture(sid, "in", "quit\n")
         p.stdin.write("quit\n"); p.stdin.flush()
     except Exception:
         pass
@@ -307,45 +1340,586 @@ def bctl_connect_wait(mac, wait_s=8):
         p.terminate()
     except Exception:
         pass
+    _capture(sid, "exit", p.poll())
 
     return connected, "".join(last_out)
 
+# ------------------ Request coalescing ------------------
+def single_flight(key, fn, ttl=None):
+    """Return ``fn()``, sharing one in-flight call and a short-lived result per ``key``.
+
+    ``hits`` are served from a finished result, ``shared`` waited on a call
+    another request started, ``misses`` ran ``fn`` themselves. Errors are
+    propagated to every waiter but never cached.
+    """
+    ttl = SINGLE_FLIGHT_TTL if ttl is None else ttl
+    with SINGLE_FLIGHT_LOCK:
+        slot = SINGLE_FLIGHT.get(key)
+        if slot and not slot["done"].is_set():
+            SINGLE_FLIGHT_STATS["shared"] += 1
+            leader = False
+        elif slot and slot["error"] is None and time.time() - slot["ts"] < ttl:
+            SINGLE_FLIGHT_STATS["hits"] += 1
+            return slot["result"]
+        else:
+            # Keys come from request parameters, so expired slots are dropped here
+            now = time.time()
+            for k in [k for k, v in SINGLE_FLIGHT.items()
+                      if v["done"].is_set() and now - v["ts"] >= v["ttl"]]:
+                del SINGLE_FLIGHT[k]
+            slot = {"done": threading.Event(), "result": None, "error": None, "ts": 0.0, "ttl": ttl}
+            SINGLE_FLIGHT[key] = slot
+            SINGLE_FLIGHT_STATS["misses"] += 1
+            leader = True
+    if not leader:
+        slot["done"].wait()
+        if slot["error"] is not None:
+            raise slot["error"]
+        return slot["result"]
+    try:
+        slot["result"] = fn()
+    except Exception as exc:
+        slot["error"] = exc
+        raise
+    finally:
+        slot["ts"] = time.time()
+        slot["done"].set()
+    return slot["result"]
+
+def single_flight_invalidate():
+    """Drop finished results so the next read sees state changed by an action."""
+    with SINGLE_FLIGHT_LOCK:
+        for key in [k for k, v in SINGLE_FLIGHT.items() if v["done"].is_set()]:
+            del SINGLE_FLIGHT[key]
+
+# ------------------ Device list views ------------------
+def _device_sort_key(sort, d):
+    """Sort key for one device; unique (ends with the MAC) and JSON-friendly."""
+    name = d.get("alias") or d.get("name") or ""
+    if sort == "paired":
+        return (not d.get("paired"), not d.get("connected"), name.casefold(), d["mac"])
+    if sort == "name":
+        return (name.casefold(), d["mac"])
+    if sort == "rssi":
+        # Strongest first; devices without a reading go last
+        rssi = d.get("rssi")
+        return (-rssi if rssi is not None else 1000, d["mac"])
+    if sort == "last_seen":
+        return (-(d.get("last_seen") or 0.0), d["mac"])
+    return (not d.get("connected"), not d.get("paired"), not d.get("trusted"), name, d["mac"])
+
+def device_views(payload):
+    """Wrap a device list with prefix indexes; sort orders are built on first use."""
+    devs = payload["devices"]
+    return {
+        "payload": payload,
+        "orders": {},
+        "names": sorted(((d.get("alias") or d.get("name") or "").casefold(), i)
+                        for i, d in enumerate(devs)),
+        "macs": sorted((d["mac"].upper(), i) for i, d in enumerate(devs)),
+    }
+
+def _device_order(views, sort):
+    order = views["orders"].get(sort)
+    if order is None:
+        keyed = sorted((_device_sort_key(sort, d), i) for i, d in enumerate(views["payload"]["devices"]))
+        # Racing builders produce the same lists, so last write wins harmlessly
+        order = views["orders"][sort] = ([k for k, _ in keyed], [i for _, i in keyed])
+    return order
+
+def _prefix_matches(index, prefix):
+    out = set()
+    for j in range(bisect.bisect_left(index, (prefix,)), len(index)):
+        key, i = index[j]
+        if not key.startswith(prefix):
+            break
+        out.add(i)
+    return out
+
+def _same_kind(value, sample):
+    if isinstance(sample, (bool, str)):
+        return type(value) is type(sample)
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def encode_cursor(sort, key):
+    raw = json.dumps([sort, list(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        csort, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+    if csort != sort or not isinstance(key, list):
+        raise ValueError("cursor does not match sort")
+    # bisect compares the key with real sort keys, so it must have their shape
+    sample = _device_sort_key(sort, {"mac": ""})
+    if len(key) != len(sample) or not all(map(_same_kind, key, sample)):
+        raise ValueError("invalid cursor")
+    return tuple(key)
+
+def parse_device_page(args):
+    """Validate ``sort``, ``q``, ``cursor`` and ``limit``; raise ValueError."""
+    sort = (args.get("sort") or DEVICE_SORTS[0]).lower()
+    if sort not in DEVICE_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(DEVICE_SORTS)}")
+    q = (args.get("q") or "").strip()
+    limit = args.get("limit")
+    if limit in (None, ""):
+        limit = DEVICE_PAGE_DEFAULT
+    else:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError("limit must be an integer")
+        if not 1 <= limit <= DEVICE_PAGE_MAX:
+            raise ValueError(f"limit must be between 1 and {DEVICE_PAGE_MAX}")
+    cursor = args.get("cursor")
+    after = decode_cursor(cursor, sort) if cursor else None
+    return sort, q, after, limit
+
+def device_page(views, sort, q="", after=None, limit=DEVICE_PAGE_DEFAULT):
+    """One page of a device snapshot; the cached payload is never modified."""
+    payload = views["payload"]
+    devs = payload["devices"]
+    if q:
+        matched = (_prefix_matches(views["names"], q.casefold())
+                   | _prefix_matches(views["macs"], q.upper()))
+        keyed = sorted((_device_sort_key(sort, devs[i]), i) for i in matched)
+        keys, order = [k for k, _ in keyed], [i for _, i in keyed]
+    else:
+        keys, order = _device_order(views, sort)
+    start = bisect.bisect_right(keys, after) if after is not None else 0
+    end = start + limit
+    result = {
+        "devices": [devs[i] for i in order[start:end]],
+        "total": len(order),
+        "sort": sort,
+        "next_cursor": encode_cursor(sort, keys[end - 1]) if end < len(order) else None,
+    }
+    if payload.get("dropped") and after is None:
+        result["dropped"] = payload["dropped"][:DEVICE_PAGE_MAX]
+    return result
+
+def parse_fields(value, allowed):
+    """Parse ``?fields=a,b`` in request order; None means every field."""
+    fields = []
+    for f in (value or "").split(","):
+        f = f.strip()
+        if f and f not in fields:
+            fields.append(f)
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"unknown field: {', '.join(unknown)}")
+    return tuple(fields) or None
+
+def parse_format(value):
+    fmt = (value or DEVICE_FORMATS[0]).lower()
+    if fmt not in DEVICE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(DEVICE_FORMATS)}")
+    return fmt
+
+def project(obj, fields):
+    """Copy of ``obj`` with only ``fields``; shared snapshots are never modified."""
+    return obj if fields is None else {f: obj.get(f) for f in fields}
+
+def encode_devices(page, fields=None, fmt="objects"):
+    """Apply ``?fields=`` and ``?format=`` to a device_page() result."""
+    if fmt == "rows":
+        fields = fields or DEVICE_FIELDS
+        out = {k: v for k, v in page.items() if k != "devices"}
+        out["fields"] = list(fields)
+        out["rows"] = [[d.get(f) for f in fields] for d in page["devices"]]
+        return out
+    if fields is None:
+        return page
+    return {**page, "devices": [project(d, fields) for d in page["devices"]]}
+
+# ------------------ Static assets ------------------
+def _read_sidecar(full, coding, body):
+    """Precompressed variant written next to ``full``, if it matches ``body``."""
+    try:
+        with open(full + ASSET_SIDECARS[coding], "rb") as f:
+            data = f.read()
+        plain = gzip.decompress(data) if coding == "gzip" else brotli.decompress(data)
+    except Exception:
+        return None
+    return data if plain == body else None
+
+def build_assets(static_dir=STATIC_DIR):
+    """Fingerprint every JS/CSS file under ``static_dir``.
+
+    Compressed variants come from up-to-date sidecar files; the rest are
+    filled in by ``_asset_variants`` when the asset is first requested, so
+    start-up never waits for compression.
+    """
+    by_name, by_path = {}, {}
+    for root, _, files in os.walk(static_dir):
+        for fn in sorted(files):
+            base, ext = os.path.splitext(fn)
+            if ext not in ASSET_TYPES:
+                continue
+            full = os.path.join(root, fn)
+            with open(full, "rb") as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            name = os.path.relpath(full, static_dir).replace(os.sep, "/")
+            rel_dir = os.path.dirname(name)
+            hashed = f"{base}.{digest}{ext}"
+            path = f"{rel_dir}/{hashed}" if rel_dir else hashed
+            entry = {
+                "name": name,
+                "url": f"/assets/{path}",
+                "etag": digest,
+                "mimetype": ASSET_TYPES[ext],
+                "identity": body,
+                "gzip": _read_sidecar(full, "gzip", body),
+                "br": _read_sidecar(full, "br", body) if brotli else None,
+            }
+            by_name[name] = entry
+            by_path[path] = entry
+    ASSETS["by_name"], ASSETS["by_path"] = by_name, by_path
+    return by_name
+
+def _asset_variants(entry):
+    """Compress what no sidecar provided; racing requests do the same work."""
+    if entry["gzip"] is None:
+        entry["gzip"] = gzip.compress(entry["identity"], ASSET_GZIP_LEVEL, mtime=0)
+    if brotli and entry["br"] is None:
+        entry["br"] = brotli.compress(entry["identity"], quality=ASSET_BROTLI_QUALITY)
+    return entry
+
+def asset_url(name, fallback=None):
+    """URL of the fingerprinted asset, or ``fallback`` when it is not present."""
+    if ASSETS["by_name"] is None:
+        build_assets()
+    entry = ASSETS["by_name"].get(name)
+    if entry:
+        return entry["url"]
+    return fallback if fallback is not None else f"/static/{name}"
+
+def _accepted_encodings(header):
+    """Codings from an Accept-Encoding header whose q-value is non-zero."""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding.strip() and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def pick_encoding(header, variants):
+    """Choose the smallest available variant the client accepts."""
+    accepted = _accepted_encodings(header)
+    for coding in ("br", "gzip"):
+        if variants.get(coding) is not None and (coding in accepted or "*" in accepted):
+            return coding
+    return "identity"
+
+def _encoded_response(variants, mimetype, etag, cache_control):
+    if request.headers.get("If-None-Match", "").strip('" W/') == etag:
+        resp = app.response_class(status=304)
+    else:
+        coding = pick_encoding(request.headers.get("Accept-Encoding", ""), variants)
+        resp = app.response_class(variants[coding], mimetype=mimetype)
+        if coding != "identity":
+            resp.headers["Content-Encoding"] = coding
+    resp.headers["ETag"] = f'"{etag}"'
+    resp.headers["Cache-Control"] = cache_control
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+def compress_json(resp):
+    """Gzip large JSON bodies when the client accepts it (after_request hook)."""
+    if not (resp.mimetype or "").endswith("json") or resp.direct_passthrough:
+        return resp
+    # The body depends on the header even when it is sent uncompressed
+    resp.headers["Vary"] = "Accept-Encoding"
+    if resp.status_code != 200 or "Content-Encoding" in resp.headers:
+        return resp
+    body = resp.get_data()
+    if len(body) < JSON_GZIP_MIN:
+        return resp
+    if pick_encoding(request.headers.get("Accept-Encoding", ""), {"gzip": body}) != "gzip":
+        return resp
+    resp.set_data(gzip.compress(body, JSON_GZIP_LEVEL, mtime=0))
+    resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
+if hasattr(app, "after_request"):
+    app.after_request(compress_json)
+
+def _read_version():
+    try:
+        with open(VERSION_FILE) as f:
+            return f.read().strip()
+    except Exception:
+        return "unknown"
+
+# ------------------ Deploy queue ------------------
+def _trim_deploys():
+    done = [k for k, d in DEPLOYS.items() if d["status"] not in ("queued", "running")]
+    for k in done[:max(0, len(done) - DEPLOY_HISTORY)]:
+        del DEPLOYS[k]
+
+# deploy.sh ends by restarting this service, which kills the app and the
+# script with it. Records and output therefore live next to the state
+# snapshot, and the next process finishes whatever was left running.
+def _deploys_path():
+    return os.path.join(os.path.dirname(os.path.abspath(_state_path())), "deploys.json")
+
+def _deploy_log(rec, stream):
+    return os.path.join(os.path.dirname(_deploys_path()), f"deploy-{rec['id']}.{stream}")
+
+def save_deploys(path=None):
+    """Write the deploy records; called on every status change."""
+    path = path or _deploys_path()
+    with DEPLOY_COND:
+        recs = [dict(r) for r in DEPLOYS.values()]
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(recs, f)
+    os.replace(tmp, path)
+
+def _collect_deploy_output(rec):
+    """Move the script's output from its log files into ``rec``."""
+    for stream in ("stdout", "stderr"):
+        path = _deploy_log(rec, stream)
+        try:
+            with open(path, errors="replace") as f:
+                rec[stream] = f.read()
+            os.remove(path)
+        except OSError:
+            pass
+
+def load_deploys(path=None):
+    """Restore deploy records; a deploy cut off by the restart is finished here.
+
+    Returns the number of records loaded.
+    """
+    path = path or _deploys_path()
+    try:
+        with open(path) as f:
+            recs = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    with DEPLOY_COND:
+        for rec in recs:
+            if rec["status"] == "running":
+                rec["status"] = "restarted"
+                rec["end_ts"] = time.time()
+                _collect_deploy_output(rec)
+            elif rec["status"] == "queued" and DEPLOY_QUEUE["pending"] is None:
+                DEPLOY_QUEUE["pending"] = rec
+            DEPLOYS.setdefault(rec["id"], rec)
+        _trim_deploys()
+    try:
+        save_deploys(path)
+    except OSError:
+        pass
+    return len(recs)
+
+def enqueue_deploy(script):
+    """Queue a deploy run, folding it into an already queued one if present.
+
+    Returns ``(record, coalesced)``.
+    """
+    with DEPLOY_COND:
+        rec = DEPLOY_QUEUE["pending"]
+        coalesced = rec is not None
+        if coalesced:
+            rec["pushes"] += 1
+        else:
+            rec = {
+                "id": os.urandom(6).hex(),
+                "status": "queued",
+                "script": script,
+                "pushes": 1,
+                "queued_ts": time.time(),
+                "start_ts": None,
+                "end_ts": None,
+                "returncode": None,
+                "stdout": "",
+                "stderr": "",
+            }
+            DEPLOYS[rec["id"]] = rec
+            DEPLOY_QUEUE["pending"] = rec
+            _trim_deploys()
+        _save_deploys_quietly()
+        _ensure_deploy_worker()
+        DEPLOY_COND.notify()
+    return rec, coalesced
+
+def _save_deploys_quietly():
+    try:
+        save_deploys()
+    except Exception:
+        if hasattr(app, "logger"):
+            app.logger.exception("Deploy records could not be saved")
+
+def run_deploy(rec, timeout=None):
+    """Run one queued deploy, recording its output and outcome on ``rec``."""
+    if timeout is None:
+        timeout = float(os.environ.get("GITHUB_WEBHOOK_TIMEOUT", DEFAULT_DEPLOY_TIMEOUT))
+    rec["status"] = "running"
+    rec["start_ts"] = time.time()
+    # On disk before the script can reach its restart step
+    _save_deploys_quietly()
+    try:
+        # Output goes straight to files so it survives the restart; own
+        # session so a timeout can kill git/rsync along with bash
+        with open(_deploy_log(rec, "stdout"), "w") as out, open(_deploy_log(rec, "stderr"), "w") as err:
+            p = subprocess.Popen(["bash", rec["script"]], stdout=out, stderr=err,
+                                 text=True, start_new_session=True)
+        try:
+            p.communicate(timeout=timeout)
+            rec["status"] = "succeeded" if p.returncode == 0 else "failed"
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except Exception:
+                p.kill()
+            p.communicate()
+            rec["status"] = "timeout"
+        rec["returncode"] = p.returncode
+        _collect_deploy_output(rec)
+        if rec["status"] == "timeout":
+            rec["stderr"] += f"\ndeploy timed out after {timeout:g}s\n"
+    except Exception as exc:
+        rec["status"] = "failed"
+        rec["stderr"] = str(exc)
+        if hasattr(app, "logger"):
+            app.logger.exception("Webhook script failed")
+    rec["end_ts"] = time.time()
+    _save_deploys_quietly()
+    if hasattr(app, "logger"):
+        app.logger.info("Deploy %s %s (rc=%s, pushes=%s)",
+                        rec["id"], rec["status"], rec["returncode"], rec["pushes"])
+    return rec
+
+def _deploy_worker():
+    while True:
+        with DEPLOY_COND:
+            while DEPLOY_QUEUE["pending"] is None:
+                DEPLOY_COND.wait()
+            rec = DEPLOY_QUEUE["pending"]
+            DEPLOY_QUEUE["pending"] = None
+        run_deploy(rec)
+
+def _ensure_deploy_worker():
+    t = DEPLOY_QUEUE["worker"]
+    if t is None or not t.is_alive():
+        t = threading.Thread(target=_deploy_worker, daemon=True)
+        t.start()
+        DEPLOY_QUEUE["worker"] = t
+
 # ------------------ API ------------------
 @app.post("/api/scan_on")
+@interactive
 def api_scan_on():
+    params = _request_params()
+    try:
+        flt = parse_scan_filter(params)
+        duty = parse_scan_duty(params)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    changed = flt != SCAN_FILTER
+    SCAN_FILTER.update(flt)
     SCAN_STATE["wanted"] = True
     SCAN_STATE["start_ts"] = time.time()
+    with SCAN_DUTY_COND:
+        SCAN_DUTY.update(duty, cycle_start=SCAN_STATE["start_ts"], auto_stopped=None)
+        note_client()
     try:
-        _start_persistent_scan()
+        running = SCAN_PROC["p"] is not None and SCAN_PROC["p"].poll() is None
+        if running and changed:
+            # BlueZ applies a new filter when discovery restarts
+            _persistent_write(["scan off"] + scan_filter_cmds(flt) + ["scan on"])
+            SCAN_DUTY["discovering"] = True
+            _reset_scan_stats()
+        else:
+            _start_persistent_scan()
     except Exception:
         SCAN_STATE["wanted"] = False
         SCAN_STATE["start_ts"] = 0
         return jsonify({"ok": False, "status": {}, "log": ""})
+    _ensure_scan_scheduler()
     time.sleep(0.5)
-    return jsonify({"ok": True, "status": adapter_status(), "log": ""})
+    single_flight_invalidate()
+    return jsonify({"ok": True, "status": adapter_status(), "filter": SCAN_FILTER,
+                    "duty": scan_duty_status(), "log": ""})
 
 @app.post("/api/scan_off")
+@interactive
 def api_scan_off():
     SCAN_STATE["wanted"] = False
     SCAN_STATE["start_ts"] = 0
     _stop_persistent_scan()
+    with SCAN_DUTY_COND:
+        SCAN_DUTY_COND.notify_all()
     time.sleep(0.3)
+    single_flight_invalidate()
     return jsonify({"ok": True, "status": adapter_status(), "log": ""})
 
-@app.get("/api/scan_status")
-def api_scan_status():
+def scan_status_payload():
     st = adapter_status()
     running = SCAN_PROC["p"] is not None and SCAN_PROC["p"].poll() is None
-    return jsonify({"status": st, "running": running, "wanted": SCAN_STATE["wanted"]})
+    stats = {**scan_rate(), "previous": SCAN_STATS["previous"]}
+    return {"status": st, "running": running, "wanted": SCAN_STATE["wanted"],
+            "filter": dict(SCAN_FILTER), "stats": stats, "duty": scan_duty_status(),
+            "watchdog": scan_watch_status(), "identity": identity_status()}
 
-@app.get("/api/devices")
-def api_devices():
-    audio_only = request.args.get("audio_only") in ("1", "true", "yes", "on")
+@app.get("/api/scan_status")
+@busy_as_503
+def api_scan_status():
+    note_client()
+    return jsonify(single_flight(("scan_status",), scan_status_payload))
+
+def _index_caps_known(entry):
+    """Tags whose absence from ``entry`` means the device really lacks them."""
+    known = set()
+    if entry.get("has_class"):
+        known |= CLASS_CAPS
+    if entry.get("has_uuids"):
+        known |= UUID_CAP_NAMES
+        if entry.get("has_class"):
+            known.add("audio")
+    return known
+
+def _index_may_match(entry, audio_only, caps):
+    """False when the capability index alone rules a device out.
+
+    A Class-only entry can only rule a device out on Class-derived tags, a
+    UUID-only one on UUID-derived tags; "audio" needs both.
+    """
+    known = _index_caps_known(entry)
+    if (caps - entry["caps"]) & known:
+        return False
+    sticky = entry["paired"] or entry["connected"]
+    return not audio_only or sticky or "audio" in entry["caps"] or "audio" not in known
+
+def device_list_payload(audio_only, caps=frozenset()):
     base = list_devices()
     merged = {}
     dropped = []
+    now = time.time()
     for d in base:
+        entry = CAPS_INDEX.get(d["mac"])
+        if entry and now - entry["ts"] < CAPS_INDEX_TTL and not _index_may_match(entry, audio_only, caps):
+            if audio_only and "audio" not in entry["caps"]:
+                dropped.append({"mac": d["mac"], "name": d.get("name") or "", "class": entry["class"]})
+            continue
         info = get_info(d["mac"])
+        entry = index_capabilities(d["mac"], info)
+        if caps and not caps <= entry["caps"]:
+            continue
         if d.get("type") == "random" and not info.get("identity"):
             continue
         start_ts = SCAN_STATE.get("start_ts", 0) if SCAN_STATE.get("wanted") else 0
@@ -354,7 +1928,9 @@ def api_devices():
         pub_mac = info.get("identity") or d["mac"]
         name = info.get("alias") or d.get("name") or ""
         audio_ok = is_audio_capable(info)
-        device = {**d, **info, "alias": info.get("alias"), "mac": pub_mac}
+        device = {**d, **info, "alias": info.get("alias"), "mac": pub_mac,
+                  "caps": sorted(entry["caps"]),
+                  "last_seen": LAST_SEEN.get(pub_mac) or LAST_SEEN.get(d["mac"])}
         if (not audio_only) or audio_ok or info.get("paired") or info.get("connected"):
             existing = merged.get(pub_mac)
             if existing:
@@ -365,15 +1941,8 @@ def api_devices():
             if audio_only and (not audio_ok) and (not info.get("paired")) and (not info.get("connected")):
                 print(f"[drop] mac={pub_mac} name={name} class={info.get('class')}")
                 dropped.append({"mac": pub_mac, "name": name, "class": info.get("class")})
+    # Ordering is left to device_views(), once per refresh
     enriched = list(merged.values())
-    enriched.sort(
-        key=lambda x: (
-            not x.get("connected"),
-            not x.get("paired"),
-            not x.get("trusted"),
-            (x.get("alias") or x.get("name") or ""),
-        )
-    )
 
     if not SCAN_STATE.get("wanted"):
         enriched = [d for d in enriched if d.get("paired") and d.get("trusted")]
@@ -381,69 +1950,121 @@ def api_devices():
     result = {"devices": enriched}
     if dropped:
         result["dropped"] = dropped
-    return jsonify(result)
+    return result
+
+@app.get("/api/devices")
+@busy_as_503
+def api_devices():
+    note_client()
+    args = request.args
+    audio_only = args.get("audio_only") in ("1", "true", "yes", "on")
+    try:
+        caps = parse_caps(args.get("caps"))
+        sort, q, after, limit = parse_device_page(args)
+        fields = parse_fields(args.get("fields"), DEVICE_FIELDS)
+        fmt = parse_format(args.get("format"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    # The result depends on scan state, so a scan toggle never shares a slot.
+    # Paging parameters are not part of the key: every page reads one snapshot.
+    key = ("devices", audio_only, caps, SCAN_STATE.get("wanted"), SCAN_STATE.get("start_ts"))
+    views = single_flight(key, lambda: device_views(device_list_payload(audio_only, caps)))
+    return jsonify(encode_devices(device_page(views, sort, q, after, limit), fields, fmt))
 
 @app.get("/api/info")
+@busy_as_503
 def api_info():
-    mac = request.args.get("mac","")
-    return jsonify(get_info(mac))
+    note_client()
+    mac = request.args.get("mac","").upper()
+    if not MAC_ADDR.fullmatch(mac):
+        return jsonify({"ok": False, "error": "invalid mac"}), 400
+    try:
+        fields = parse_fields(request.args.get("fields"), INFO_FIELDS)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify(project(single_flight(("info", mac), lambda: get_info(mac)), fields))
+
+@app.get("/api/stats")
+def api_stats():
+    with SINGLE_FLIGHT_LOCK:
+        sf = {**SINGLE_FLIGHT_STATS, "entries": len(SINGLE_FLIGHT)}
+    return jsonify({"single_flight": sf, "bctl": bctl_stats(), "scanner": scan_watch_status()})
+
+@app.get("/api/logs")
+def api_logs():
+    note_client()
+    try:
+        cursor = int(request.args.get("cursor", 0))
+    except (TypeError, ValueError):
+        cursor = 0
+    entries, head, reset = log_since(cursor, request.args.get("boot"))
+    return jsonify({"entries": entries, "cursor": head, "boot": OP_LOG_STATE["boot"], "reset": reset})
 
 @app.post("/api/connect")
+@interactive
 def api_connect():
     mac = request.json.get("mac","")
     logs = []
 
     def logstep(tag, out=""):
-        logs.append(f"\x1b[1m== {tag}\x1b[0m\n{out}")
+        logs.append(log_step(tag, out)["text"])
 
     # Pair (while scanning) to avoid "Device not available"
-    _start_persistent_scan()
-    logstep("scan-on")
-    _persistent_write(["pairable on", f"pair {mac}"])
-    time.sleep(1.0)
-    info = wait_info(mac, "paired", True, tries=12, delay=0.5)
+    with scan_held("pair"):
+        _start_persistent_scan()
+        logstep("scan-on")
+        _persistent_write(["pairable on", f"pair {mac}"])
+        time.sleep(1.0)
+        info = wait_info(mac, "paired", True, tries=12, delay=0.5)
     if not info.get("paired"):
-        raw = clean_for_js("\n".join(logs))
+        raw = "\n".join(logs)
+        single_flight_invalidate()
         return jsonify({"ok": False, "stage": "pair", "info": info, "log": raw}), 500
     logstep("pair-ok")
 
-    # Stop scanning
-    _stop_persistent_scan()
-    logstep("scan-off")
+    # Stop discovery while trusting/connecting. A wanted scan is only paused and
+    # resumes afterwards; a scanner started just for pairing is shut down.
+    with scan_paused("connect"):
+        if not SCAN_STATE.get("wanted"):
+            _stop_persistent_scan()
+        logstep("scan-off")
 
-    # Trust only if needed
-    info = get_info(mac)
-    if not info.get("trusted"):
-        rc, out, err = run_bctl([f"trust {mac}"])
-        logstep("trust", out + err)
-        info = wait_info(mac, "trusted", True, tries=6, delay=0.4)
-    else:
-        logstep("trust-skip", "device is already trusted")
+        # Trust only if needed
+        info = get_info(mac)
+        if not info.get("trusted"):
+            rc, out, err = run_bctl([f"trust {mac}"])
+            logstep("trust", out + err)
+            info = wait_info(mac, "trusted", True, tries=6, delay=0.4)
+        else:
+            logstep("trust-skip", "device is already trusted")
 
-    # Connect (hold session open like interactive bluetoothctl)
-    connected = False
-    for attempt in range(1, 3):  # up to 2 tries
-        ok, live_out = bctl_connect_wait(mac, wait_s=8)
-        logstep(f"connect (held session, try {attempt})", live_out)
-        info = wait_info(mac, "connected", True, tries=8, delay=0.5)
-        if ok or info.get("connected"):
-            connected = True
-            break
-        # nudge before retry
-        rc2, out2, err2 = run_bctl([f"disconnect {mac}"])
-        logstep(f"disconnect-before-retry {attempt}", out2 + err2)
-        time.sleep(0.8)
+        # Connect (hold session open like interactive bluetoothctl)
+        connected = False
+        for attempt in range(1, 3):  # up to 2 tries
+            ok, live_out = bctl_connect_wait(mac, wait_s=8)
+            logstep(f"connect (held session, try {attempt})", live_out)
+            info = wait_info(mac, "connected", True, tries=8, delay=0.5)
+            if ok or info.get("connected"):
+                connected = True
+                break
+            # nudge before retry
+            rc2, out2, err2 = run_bctl([f"disconnect {mac}"])
+            logstep(f"disconnect-before-retry {attempt}", out2 + err2)
+            time.sleep(0.8)
 
-    raw = clean_for_js("\n".join(logs))
+    raw = "\n".join(logs)
+    single_flight_invalidate()
     return jsonify({"ok": connected, "info": info, "log": raw})
 
 @app.post("/api/disconnect")
+@interactive
 def api_disconnect():
     mac = request.json.get("mac","")
     rc, out, err = run_bctl([f"disconnect {mac}"])
     info = wait_info(mac, "connected", False, tries=6, delay=0.4)
     txt = f"\x1b[1m== disconnect\x1b[0m\n{out}{err}"
-    return jsonify({"ok": not info.get("connected", False), "info": info, "log": clean_for_js(txt)})
+    single_flight_invalidate()
+    return jsonify({"ok": not info.get("connected", False), "info": info, "log": log_append(txt)["text"]})
 
 @app.post("/api/test_audio")
 def api_test_audio():
@@ -455,29 +2076,31 @@ def api_test_audio():
         mac = os.environ.get("TEST_AUDIO_MAC")
     if not mac:
         txt = "no device mac supplied"
-        return jsonify({"ok": False, "log": clean_for_js(txt)}), 400
+        return jsonify({"ok": False, "log": log_append(txt)["text"]}), 400
     try:
         cmd = ["aplay", "-D", f"bluealsa:DEV={mac},PROFILE=a2dp", audio_file]
-        p = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            timeout=10,
-        )
+        with scan_paused("audio-test"):
+            p = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+            )
         txt = f"\x1b[1m== test-audio\x1b[0m\n{p.stdout.decode(errors='ignore')}"
         if p.returncode != 0:
-            return jsonify({"ok": False, "log": clean_for_js(txt)}), 500
-        return jsonify({"ok": True, "log": clean_for_js(txt)})
+            return jsonify({"ok": False, "log": log_append(txt)["text"]}), 500
+        return jsonify({"ok": True, "log": log_append(txt)["text"]})
     except FileNotFoundError as e:
         txt = f"aplay not found: {e}"
-        return jsonify({"ok": False, "log": clean_for_js(txt)}), 500
+        return jsonify({"ok": False, "log": log_append(txt)["text"]}), 500
     except subprocess.TimeoutExpired as e:
         txt = f"test audio timeout: {e}"
-        return jsonify({"ok": False, "log": clean_for_js(txt)}), 500
+        return jsonify({"ok": False, "log": log_append(txt)["text"]}), 500
     except Exception as e:
-        return jsonify({"ok": False, "log": clean_for_js(str(e))}), 500
+        return jsonify({"ok": False, "log": log_append(str(e))["text"]}), 500
 
 @app.post("/api/forget")
+@interactive
 def api_forget():
     mac = request.json.get("mac","")
     info = get_info(mac)
@@ -485,8 +2108,9 @@ def api_forget():
         run_bctl([f"disconnect {mac}"]); time.sleep(0.2)
     rc, out, err = run_bctl([f"remove {mac}"])
     txt = f"\x1b[1m== remove\x1b[0m\n{out}{err}"
+    single_flight_invalidate()
     # Best-effort result; devices list will reflect reality
-    return jsonify({"ok": True, "log": clean_for_js(txt)})
+    return jsonify({"ok": True, "log": log_append(txt)["text"]})
 
 @app.post("/github-webhook")
 def github_webhook():
@@ -509,33 +2133,65 @@ def github_webhook():
     if event == "push":
         script = os.environ.get("GITHUB_WEBHOOK_SCRIPT", DEFAULT_WEBHOOK_SCRIPT)
         try:
-            result = subprocess.run(
-                ["bash", script], capture_output=True, text=True
-            )
-            if hasattr(app, "logger"):
-                app.logger.info("Webhook script exited %s", result.returncode)
-            payload = {
-                "ok": result.returncode == 0,
-                "stdout": result.stdout,
-                "stderr": result.stderr,
-            }
-            return jsonify(payload), 200
+            rec, coalesced = enqueue_deploy(script)
         except Exception as exc:
             if hasattr(app, "logger"):
-                app.logger.exception("Webhook script failed")
+                app.logger.exception("Webhook deploy could not be queued")
             return jsonify({"ok": False, "error": str(exc)}), 500
+        if hasattr(app, "logger"):
+            app.logger.info("Deploy %s queued (coalesced=%s)", rec["id"], coalesced)
+        payload = {
+            "ok": True,
+            "deploy_id": rec["id"],
+            "coalesced": coalesced,
+            "status_url": f"/api/deploys/{rec['id']}",
+        }
+        return jsonify(payload), 202
     return jsonify({"ok": True})
 
+@app.get("/api/deploys/<deploy_id>")
+def api_deploy_status(deploy_id):
+    rec = DEPLOYS.get(deploy_id)
+    if not rec:
+        return jsonify({"ok": False, "error": "unknown deploy"}), 404
+    return jsonify({"ok": True, **{k: v for k, v in rec.items() if k != "script"}})
+
+@app.get("/assets/<path:path>")
+def static_asset(path):
+    if ASSETS["by_name"] is None:
+        build_assets()
+    entry = ASSETS["by_path"].get(path)
+    if not entry:
+        return jsonify({"ok": False, "error": "unknown asset"}), 404
+    _asset_variants(entry)
+    return _encoded_response(entry, entry["mimetype"], entry["etag"], ASSET_CACHE_CONTROL)
+
 @app.get("/")
 def index():
-    version = "unknown"
-    try:
-        with open(os.path.join(os.path.dirname(__file__), "..", "VERSION")) as f:
-            version = f.read().strip()
-    except Exception:
-        pass
-    return render_template("index.html", version=version)
+    note_client()
+    if INDEX_CACHE["html"] is None:
+        html = render_template("index.html", version=_read_version(), asset_url=asset_url)
+        body = html.encode()
+        INDEX_CACHE["html"] = body
+        INDEX_CACHE["gzip"] = gzip.compress(body, 9, mtime=0)
+        INDEX_CACHE["etag"] = hashlib.sha256(body).hexdigest()[:12]
+    variants = {"identity": INDEX_CACHE["html"], "gzip": INDEX_CACHE["gzip"]}
+    # Revalidate so a deploy shows up on the next load
+    return _encoded_response(variants, "text/html", INDEX_CACHE["etag"], "no-cache")
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8080"))
-    app.run(host="0.0.0.0", port=port)
+    capture_start(os.environ.get("BT_WEB_CAPTURE"))
+    build_assets()
+    if load_deploys() and DEPLOY_QUEUE["pending"]:
+        _ensure_deploy_worker()
+    if load_state() and SCAN_STATE.get("wanted"):
+        try:
+            # Give clients of the previous process time to reconnect
+            note_client()
+            _start_persistent_scan()
+            _ensure_scan_scheduler()
+        except Exception:
+            SCAN_STATE["wanted"] = False
+            SCAN_STATE["start_ts"] = 0
+    serve(port)
@@ -14,25 +14,75 @@ const countEl      = document.getElementById('count');
 const logBox       = document.getElementById('logBox');
 const audioOnlyChk = document.getElementById('audioOnly');
 const testAudioBtn = document.getElementById('testAudioBtn');
+const searchInput  = document.getElementById('deviceSearch');
+const sortSelect   = document.getElementById('deviceSort');
 
 // --- ANSI renderer (client-side) ---
 if (window.APP_VERSION) {
   console.debug('App version:', window.APP_VERSION);
 }
-const ansi = new AnsiToHtml();          // from CDN in index.html
+// Log text holds device names and bluetoothctl output and is inserted as HTML
+const ansi = new AnsiToHtml({ escapeXML: true });  // static/ansi-to-html.min.js
 let lastLogRaw = "";                    // plain text for "Copy" button
+let logCursor = 0;                      // last /api/logs entry seen
+let logBoot = '';                       // server process the cursor belongs to
+let logFetching = false;
 
-function showLogRAW(raw) {
-  lastLogRaw = raw || "";
-  logBox.innerHTML = ansi.toHtml(lastLogRaw);
+function clearLog() {
+  lastLogRaw = "";
+  logBox.innerHTML = "";
+}
+
+function appendLog(raw) {
+  if (!raw) return;
+  lastLogRaw += raw;
+  logBox.insertAdjacentHTML('beforeend', ansi.toHtml(raw));
   logBox.scrollTop = logBox.scrollHeight; // autoscroll
 }
 
+// Pull only the operation log entries added since the last fetch.
+async function fetchLogs() {
+  if (logFetching) return;
+  logFetching = true;
+  try {
+    const res = await fetch('/api/logs?cursor=' + logCursor + '&boot=' + logBoot);
+    const data = await res.json();
+    if (data.reset) clearLog();
+    const entries = data.entries || [];
+    if (entries.length) appendLog(entries.map(e => e.text).join('\n') + '\n');
+    logCursor = data.cursor ?? logCursor;
+    logBoot = data.boot ?? logBoot;
+  } finally {
+    logFetching = false;
+  }
+}
+
+// Stream log entries while a long-running operation is in flight.
+async function withLogStream(work) {
+  const timer = setInterval(() => fetchLogs().catch(() => {}), 1000);
+  try {
+    return await work();
+  } finally {
+    clearInterval(timer);
+    await fetchLogs().catch(() => {});
+  }
+}
+
 // --- State ---
 let devices = [];
 let selectedMac = "";
 let polling = null;
+let pollTicks = 0;
 let audioOnly = true;
+let devicesFetchedAt = 0;
+let devicesTotal = 0;
+let searchTimer = null;
+const STATUS_MAX_AGE_MS = 5000;          // trust list status for this long
+const SCAN_UI_EVERY = 4;                 // re-check scan state every N polls
+const DEVICE_PAGE = 100;                 // rows per /api/devices request
+// Only the keys the list and status badges use; the rest stays on the server
+const DEVICE_FIELDS = 'mac,name,alias,identity,paired,trusted,connected';
+const INFO_FIELDS = 'alias,identity,paired,trusted,connected';
 
 // --- Helpers ---
 function badge(label, ok, yes='Yes', no='No') {
@@ -59,67 +109,132 @@ function renderStatus(info) {
   testAudioBtn.disabled  = !info.connected || !selectedMac;
 }
 
+function escapeHtml(s) {
+  return String(s).replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+}
+
+// Rows keyed by MAC; only rows whose content changed are rewritten.
+const rowByMac = new Map();
+let emptyRow = null;
+
+function rowSignature(d) {
+  return [d.alias || d.name || "", d.mac, d.identity || "", !!d.connected, !!d.paired, !!d.trusted].join('|');
+}
+
+function fillRow(item, d) {
+  const alias = d.alias || d.name || "(unknown)";
+  const identityLink = d.identity && d.identity !== d.mac
+    ? `<a href="#" class="ms-2 small identity-link" data-mac="${escapeHtml(d.identity)}">→ ${escapeHtml(d.identity)}</a>`
+    : "";
+  item.innerHTML = `
+    <div>
+      <div class="fw-semibold">${escapeHtml(alias)}</div>
+      <div class="badge text-bg-secondary rounded-pill mac">${escapeHtml(d.mac)}</div>${identityLink}
+    </div>
+    <div>${deviceStateBadge(d)}</div>
+  `;
+}
+
 function renderList() {
-  deviceList.innerHTML = "";
-  countEl.textContent = devices.length;
+  countEl.textContent = devicesTotal > devices.length
+    ? `${devices.length} of ${devicesTotal}` : devices.length;
+  if (!selectedMac && devices[0]) selectedMac = devices[0].mac;
 
+  const seen = new Set();
+  let prev = null;
   devices.forEach(d => {
-    const alias = d.alias || d.name || "(unknown)";
-    const identityLink = d.identity && d.identity !== d.mac
-      ? `<a href="#" class="ms-2 small identity-link" data-mac="${d.identity}">→ ${d.identity}</a>`
-      : "";
-    const item = document.createElement('button');
-    item.type = "button";
-    item.className = "list-group-item list-group-item-action d-flex justify-content-between align-items-center";
-    item.innerHTML = `
-      <div>
-        <div class="fw-semibold">${alias}</div>
-        <div class="badge text-bg-secondary rounded-pill mac">${d.mac}</div>${identityLink}
-      </div>
-      <div>${deviceStateBadge(d)}</div>
-    `;
-    if (d.mac === selectedMac) item.classList.add('active');
-    item.addEventListener('click', async () => {
-      selectedMac = d.mac;
-      renderList();
-      await refreshDeviceInfo();
-    });
-    deviceList.appendChild(item);
-
-    if (identityLink) {
-      const link = item.querySelector('.identity-link');
-      link.addEventListener('click', async (e) => {
-        e.preventDefault();
-        e.stopPropagation();
-        selectedMac = link.getAttribute('data-mac');
-        renderList();
-        await refreshDeviceInfo();
-      });
+    seen.add(d.mac);
+    let item = rowByMac.get(d.mac);
+    if (!item) {
+      item = document.createElement('button');
+      item.type = "button";
+      item.className = "list-group-item list-group-item-action d-flex justify-content-between align-items-center";
+      item.dataset.mac = d.mac;
+      rowByMac.set(d.mac, item);
     }
+    const sig = rowSignature(d);
+    if (item.dataset.sig !== sig) {
+      fillRow(item, d);
+      item.dataset.sig = sig;
+    }
+    item.classList.toggle('active', d.mac === selectedMac);
+    // Move only rows that are out of place
+    const want = prev ? prev.nextSibling : deviceList.firstChild;
+    if (want !== item) deviceList.insertBefore(item, want);
+    prev = item;
   });
 
+  for (const [mac, item] of rowByMac) {
+    if (!seen.has(mac)) { item.remove(); rowByMac.delete(mac); }
+  }
+
   if (devices.length === 0) {
-    const empty = document.createElement('div');
-    empty.className = "list-group-item text-secondary";
-    empty.textContent = "No devices yet. Turn scan on and put your speaker in pairing mode.";
-    deviceList.appendChild(empty);
+    if (!emptyRow) {
+      emptyRow = document.createElement('div');
+      emptyRow.className = "list-group-item text-secondary";
+      emptyRow.textContent = "No devices yet. Turn scan on and put your speaker in pairing mode.";
+    }
+    if (!emptyRow.isConnected) deviceList.appendChild(emptyRow);
+  } else if (emptyRow?.isConnected) {
+    emptyRow.remove();
   }
+}
 
-  if (!selectedMac && devices[0]) selectedMac = devices[0].mac;
+async function selectDevice(mac) {
+  selectedMac = mac;
+  renderList();
+  await syncStatus();
 }
 
+// One listener for every row and identity link.
+deviceList.addEventListener('click', async (e) => {
+  const link = e.target.closest('.identity-link');
+  if (link) {
+    e.preventDefault();
+    await selectDevice(link.getAttribute('data-mac'));
+    return;
+  }
+  const item = e.target.closest('[data-mac]');
+  if (item && deviceList.contains(item)) await selectDevice(item.dataset.mac);
+});
+
 // --- API calls ---
 async function fetchDevices() {
-  const res = await fetch('/api/devices?audio_only=' + (audioOnly ? '1' : '0'));
+  const params = new URLSearchParams({
+    audio_only: audioOnly ? '1' : '0',
+    sort: sortSelect?.value || 'connected',
+    limit: DEVICE_PAGE,
+    fields: DEVICE_FIELDS,
+    format: 'rows',
+  });
+  const q = searchInput?.value.trim();
+  if (q) params.set('q', q);
+  const res = await fetch('/api/devices?' + params);
+  if (res.status === 503) return;         // bluetoothctl busy: keep the current list
   const data = await res.json();
-  devices = data.devices || [];
+  const fields = data.fields || [];
+  devices = (data.rows || []).map(row => Object.fromEntries(fields.map((f, i) => [f, row[i]])));
+  devicesTotal = data.total ?? devices.length;
+  devicesFetchedAt = Date.now();
   renderList();
+  await syncStatus();
+}
+
+// The device list already carries paired/trusted/connected; only ask
+// /api/info when the selected device is missing from it or the list is old.
+async function syncStatus() {
+  const d = devices.find(x => x.mac === selectedMac);
+  if (d && Date.now() - devicesFetchedAt < STATUS_MAX_AGE_MS) {
+    renderStatus(d);
+    return;
+  }
   await refreshDeviceInfo();
 }
 
 async function refreshDeviceInfo() {
   if (!selectedMac) { renderStatus(null); return; }
-  const res = await fetch('/api/info?mac=' + encodeURIComponent(selectedMac));
+  const res = await fetch('/api/info?mac=' + encodeURIComponent(selectedMac) + '&fields=' + INFO_FIELDS);
+  if (res.status === 503) return;
   const info = await res.json();
   renderStatus(info);
 
@@ -131,21 +246,39 @@ async function refreshDeviceInfo() {
 }
 
 async function updateScanUI() {
-  const js = await (await fetch('/api/scan_status')).json();
+  const res = await fetch('/api/scan_status');
+  if (res.status === 503) return;
+  const js = await res.json();
   const st = js.status || {};
   const running = !!js.running;
   const on = js.wanted || st.discovering || running;
+  const paused = (js.duty && js.duty.paused) || [];
   scanText.textContent = on ? "Scan Off" : "Scan On";
-  scanMsg.innerHTML = on
-    ? '<span class="spinner-border spinner-border-sm me-1" role="status" aria-hidden="true"></span>Scanning…'
-    : 'Idle';
+  if (!on) {
+    scanMsg.textContent = js.duty && js.duty.auto_stopped ? 'Idle (stopped, no clients)' : 'Idle';
+  } else if (paused.length) {
+    scanMsg.textContent = 'Scan paused (' + paused.join(', ') + ')';
+  } else {
+    scanMsg.innerHTML = '<span class="spinner-border spinner-border-sm me-1" role="status" aria-hidden="true"></span>Scanning…';
+  }
   if (on && !polling) {
-    polling = setInterval(fetchDevices, 2500);
+    polling = setInterval(pollTick, 2500);
   } else if (!on && polling) {
     clearInterval(polling); polling = null;
   }
 }
 
+// Hidden tabs stop polling, so the server can auto-stop an unattended scan.
+async function pollTick() {
+  if (document.hidden) return;
+  await fetchDevices();
+  if (++pollTicks % SCAN_UI_EVERY === 0) await updateScanUI();
+}
+
+document.addEventListener('visibilitychange', () => {
+  if (!document.hidden) updateScanUI().catch(() => {});
+});
+
 // --- Event handlers ---
 scanToggle.addEventListener('click', async () => {
   scanToggle.disabled = true;
@@ -165,16 +298,15 @@ connectBtn.addEventListener('click', async () => {
   if (!selectedMac) return;
   connectBtn.disabled = true;
   try {
-    const res = await fetch('/api/connect', {
+    const res = await withLogStream(() => fetch('/api/connect', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ mac: selectedMac })
-    });
+    }));
     const data = await res.json();
-    showLogRAW(data.log || "");
     if (!data.ok) alert("Connect failed" + (data.stage ? ` (stage: ${data.stage})` : ""));
   } catch (e) {
-    showLogRAW(String(e));
+    appendLog(String(e) + "\n");
     alert("Connect failed");
   }
   await refreshDeviceInfo();
@@ -184,16 +316,15 @@ disconnectBtn.addEventListener('click', async () => {
   if (!selectedMac) return;
   disconnectBtn.disabled = true;
   try {
-    const res = await fetch('/api/disconnect', {
+    const res = await withLogStream(() => fetch('/api/disconnect', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ mac: selectedMac })
-    });
+    }));
     const data = await res.json();
-    showLogRAW(data.log || "");
     if (!data.ok) alert("Disconnect may not have completed");
   } catch (e) {
-    showLogRAW(String(e));
+    appendLog(String(e) + "\n");
     alert("Disconnect failed");
   }
   await refreshDeviceInfo();
@@ -204,16 +335,15 @@ forgetBtn.addEventListener('click', async () => {
   if (!confirm("Forget this device? This will unpair and remove it.")) return;
   forgetBtn.disabled = true;
   try {
-    const res = await fetch('/api/forget', {
+    const res = await withLogStream(() => fetch('/api/forget', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ mac: selectedMac })
-    });
+    }));
     const data = await res.json();
-    showLogRAW(data.log || "");
     if (!data.ok) alert("Forget may not have completed");
   } catch (e) {
-    showLogRAW(String(e));
+    appendLog(String(e) + "\n");
     alert("Forget failed");
   }
   await fetchDevices();
@@ -225,16 +355,15 @@ forgetBtn.addEventListener('click', async () => {
 testAudioBtn.addEventListener('click', async () => {
   testAudioBtn.disabled = true;
   try {
-    const res = await fetch('/api/test_audio', {
+    const res = await withLogStream(() => fetch('/api/test_audio', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ mac: selectedMac })
-    });
+    }));
     const data = await res.json();
-    showLogRAW(data.log || "");
     if (!data.ok) alert('Test audio failed');
   } catch (e) {
-    showLogRAW(String(e));
+    appendLog(String(e) + "\n");
     alert('Test audio failed');
   }
   testAudioBtn.disabled = false;
@@ -254,8 +383,14 @@ audioOnlyChk.addEventListener('change', async () => {
   await fetchDevices();
 });
 
+sortSelect?.addEventListener('change', () => fetchDevices().catch(() => {}));
+searchInput?.addEventListener('input', () => {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(() => fetchDevices().catch(() => {}), 250);
+});
+
 // Copy / Clear log
-clearLogBtn?.addEventListener('click', () => showLogRAW(""));
+clearLogBtn?.addEventListener('click', clearLog);
 copyLogBtn?.addEventListener('click', async () => {
   try {
     if (navigator.clipboard?.writeText) {
@@ -283,7 +418,8 @@ copyLogBtn?.addEventListener('click', async () => {
   try {
     await updateScanUI();
     await fetchDevices();
+    await fetchLogs();
   } catch (e) {
-    showLogRAW(String(e));
+    appendLog(String(e) + "\n");
   }
 })();